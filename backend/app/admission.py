@@ -0,0 +1,199 @@
+import asyncio
+import json
+import math
+import os
+import time
+from jose import JWTError, jwt
+from .auth import SECRET_KEY, ALGORITHM
+
+# Admission control and load shedding.
+#
+# Every request is put in a route class (see classify()) before it is routed, so a rejected request
+# never opens a DB session or takes a thread. Each class has:
+#   concurrency  requests of this class in flight at once (per worker process)
+#   share        fraction of the worker's total in-flight budget (MAX_IN_FLIGHT) the class may use;
+#                trades may use all of it, bulk requests only half, so trades still get in when reads pile up
+#   queue        seconds a request may wait for a free slot before being shed (0 = reject at once)
+#   rate, burst  token bucket per user (from a valid access token) or per client IP
+#
+# Over a rate limit -> 429, over capacity -> 503, both with Retry-After.
+# ADMISSION_CONFIG (JSON) overrides the defaults, e.g. '{"bulk": {"concurrency": 4}}'.
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+# Behind a reverse proxy the client address is the first X-Forwarded-For entry.
+TRUST_FORWARDED_FOR = os.getenv("ADMISSION_TRUST_FORWARDED_FOR", "false").lower() == "true"
+BUCKET_IDLE_SECONDS = 600
+
+ROUTE_CLASSES = {
+    "trade":     {"concurrency": 32, "share": 1.0, "queue": 2.0, "rate": 5.0, "burst": 20},
+    "auth":      {"concurrency": 8, "share": 0.3, "queue": 0.0, "rate": 1.0, "burst": 20},
+    "read":      {"concurrency": 32, "share": 0.8, "queue": 0.0, "rate": 20.0, "burst": 60},
+    "bulk":      {"concurrency": 8, "share": 0.5, "queue": 0.0, "rate": 2.0, "burst": 10},
+    "admin":     {"concurrency": 2, "share": 0.2, "queue": 0.0, "rate": 1.0, "burst": 5},
+}
+for name, overrides in json.loads(os.getenv("ADMISSION_CONFIG", "{}")).items():
+    ROUTE_CLASSES.setdefault(name, dict(ROUTE_CLASSES["read"])).update(overrides)
+
+# Paths served without admission control (health check, docs, CORS preflight is handled separately).
+EXEMPT_PATHS = {"/", "/docs", "/openapi.json", "/redoc", "/admission/stats"}
+# The full board, exports and imports. Not /market/stocks/{code}.
+BULK_PATHS = ("/market/stocks", "/portfolio/transactions/export", "/portfolio/transactions/import")
+
+def classify(method: str, path: str):
+    if path in ("/token", "/register", "/refresh", "/logout"):
+        return "auth"
+    if path.startswith("/jobs") or path == "/market/scrape":
+        return "admin"
+    if path.rstrip("/") in BULK_PATHS or path.endswith("/history"):
+        return "bulk"
+    if method in ("POST", "PUT", "PATCH", "DELETE") and path != "/portfolio/simulate":
+        return "trade" # transactions, watchlist and alert changes
+    return "read"
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, rate, burst):
+        # Returns 0 if a token was taken, otherwise the seconds until one is available.
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+class RouteClass:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.in_flight = 0
+        self.buckets = {} # client key -> TokenBucket
+        self.waiters = [] # futures of queued requests, woken when a slot frees up
+        self.counts = {"admitted": 0, "rejected_rate": 0, "rejected_capacity": 0}
+
+    def stats(self):
+        return {**self.config, **self.counts, "in_flight": self.in_flight, "waiting": len(self.waiters),
+                "tracked_clients": len(self.buckets)}
+
+class Limiter:
+    # Shared by the middleware and the stats endpoint. Only touched from the event loop, so no lock.
+    def __init__(self):
+        self.classes = {name: RouteClass(name, config) for name, config in ROUTE_CLASSES.items()}
+        self.in_flight = 0
+        self.pruned_at = time.monotonic()
+
+    def client_key(self, scope, headers):
+        # The user id from a valid access token, otherwise the client IP.
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization.lower().startswith("bearer "):
+            try:
+                payload = jwt.decode(authorization[7:], SECRET_KEY, algorithms=[ALGORITHM])
+                if payload.get("sub"):
+                    return "user:" + payload["sub"]
+            except JWTError:
+                pass
+        if TRUST_FORWARDED_FOR and b"x-forwarded-for" in headers:
+            return "ip:" + headers[b"x-forwarded-for"].decode("latin-1").split(",")[0].strip()
+        return "ip:" + (scope["client"][0] if scope.get("client") else "unknown")
+
+    def _has_capacity(self, route_class):
+        config = route_class.config
+        return route_class.in_flight < config["concurrency"] \
+            and self.in_flight < max(1, int(MAX_IN_FLIGHT * config["share"]))
+
+    def take_token(self, route_class, key):
+        # Returns 0 if the request is within its rate, otherwise the seconds until it would be.
+        config = route_class.config
+        bucket = route_class.buckets.get(key)
+        if bucket is None:
+            bucket = route_class.buckets[key] = TokenBucket(config["burst"])
+        self._prune()
+        return bucket.take(config["rate"], config["burst"])
+
+    async def acquire(self, route_class):
+        # Wait up to the class's queue time for a slot. Returns False if none became free.
+        deadline = time.monotonic() + route_class.config["queue"]
+        while not self._has_capacity(route_class):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            waiter = asyncio.get_running_loop().create_future()
+            route_class.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in route_class.waiters:
+                    route_class.waiters.remove(waiter)
+        route_class.in_flight += 1
+        self.in_flight += 1
+        return True
+
+    def release(self, route_class):
+        route_class.in_flight -= 1
+        self.in_flight -= 1
+        # A finished request frees global budget too, so wake the queued requests of every class,
+        # highest share first; those that still don't fit go back to waiting.
+        for other in sorted(self.classes.values(), key=lambda c: -c.config["share"]):
+            for waiter in other.waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _prune(self):
+        # Forget clients that have been idle long enough for their bucket to be full again.
+        now = time.monotonic()
+        if now - self.pruned_at < BUCKET_IDLE_SECONDS:
+            return
+        self.pruned_at = now
+        for route_class in self.classes.values():
+            route_class.buckets = {k: b for k, b in route_class.buckets.items() if now - b.updated < BUCKET_IDLE_SECONDS}
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": MAX_IN_FLIGHT,
+            "classes": {name: route_class.stats() for name, route_class in self.classes.items()},
+        }
+
+# Per-process limiter; the counters in /admission/stats are for the worker that answered.
+limiter = Limiter()
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def _reject(self, send, status, retry_after, detail):
+        body = json.dumps({"detail": detail}).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in EXEMPT_PATHS:
+            return await self.app(scope, receive, send)
+
+        route_class = limiter.classes[classify(scope["method"], scope["path"])]
+        wait = limiter.take_token(route_class, limiter.client_key(scope, dict(scope["headers"])))
+        if wait:
+            route_class.counts["rejected_rate"] += 1
+            return await self._reject(send, 429, wait, "Too many requests")
+
+        if not await limiter.acquire(route_class):
+            route_class.counts["rejected_capacity"] += 1
+            return await self._reject(send, 503, 1, "Server busy, please retry")
+
+        route_class.counts["admitted"] += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(route_class)
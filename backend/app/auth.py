@@ -2,11 +2,13 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.orm import Session
 from . import models, schemas, database
+import hmac
 import os
+import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,6 +18,9 @@ REFRESH_SECRET_KEY = os.getenv("REFRESH_SECRET_KEY", "fallback_refresh_secret")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Operator credential for admin-only endpoints (job queue, index definitions), sent as the
+# X-Admin-Token header. Without ADMIN_TOKEN set, those endpoints are closed to everyone.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
@@ -36,13 +41,15 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None, family_id: Optional[str] = None):
+    # Every refresh token gets a unique id (jti) and belongs to a family: the chain of tokens
+    # rotated from one login. Revocation works per token or per family (services/revocation.py).
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex, "fam": family_id or uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -64,3 +71,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     if user is None:
         raise credentials_exception
     return user
+
+def is_admin(x_admin_token: Optional[str] = Header(None)):
+    return bool(ADMIN_TOKEN) and x_admin_token is not None \
+        and hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(admin: bool = Depends(is_admin)):
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin token required")
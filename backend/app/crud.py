@@ -1,5 +1,8 @@
+from sqlalchemy import insert, update, tuple_, func, case, and_, or_
+import os
 from sqlalchemy.orm import Session
 from . import models, schemas
+from .services import search
 from datetime import datetime
 
 # CRUD: Create, Read, Update, Delete.
@@ -11,14 +14,17 @@ def get_stock(db: Session, stock_id: int):
     # .first() executes the query and returns the first result or None.
     return db.query(models.Stock).filter(models.Stock.id == stock_id).first()
 
-def get_stock_by_code(db: Session, trading_code: str):
-    return db.query(models.Stock).filter(models.Stock.trading_code == trading_code).first()
+def get_stock_by_code(db: Session, trading_code: str, options=None):
+    # options: optional loader options (eager loading / column projection), see app/projection.py
+    return db.query(models.Stock).options(*(options or []))\
+        .filter(models.Stock.trading_code == trading_code).first()
 
-def get_stocks(db: Session, skip: int = 0, limit: int = 100):
+def get_stocks(db: Session, skip: int = 0, limit: int = 100, options=None):
     # .offset(skip) skips the first N results (pagination).
     # .limit(limit) restricts the number of results.
     # .all() returns a list of results.
-    return db.query(models.Stock).offset(skip).limit(limit).all()
+    return db.query(models.Stock).options(*(options or []))\
+        .order_by(models.Stock.id).offset(skip).limit(limit).all()
 
 def create_stock(db: Session, stock: schemas.StockCreate):
     # Create a new instance of the ORM model using data from the schema.
@@ -33,6 +39,9 @@ def create_stock(db: Session, stock: schemas.StockCreate):
     
     # Refresh the instance to get generated fields (like ID) from the DB.
     db.refresh(db_stock)
+
+    # New listing: rebuild the in-memory search index on next use.
+    search.invalidate()
     return db_stock
 
 def get_transactions(
@@ -41,7 +50,8 @@ def get_transactions(
     start_date: datetime = None, 
     end_date: datetime = None, 
     skip: int = 0, 
-    limit: int = 100
+    limit: int = 100,
+    before: tuple = None
 ):
     query = db.query(models.Transaction).filter(models.Transaction.user_id == user_id)
     
@@ -49,8 +59,33 @@ def get_transactions(
         query = query.filter(models.Transaction.date >= start_date)
     if end_date:
         query = query.filter(models.Transaction.date <= end_date)
+
+    # Keyset pagination: 'before' is the (date, id) of the last row of the previous page.
+    # Unlike OFFSET, the database seeks straight to that position using the (user_id, date, id) index.
+    # Rows without a date come first (Postgres' default for DESC), so after one of them the next
+    # page is the rest of the undated rows, then every dated one.
+    if before:
+        before_date, before_id = before
+        if before_date is None:
+            query = query.filter(or_(models.Transaction.date.isnot(None), models.Transaction.id < before_id))
+        else:
+            query = query.filter(tuple_(models.Transaction.date, models.Transaction.id) < tuple(before))
         
-    return query.order_by(models.Transaction.date.desc()).offset(skip).limit(limit).all()
+    return query.order_by(models.Transaction.date.desc().nulls_first(), models.Transaction.id.desc())\
+        .offset(skip).limit(limit).all()
+
+def get_transaction_export_query(db: Session, user_id: int):
+    # Flat rows (no ORM objects) for streaming exports, oldest first.
+    return db.query(
+        models.Transaction.id,
+        models.Transaction.date,
+        models.Stock.trading_code,
+        models.Transaction.type,
+        models.Transaction.quantity,
+        models.Transaction.price,
+    ).join(models.Stock, models.Stock.id == models.Transaction.stock_id)\
+        .filter(models.Transaction.user_id == user_id)\
+        .order_by(models.Transaction.date, models.Transaction.id)
 
 def create_transaction(db: Session, transaction: schemas.TransactionCreate):
     db_transaction = models.Transaction(**transaction.dict())
@@ -59,6 +94,107 @@ def create_transaction(db: Session, transaction: schemas.TransactionCreate):
     db.refresh(db_transaction)
     return db_transaction
 
+def get_stock_ids_by_codes(db: Session, trading_codes):
+    # Resolve many trading codes in one query. Returns {trading_code: stock_id}.
+    if not trading_codes:
+        return {}
+    rows = db.query(models.Stock.trading_code, models.Stock.id)\
+        .filter(models.Stock.trading_code.in_(list(trading_codes))).all()
+    return {code: stock_id for code, stock_id in rows}
+
+def get_transaction_history_for_stocks(db: Session, user_id: int, stock_ids):
+    # Only the columns needed to replay holdings, no ORM objects.
+    if not stock_ids:
+        return []
+    return db.query(
+        models.Transaction.stock_id,
+        models.Transaction.date,
+        models.Transaction.type,
+        models.Transaction.quantity,
+    ).filter(
+        models.Transaction.user_id == user_id,
+        models.Transaction.stock_id.in_(list(stock_ids))
+    ).all()
+
+def bulk_create_transactions(db: Session, rows):
+    # A single multi-row INSERT inside one transaction (all rows are saved or none are).
+    if rows:
+        db.execute(insert(models.Transaction), rows)
+    db.commit()
+    return len(rows)
+
+def get_positions(db: Session, user_id: int):
+    # Current holdings aggregated in SQL: (stock_id, trading_code, quantity, ltp) per held stock.
+    signed_quantity = case(
+        (models.Transaction.type == models.TransactionType.BUY, models.Transaction.quantity),
+        (models.Transaction.type == models.TransactionType.SELL, -models.Transaction.quantity),
+        else_=0 # rows without a type don't move the position
+    )
+    quantity = func.sum(signed_quantity)
+    return db.query(
+        models.Transaction.stock_id,
+        models.Stock.trading_code,
+        quantity.label("quantity"),
+        models.MarketData.ltp,
+    ).join(models.Stock, models.Stock.id == models.Transaction.stock_id)\
+        .outerjoin(models.MarketData, models.MarketData.stock_id == models.Transaction.stock_id)\
+        .filter(models.Transaction.user_id == user_id)\
+        .group_by(models.Transaction.stock_id, models.Stock.trading_code, models.MarketData.ltp)\
+        .having(quantity > 0)\
+        .order_by(models.Stock.trading_code).all()
+
+def replay_cost_basis(transactions):
+    # Running average cost, replayed in trade order: a buy adds its cost, a sell takes its shares
+    # out at the average cost so far, so selling doesn't change the average of what is left.
+    # Returns stock_id -> [quantity, total_cost]. Used by /portfolio/ and the dashboard summary.
+    positions = {}
+    for t in transactions:
+        position = positions.setdefault(t.stock_id, [0.0, 0.0])
+        if t.type == models.TransactionType.BUY:
+            position[0] += t.quantity
+            position[1] += t.quantity * t.price
+        elif t.type == models.TransactionType.SELL:
+            if position[0] > 0:
+                position[1] -= t.quantity * (position[1] / position[0])
+            position[0] -= t.quantity
+    return positions
+
+def get_portfolio_summary(db: Session, user_id: int, top: int = 5):
+    # The largest holdings plus portfolio-wide totals. The cost basis depends on the order of buys
+    # and sells, so it is replayed from the user's transactions (via the (user_id, date, id) index);
+    # prices for the held stocks come in one more query.
+    tx = models.Transaction
+    transactions = db.query(tx.stock_id, tx.type, tx.quantity, tx.price)\
+        .filter(tx.user_id == user_id).order_by(tx.date, tx.id).all()
+    held = {stock_id: p for stock_id, p in replay_cost_basis(transactions).items() if p[0] > 0}
+
+    market = db.query(models.Stock.id, models.Stock.trading_code, models.MarketData.ltp, models.MarketData.change)\
+        .outerjoin(models.MarketData, models.MarketData.stock_id == models.Stock.id)\
+        .filter(models.Stock.id.in_(held)).all() if held else []
+    holdings = []
+    for stock_id, code, ltp, change in market:
+        quantity, total_cost = held[stock_id]
+        holdings.append({
+            "trading_code": code,
+            "quantity": quantity,
+            "average_cost": total_cost / quantity,
+            "cost": total_cost,
+            "ltp": ltp or 0.0,
+            "value": quantity * (ltp or 0.0),
+            "day_change": quantity * (change or 0.0),
+        })
+    holdings.sort(key=lambda h: h["value"], reverse=True)
+    return {
+        "holdings": holdings[:top],
+        "total_value": sum(h["value"] for h in holdings),
+        "total_cost": sum(h["cost"] for h in holdings),
+        "total_day_change": sum(h["day_change"] for h in holdings),
+    }
+
+def count_active_alerts(db: Session, user_id: int):
+    return db.query(func.count(models.Alert.id))\
+        .filter(models.Alert.user_id == user_id, models.Alert.is_active == True).scalar()
+
 def get_watchlist(db: Session):
     return db.query(models.Watchlist).all()
 
@@ -83,6 +219,55 @@ def create_alert(db: Session, alert: schemas.AlertCreate, user_id: int):
     db.refresh(db_alert)
     return db_alert
 
+# Outbox channels every triggered alert is delivered to (see services/notifier.py).
+NOTIFICATION_CHANNELS = [c.strip() for c in os.getenv("NOTIFICATION_CHANNELS", "log").split(",") if c.strip()]
+
+def trigger_alerts(db: Session):
+    # Deactivate every alert whose condition is met by the current price and queue its notifications.
+    # Both happen in one transaction, so an alert can't fire without a notification or twice.
+    triggered = db.execute(
+        update(models.Alert)
+        .where(
+            models.Alert.is_active == True,
+            models.Alert.stock_id == models.MarketData.stock_id,
+            models.Stock.id == models.Alert.stock_id,
+            models.MarketData.ltp > 0, # the scraper stores 0 for stocks that haven't traded today
+            or_(
+                and_(models.Alert.condition == models.AlertCondition.ABOVE, models.MarketData.ltp >= models.Alert.target_price),
+                and_(models.Alert.condition == models.AlertCondition.BELOW, models.MarketData.ltp <= models.Alert.target_price),
+            )
+        )
+        .values(is_active=False)
+        .returning(models.Alert.id, models.Alert.user_id, models.Stock.trading_code,
+                   models.Alert.condition, models.Alert.target_price, models.MarketData.ltp)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+    notifications = [
+        {
+            "user_id": row.user_id,
+            "alert_id": row.id,
+            "channel": channel,
+            "payload": {
+                "alert_id": row.id,
+                "trading_code": row.trading_code,
+                "condition": row.condition.value,
+                "target_price": row.target_price,
+                "ltp": row.ltp,
+            },
+            "status": models.NotificationStatus.PENDING,
+            "attempts": 0,
+            "next_attempt_at": datetime.utcnow(),
+            "created_at": datetime.utcnow(),
+        }
+        for row in triggered if row.user_id is not None
+        for channel in NOTIFICATION_CHANNELS
+    ]
+    if notifications:
+        db.execute(insert(models.Notification), notifications)
+    db.commit()
+    return len(triggered)
+
 def update_market_data(db: Session, stock_id: int, data: dict):
     # Check if market data entry already exists for this stock
     market_data = db.query(models.MarketData).filter(models.MarketData.stock_id == stock_id).first()
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from zoneinfo import ZoneInfo
+from fastapi import Request, Response
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from . import models
+from .services import snapshot
+
+# HTTP conditional caching for the public market endpoints.
+#
+# The validator is the newest of MarketData.updated_at, Fundamental.last_updated and
+# Stock.last_updated (plus the number of stocks, so additions show up too). It only changes when a
+# scrape or import writes, and every writer then publishes a new snapshot version, so each worker
+# recomputes it once per snapshot version. A conditional request that still matches gets a 304
+# before the endpoint's own query runs.
+#
+# Responses may be compressed (see main.py), so the ETag is weak, meaning the same data whatever
+# the encoding, and Vary: Accept-Encoding keeps shared caches from handing one encoding to a client
+# that asked for another.
+
+MARKET_TIMEZONE = ZoneInfo(os.getenv("MARKET_TIMEZONE", "Asia/Dhaka"))
+# DSE trades Sunday to Thursday (Python weekdays: Monday = 0, Sunday = 6).
+TRADING_DAYS = {6, 0, 1, 2, 3}
+MARKET_OPEN = time.fromisoformat(os.getenv("MARKET_OPEN", "10:00"))
+MARKET_CLOSE = time.fromisoformat(os.getenv("MARKET_CLOSE", "14:30"))
+
+# max-age while prices are moving, and after the close when nothing changes until the next session
+# (never past the next open).
+CACHE_SECONDS_OPEN = int(os.getenv("CACHE_SECONDS_OPEN", "15"))
+CACHE_SECONDS_CLOSED = int(os.getenv("CACHE_SECONDS_CLOSED", "3600"))
+
+_lock = threading.Lock()
+_cached = (0, None) # (snapshot version, validator)
+
+def market_is_open(now: datetime = None):
+    local = (now or datetime.now(timezone.utc)).astimezone(MARKET_TIMEZONE)
+    return local.weekday() in TRADING_DAYS and MARKET_OPEN <= local.time() < MARKET_CLOSE
+
+def seconds_until_open(now: datetime = None):
+    local = (now or datetime.now(timezone.utc)).astimezone(MARKET_TIMEZONE)
+    for days in range(8):
+        day = local.date() + timedelta(days=days)
+        opens = datetime.combine(day, MARKET_OPEN, tzinfo=MARKET_TIMEZONE)
+        if day.weekday() in TRADING_DAYS and opens > local:
+            return (opens - local).total_seconds()
+    return float(CACHE_SECONDS_CLOSED) # no trading days configured
+
+def cache_control(now: datetime = None):
+    now = now or datetime.now(timezone.utc)
+    if market_is_open(now):
+        seconds = CACHE_SECONDS_OPEN
+    else:
+        seconds = min(CACHE_SECONDS_CLOSED, int(seconds_until_open(now)))
+    return f"public, max-age={seconds}"
+
+def _query_validator(db: Session):
+    latest_price, latest_fundamental, latest_stock, stock_count = db.query(
+        func.max(models.MarketData.updated_at),
+        func.max(models.Fundamental.last_updated),
+        func.max(models.Stock.last_updated),
+        func.count(models.Stock.id.distinct()),
+    ).select_from(models.Stock)\
+        .outerjoin(models.MarketData, models.MarketData.stock_id == models.Stock.id)\
+        .outerjoin(models.Fundamental, models.Fundamental.stock_id == models.Stock.id).one()
+    timestamps = [t for t in (latest_price, latest_fundamental, latest_stock) if t is not None]
+    return (max(timestamps) if timestamps else datetime(1970, 1, 1)), stock_count
+
+def market_validator(db: Session):
+    # (last modified as naive UTC, stock count). Without a snapshot this is one aggregate query.
+    global _cached
+    version = snapshot.reader.version
+    if version and _cached[0] == version:
+        return _cached[1]
+    validator = _query_validator(db)
+    if version:
+        with _lock:
+            _cached = (version, validator)
+    return validator
+
+def _etag(request: Request, *parts):
+    # The ETag also covers the path and query string, since each page and field selection is a
+    # different representation.
+    query = "&".join(sorted(str(request.query_params).split("&")))
+    validator = "|".join(str(p) for p in parts)
+    digest = hashlib.sha1(f"{validator}|{request.url.path}?{query}".encode())
+    return f'W/"{digest.hexdigest()[:20]}"'
+
+def market_headers(request: Request, db: Session):
+    # ETag, Last-Modified and Cache-Control for a market response.
+    last_modified, stock_count = market_validator(db)
+    return {
+        "ETag": _etag(request, last_modified.isoformat(), stock_count),
+        "Last-Modified": format_datetime(last_modified.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True),
+        "Cache-Control": cache_control(),
+        "Vary": "Accept-Encoding",
+    }
+
+def history_headers(request: Request, db: Session, stock_id: int, start: date, end: date):
+    # ETag and Cache-Control for /market/stocks/{code}/history. Not the board validator: a history
+    # backfill adds bars without touching market data or fundamentals. The number of bars in the range
+    # and the last bar's date change when bars are added; today's bar is rewritten in place by every
+    # scrape, so a range reaching today also covers the stock's market data update time. Bars carry
+    # no timestamps, so there is no Last-Modified (clients revalidate with the ETag).
+    bar_count, last_day = db.query(func.count(), func.max(models.StockPrice.date))\
+        .filter(models.StockPrice.stock_id == stock_id,
+                models.StockPrice.date >= start, models.StockPrice.date <= end).one()
+    updated_at = None
+    if end >= min(date.today(), datetime.utcnow().date()): # the scraper dates bars in UTC
+        updated_at = db.query(models.MarketData.updated_at)\
+            .filter(models.MarketData.stock_id == stock_id).scalar()
+    return {
+        "ETag": _etag(request, bar_count, last_day, updated_at),
+        "Cache-Control": cache_control(),
+        "Vary": "Accept-Encoding",
+    }
+
+def is_not_modified(request: Request, headers: dict):
+    # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2), compared weakly.
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return headers["ETag"].removeprefix("W/") in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and "Last-Modified" in headers:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return parsedate_to_datetime(headers["Last-Modified"]) <= since
+    return False
+
+def not_modified_response(headers: dict):
+    return Response(status_code=304, headers=headers)
@@ -1,16 +1,38 @@
-from fastapi import FastAPI, Depends, BackgroundTasks
+import time
+from fastapi import FastAPI, Depends, BackgroundTasks, Request
 from sqlalchemy.orm import Session
-from . import models, database
-from .routers import market, portfolio, auth, alerts
+from . import models, database, profiling, slow_queries, admission, auth as auth_utils
+from .routers import market, portfolio, auth, alerts, dashboard, jobs
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+
+# Brotli is optional: without the brotli-asgi package we fall back to gzip only.
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
+
+# Responses smaller than this are sent uncompressed (compression would not pay off).
+COMPRESSION_MINIMUM_SIZE = 1000
 
 # Create all database tables defined in models.py
 # This is a simple way to initialize the DB. In production, use Alembic migrations.
 models.Base.metadata.create_all(bind=database.engine)
 
+# Slow query log (off unless SLOW_QUERY_MS is set, see app/slow_queries.py).
+if slow_queries.SLOW_QUERY_MS:
+    for engine in [database.engine] + [replica.engine for replica in database.replica_router.replicas]:
+        slow_queries.install(engine)
+
 # Initialize the FastAPI application
 app = FastAPI(title="Stock Manager")
 
+# Admission control: per route class concurrency limits and per user/IP rate limits, checked before
+# a request reaches a route (so before it opens a DB session). See app/admission.py.
+# Added before CORS so that 429/503 responses still carry the CORS headers the browser needs.
+if admission.ADMISSION_ENABLED:
+    app.add_middleware(admission.AdmissionMiddleware)
+
 # Configure CORS (Cross-Origin Resource Sharing).
 # This allows our React frontend (running on a different port) to communicate with this backend.
 app.add_middleware(
@@ -21,12 +43,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress responses according to the client's Accept-Encoding (br, then gzip).
+if BrotliMiddleware:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
+# Read-your-writes: after a successful write, the client's reads go to the primary for a few
+# seconds so it doesn't see stale data from a lagging replica (see database.get_read_db).
+if database.READ_REPLICA_URLS:
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        response = await call_next(request)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+            until = time.time() + database.READ_YOUR_WRITES_SECONDS
+            response.set_cookie(database.READ_YOUR_WRITES_COOKIE, f"{until:.3f}",
+                                max_age=int(database.READ_YOUR_WRITES_SECONDS) + 1, httponly=True, samesite="lax")
+        return response
+
+# On-demand profiling (off unless PROFILING_SECRET or PROFILE_SAMPLE_RATE is set, see app/profiling.py).
+# Added last so it is the outermost middleware and the profile covers the whole request.
+if profiling.PROFILING_SECRET or profiling.PROFILE_SAMPLE_RATE:
+    app.add_middleware(profiling.ProfilingMiddleware)
+
 # Include routers. This keeps the code organized by feature.
 app.include_router(auth.router)
 app.include_router(market.router)
 app.include_router(portfolio.router)
 app.include_router(alerts.router)
+app.include_router(dashboard.router)
+app.include_router(jobs.router)
 
 @app.get("/")
 def read_root():
     return {"message": "Stock Manager API is running"}
+
+@app.get("/admission/stats")
+def admission_stats(admin: None = Depends(auth_utils.require_admin)):
+    # Admins only (see auth.require_admin). Limiter settings, in-flight requests and rejection counts
+    # of this worker, for tuning the limits.
+    return {"enabled": admission.ADMISSION_ENABLED, **admission.limiter.stats()}
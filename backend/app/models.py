@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Date, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Date, Enum, Index, JSON, text
 from sqlalchemy.orm import relationship
 from .database import Base
 import datetime
@@ -14,6 +14,17 @@ class AlertCondition(str, enum.Enum):
     ABOVE = "ABOVE"
     BELOW = "BELOW"
 
+class NotificationStatus(str, enum.Enum):
+    PENDING = "PENDING"
+    SENT = "SENT"
+    FAILED = "FAILED"
+
+class JobStatus(str, enum.Enum):
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+
 class User(Base):
     __tablename__ = "users"
 
@@ -96,6 +107,11 @@ class StockPrice(Base):
 
     stock = relationship("Stock", back_populates="prices")
 
+    # One bar per stock per day. Also serves history lookups by stock and date range.
+    __table_args__ = (
+        Index("ix_stock_prices_stock_date", "stock_id", "date", unique=True),
+    )
+
 # Model for user transactions (Buy/Sell).
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -111,6 +127,11 @@ class Transaction(Base):
     stock = relationship("Stock", back_populates="transactions")
     user = relationship("User", back_populates="transactions")
 
+    # Composite index for per-user history ordered by (date, id), used by keyset pagination and exports.
+    __table_args__ = (
+        Index("ix_transactions_user_date_id", "user_id", "date", "id"),
+    )
+
 # Model for user's watchlist.
 class Watchlist(Base):
     __tablename__ = "watchlist"
@@ -136,6 +157,39 @@ class Alert(Base):
     stock = relationship("Stock", back_populates="alerts")
     user = relationship("User", back_populates="alerts")
 
+# Notification outbox. Rows are written in the same transaction that deactivates the triggered
+# alerts, and delivered later by the dispatcher (services/notifier.py).
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    alert_id = Column(Integer, ForeignKey("alerts.id", ondelete="SET NULL"), nullable=True)
+    channel = Column(String) # e.g. "log", "webhook"
+    payload = Column(JSON)
+    status = Column(Enum(NotificationStatus), default=NotificationStatus.PENDING)
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow) # also the claim lease
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    # The dispatcher polls for due PENDING rows.
+    __table_args__ = (
+        Index("ix_notifications_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+# Revoked refresh tokens ("jti") and token families ("family"), kept until they expire.
+# Issued tokens are not stored: only revocations are, so the table stays small.
+class RevokedToken(Base):
+    __tablename__ = "revoked_tokens"
+
+    id = Column(String, primary_key=True) # the token's jti or the family id
+    kind = Column(String) # "jti" or "family"
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    revoked_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    expires_at = Column(DateTime, index=True)
+
 class Sector(Base):
     __tablename__ = "sectors"
     
@@ -173,3 +227,101 @@ class Fundamental(Base):
     last_updated = Column(DateTime, default=datetime.datetime.utcnow)
     
     stock = relationship("Stock", back_populates="fundamental")
+
+# Change history of a stock's fundamentals. Each import adds a row holding only the columns that
+# changed (a delta). Periodically a checkpoint row with every column is written, so rebuilding the
+# values at any date reads one checkpoint plus a bounded number of deltas.
+class FundamentalVersion(Base):
+    __tablename__ = "fundamental_versions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    stock_id = Column(Integer, ForeignKey("stocks.id"))
+    version = Column(Integer) # 1, 2, 3... per stock
+    recorded_at = Column(DateTime, default=datetime.datetime.utcnow)
+    is_checkpoint = Column(Boolean, default=False)
+    values = Column(JSON) # {column: value} of the changed columns, or of all columns for a checkpoint
+
+    __table_args__ = (
+        Index("ix_fundamental_versions_stock_version", "stock_id", "version", unique=True),
+        Index("ix_fundamental_versions_stock_recorded", "stock_id", "recorded_at"),
+    )
+
+# End-of-day value of each user's holdings, one row per user per trading day.
+# Written by services/portfolio_snapshots.py; the equity curve endpoints only read these rows.
+class PortfolioSnapshot(Base):
+    __tablename__ = "portfolio_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    date = Column(Date)
+    market_value = Column(Float)   # holdings at that day's closing prices
+    net_invested = Column(Float)   # buys minus sells up to and including that day
+    net_flow = Column(Float)       # buys minus sells on that day only
+    holdings = Column(Integer)     # number of stocks held
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_portfolio_snapshots_user_date", "user_id", "date", unique=True),
+    )
+
+# Market index definitions (all-share, top N by market cap, per sector). See services/market_indices.py.
+class MarketIndex(Base):
+    __tablename__ = "market_indices"
+
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String, unique=True, index=True) # e.g. "ALL", "TOP30", "SECTOR-BANK"
+    name = Column(String)
+    kind = Column(String) # "all", "top" or "sector"
+    size = Column(Integer, nullable=True) # number of constituents for "top"
+    sector = Column(String, nullable=True) # sector name for "sector"
+    base_value = Column(Float, default=1000.0)
+    divisor = Column(Float, nullable=True) # set on the first calculation, adjusted on each rebalance
+    rebalanced_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    ticks = relationship("IndexTick", back_populates="index")
+
+# One index level per scrape in which the index moved.
+class IndexTick(Base):
+    __tablename__ = "index_ticks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    index_id = Column(Integer, ForeignKey("market_indices.id"))
+    ts = Column(DateTime, default=datetime.datetime.utcnow)
+    value = Column(Float)
+    change = Column(Float) # against the previous trading day's close
+    change_percent = Column(Float)
+
+    index = relationship("MarketIndex", back_populates="ticks")
+
+    __table_args__ = (
+        Index("ix_index_ticks_index_ts", "index_id", "ts"),
+    )
+
+# Background jobs (scrapes, imports, recomputes, backfills), run by worker.py. See services/jobs.py.
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String) # e.g. "scrape", see services/jobs.JOB_KINDS
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True) # who queued it (none for internal jobs)
+    payload = Column(JSON, nullable=True)
+    status = Column(Enum(JobStatus), default=JobStatus.QUEUED)
+    priority = Column(Integer, default=100) # lower runs first
+    dedupe_key = Column(String, nullable=True) # at most one queued/running job per key
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.datetime.utcnow) # retry time, and the lease while RUNNING
+    locked_by = Column(String, nullable=True) # worker that claimed it
+    last_error = Column(String, nullable=True)
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_priority_run_after", "status", "priority", "run_after"),
+        Index("ix_jobs_active_dedupe_key", "dedupe_key", unique=True,
+              postgresql_where=text("status IN ('QUEUED', 'RUNNING')"),
+              sqlite_where=text("status IN ('QUEUED', 'RUNNING')")),
+    )
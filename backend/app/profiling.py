@@ -0,0 +1,179 @@
+import contextvars
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from starlette.concurrency import run_in_threadpool
+
+# On-demand request profiling.
+#
+# A request is profiled when it carries a valid signed X-Profile header (see sign() below) or is
+# picked by PROFILE_SAMPLE_RATE. A background thread then samples the stacks of the threads working
+# on that request every PROFILE_INTERVAL_MS and writes a speedscope profile
+# (https://www.speedscope.app) to PROFILE_DIR when the request finishes.
+#
+# Our endpoints are sync functions run in a thread pool, so the sampler can't just watch the event
+# loop thread. The request's contextvars context is copied into whichever worker thread runs its
+# code, so a worker belongs to the request if the Context it is running holds our marker.
+#
+# main.py only installs the middleware when PROFILING_SECRET or PROFILE_SAMPLE_RATE is set.
+
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "stock_manager_profiles"))
+PROFILE_HEADER = b"x-profile"
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("profile_session", default=None)
+
+def sign(valid_seconds: int = 300, secret: str = None):
+    # Header value that enables profiling until it expires: "<expires>:<hmac>".
+    expires = str(int(time.time()) + valid_seconds)
+    digest = hmac.new((secret or PROFILING_SECRET).encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return f"{expires}:{digest}"
+
+def verify(value: str):
+    if not PROFILING_SECRET:
+        return False
+    expires, _, digest = value.partition(":")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    expected = hmac.new(PROFILING_SECRET.encode(), expires.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, digest)
+
+class Sampler:
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+        self.marker = object() # identifies this request's context
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_")[:80]
+        self.filename = f"{time.strftime('%Y%m%d-%H%M%S')}_{slug}_{uuid.uuid4().hex[:8]}.speedscope.json"
+        self.frames = {}       # (name, file, line) -> index in the speedscope frame table
+        self.samples = {}      # thread id -> list of stacks (frame indexes, root first)
+        self._owner = {}       # thread id -> frame that was running our context last time
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _runs_our_context(self, thread_id, frame):
+        # Look for a frame whose locals hold a contextvars.Context marked with this request.
+        # The frame found last time (the worker's run loop) is checked first, so this is usually
+        # a single dict lookup.
+        cached = self._owner.get(thread_id)
+        candidates = [cached] if cached is not None else []
+        f = frame
+        while f is not None:
+            candidates.append(f)
+            f = f.f_back
+        for f in candidates:
+            for value in f.f_locals.values():
+                if isinstance(value, contextvars.Context) and value.get(_current) is self.marker:
+                    self._owner[thread_id] = f
+                    return True
+        return False
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, frame.f_lineno)
+            index = self.frames.get(key)
+            if index is None:
+                index = self.frames[key] = len(self.frames)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != me and self._runs_our_context(thread_id, frame):
+                    self.samples.setdefault(thread_id, []).append(self._stack(frame))
+
+    def to_speedscope(self):
+        interval_ms = self.interval * 1000
+        frames = [{"name": name, "file": file, "line": line} for (name, file, line) in self.frames]
+        profiles = []
+        for thread_id, stacks in self.samples.items():
+            profiles.append({
+                "type": "sampled", "name": f"thread {thread_id}", "unit": "milliseconds",
+                "startValue": 0, "endValue": len(stacks) * interval_ms,
+                "samples": stacks, "weights": [interval_ms] * len(stacks),
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.name} ({self.elapsed * 1000:.0f} ms)",
+            "exporter": "stock-manager",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def save(self, directory: str = PROFILE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        with open(path, "w") as f:
+            json.dump(self.to_speedscope(), f)
+        return path
+
+def _stop_and_save(sampler: Sampler):
+    sampler.stop()
+    return sampler.save()
+
+class ProfilingMiddleware:
+    # Plain ASGI middleware: requests that aren't profiled pass straight through.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = dict(scope["headers"]).get(PROFILE_HEADER)
+        signed = header is not None and verify(header.decode("latin-1"))
+        if not signed and not (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+            return await self.app(scope, receive, send)
+
+        sampler = Sampler(f"{scope['method']} {scope['path']}", PROFILE_INTERVAL_MS / 1000)
+        token = _current.set(sampler.marker)
+        sampler.start()
+
+        async def send_with_profile_id(message):
+            # Only a caller who asked for a profile is told its file name.
+            if signed and message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-id", sampler.filename.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _current.reset(token)
+            # Joining the sampler thread and writing the file block, so they run off the event loop.
+            path = await run_in_threadpool(_stop_and_save, sampler)
+            logger.info("Saved profile %s", path)
+
+if __name__ == "__main__":
+    # python -m app.profiling [seconds]  ->  prints an X-Profile header value for PROFILING_SECRET
+    if not PROFILING_SECRET:
+        sys.exit("PROFILING_SECRET is not set")
+    print(sign(int(sys.argv[1]) if len(sys.argv) > 1 else 300))
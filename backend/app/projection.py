@@ -0,0 +1,79 @@
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.orm import joinedload, load_only
+from . import models, schemas
+
+# Sparse fieldsets for stock payloads (?fields=...).
+#
+# Syntax: a comma separated list of stock columns and relationship columns, e.g.
+#   fields=trading_code,market_data.ltp,market_data.change
+#   fields=trading_code,name,fundamental          (a bare relationship means all of its columns)
+# Only the requested columns are selected and only the requested relationships are joined.
+
+STOCK_COLUMNS = ["id", "trading_code", "name", "sector", "last_updated"]
+
+# relationship name -> (ORM model, response schema)
+RELATIONSHIPS = {
+    "market_data": (models.MarketData, schemas.MarketData),
+    "sector_rel": (models.Sector, schemas.Sector),
+    "fundamental": (models.Fundamental, schemas.Fundamental),
+}
+
+def parse_fields(fields: str):
+    # Returns {"": [stock columns], "market_data": [columns], ...} or None when no projection was asked for.
+    if not fields:
+        return None
+
+    spec = {"": ["id"]} # The id is always returned so clients can link rows.
+    for item in fields.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        relation, _, column = item.partition(".")
+        if relation in RELATIONSHIPS:
+            allowed = list(RELATIONSHIPS[relation][1].model_fields)
+            columns = spec.setdefault(relation, [])
+            if not column:
+                columns.extend(c for c in allowed if c not in columns)
+            elif column in allowed:
+                if column not in columns:
+                    columns.append(column)
+            else:
+                raise HTTPException(status_code=400, detail=f"Unknown field: {item}")
+        elif not column and item in STOCK_COLUMNS:
+            if item not in spec[""]:
+                spec[""].append(item)
+        else:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {item}")
+    return spec
+
+def stock_load_options(spec, via=None):
+    # Loader options for a Stock query (or for Stock reached through the 'via' relationship).
+    # Without a spec every relationship is eager loaded, which avoids one lazy query per row.
+    if spec is None:
+        if via is None:
+            return [joinedload(getattr(models.Stock, name)) for name in RELATIONSHIPS]
+        return [joinedload(via).joinedload(getattr(models.Stock, name)) for name in RELATIONSHIPS]
+
+    base = joinedload(via) if via is not None else None
+    stock_columns = [getattr(models.Stock, c) for c in spec[""]]
+    options = [base.load_only(*stock_columns) if base is not None else load_only(*stock_columns)]
+    for relation, columns in spec.items():
+        if not relation:
+            continue
+        model = RELATIONSHIPS[relation][0]
+        attr = getattr(models.Stock, relation)
+        loader = base.joinedload(attr) if base is not None else joinedload(attr)
+        options.append(loader.load_only(*[getattr(model, c) for c in columns]))
+    return options
+
+def project_stock(stock: models.Stock, spec):
+    # Serialize only the requested attributes. Unrequested relationships are never touched,
+    # so they are never lazy loaded either.
+    data = {c: getattr(stock, c) for c in spec[""]}
+    for relation, columns in spec.items():
+        if not relation:
+            continue
+        related = getattr(stock, relation)
+        data[relation] = {c: getattr(related, c) for c in columns} if related is not None else None
+    return jsonable_encoder(data)
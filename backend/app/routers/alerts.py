@@ -10,7 +10,7 @@ router = APIRouter(
 
 @router.get("/", response_model=List[schemas.Alert])
 def read_alerts(
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
     return crud.get_alerts(db, user_id=current_user.id)
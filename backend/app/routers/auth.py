@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Response, Request
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from .. import schemas, models, database, auth
+from ..services.revocation import store as revocation_store, REUSE_GRACE_SECONDS
 
 router = APIRouter(
     tags=["Authentication"]
@@ -54,6 +55,10 @@ def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestF
     
     return {"access_token": access_token, "token_type": "bearer"}
 
+def _family_expiry():
+    # A family revocation must outlive every token of the family issued so far.
+    return datetime.utcnow() + timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS)
+
 @router.post("/refresh", response_model=schemas.Token)
 def refresh_token(request: Request, response: Response, db: Session = Depends(database.get_db)):
     refresh_token = request.cookies.get("refresh_token")
@@ -63,14 +68,29 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(da
     try:
         payload = jwt.decode(refresh_token, auth.REFRESH_SECRET_KEY, algorithms=[auth.ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        jti: str = payload.get("jti")
+        family_id: str = payload.get("fam")
+        if email is None or jti is None or family_id is None:
             raise HTTPException(status_code=401, detail="Invalid refresh token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid refresh token")
-        
+
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
          raise HTTPException(status_code=401, detail="User not found")
+
+    # Rotate: the presented token is marked used in the same statement that checks its family, so a
+    # logout on another worker can't be raced. If it was already used, it is being replayed. Outside
+    # the short grace window for concurrent tabs, assume it was stolen and revoke the whole family,
+    # which logs out every session descended from that login.
+    revoked = revocation_store.rotate(db, jti, family_id, user.id, datetime.utcfromtimestamp(payload["exp"]))
+    if revoked:
+        kind, revoked_at = revoked
+        if kind == "family":
+            raise HTTPException(status_code=401, detail="Refresh token revoked")
+        if not revoked_at or (datetime.utcnow() - revoked_at).total_seconds() > REUSE_GRACE_SECONDS:
+            revocation_store.revoke(db, family_id, "family", user.id, _family_expiry())
+            raise HTTPException(status_code=401, detail="Refresh token reuse detected")
          
     # Issue new tokens
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -78,12 +98,10 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(da
         data={"sub": user.email}, expires_delta=access_token_expires
     )
     
-    # Rotate refresh token (Optional but recommended security practice)
-    # For now, let's keep the same refresh token or issue a new one
-    # Let's issue a new one to extend the session
+    # The new refresh token stays in the same family.
     new_refresh_token_expires = timedelta(days=auth.REFRESH_TOKEN_EXPIRE_DAYS)
     new_refresh_token = auth.create_refresh_token(
-        data={"sub": user.email}, expires_delta=new_refresh_token_expires
+        data={"sub": user.email}, expires_delta=new_refresh_token_expires, family_id=family_id
     )
     
     response.set_cookie(
@@ -98,6 +116,16 @@ def refresh_token(request: Request, response: Response, db: Session = Depends(da
     return {"access_token": new_access_token, "token_type": "bearer"}
 
 @router.post("/logout")
-def logout(response: Response):
+def logout(request: Request, response: Response, db: Session = Depends(database.get_db)):
+    # Revoke the whole token family so the refresh token can't be used even if it was copied.
+    refresh_token = request.cookies.get("refresh_token")
+    if refresh_token:
+        try:
+            payload = jwt.decode(refresh_token, auth.REFRESH_SECRET_KEY, algorithms=[auth.ALGORITHM])
+            user = db.query(models.User).filter(models.User.email == payload.get("sub")).first()
+            if payload.get("fam"):
+                revocation_store.revoke(db, payload["fam"], "family", user.id if user else None, _family_expiry())
+        except JWTError:
+            pass # expired or invalid: nothing to revoke
     response.delete_cookie("refresh_token")
     return {"message": "Logged out successfully"}
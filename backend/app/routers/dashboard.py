@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from .. import schemas, models, database, auth, crud
+from ..services import quotes, movers
+
+router = APIRouter(
+    prefix="/dashboard",
+    tags=["Dashboard"]
+)
+
+@router.get("/summary", response_model=schemas.DashboardSummary, response_model_exclude_none=True)
+def get_summary(
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # Everything the home screen needs in one request: one auth lookup, one DB session,
+    # positions replayed from one transactions query and market data from the shared snapshot
+    # where possible.
+    summary = crud.get_portfolio_summary(db, current_user.id)
+
+    total_value = summary["total_value"]
+    total_cost = summary["total_cost"]
+    day_change = summary["total_day_change"]
+    previous_value = total_value - day_change
+
+    return {
+        "total_value": total_value,
+        "total_cost": total_cost,
+        "gain_loss": total_value - total_cost,
+        "gain_loss_percent": (total_value - total_cost) / total_cost * 100 if total_cost else 0.0,
+        "day_change": day_change,
+        "day_change_percent": day_change / previous_value * 100 if previous_value else 0.0,
+        "top_holdings": summary["holdings"],
+        "watchlist": quotes.pack(quotes.get_watchlist_quotes(db, current_user.id)),
+        "active_alerts": crud.count_active_alerts(db, current_user.id),
+        "movers": movers.top_movers(db),
+    }
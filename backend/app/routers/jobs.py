@@ -0,0 +1,55 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from .. import schemas, models, database, auth
+from ..services import jobs
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["Jobs"]
+)
+
+@router.post("/", response_model=schemas.Job)
+def create_job(
+    job: schemas.JobCreate,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+    admin: bool = Depends(auth.is_admin)
+):
+    # Queues a job for worker.py. With a dedupe_key that is already queued or running, the existing
+    # job is returned instead of a new one.
+    # Users may only queue the kinds in USER_JOB_KINDS, with the same options as /market/scrape;
+    # everything else (imports, backfills, recomputes) needs the admin token.
+    try:
+        if admin:
+            return jobs.enqueue(db, job.kind, job.payload, priority=job.priority, dedupe_key=job.dedupe_key,
+                                max_attempts=job.max_attempts, user_id=current_user.id)
+        if job.kind not in jobs.USER_JOB_KINDS:
+            raise HTTPException(status_code=403, detail="Admin token required for this job kind")
+        return jobs.enqueue(db, job.kind, job.payload, priority=10, dedupe_key=job.kind, user_id=current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/", response_model=List[schemas.Job])
+def read_jobs(
+    status: Optional[models.JobStatus] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+    admin: bool = Depends(auth.is_admin)
+):
+    # Users see the jobs they queued; the admin token shows every job.
+    return jobs.list_jobs(db, status=status, kind=kind, limit=limit, user_id=None if admin else current_user.id)
+
+@router.get("/{job_id}", response_model=schemas.Job)
+def read_job(
+    job_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+    admin: bool = Depends(auth.is_admin)
+):
+    job = jobs.get_job(db, job_id)
+    if job is None or (not admin and job.user_id != current_user.id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
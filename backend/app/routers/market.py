@@ -1,8 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
-from sqlalchemy.orm import Session
-from typing import List
-from .. import crud, schemas, database
-from ..services import scraper
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy.orm import Session, load_only
+from fastapi.responses import JSONResponse
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+from .. import crud, schemas, models, database, projection, http_cache, auth
+from ..services import jobs, quotes, indicators, search, fundamental_history, movers, chart_history, market_indices
 
 # APIRouter allows us to group related path operations.
 router = APIRouter(
@@ -11,23 +13,169 @@ router = APIRouter(
 )
 
 @router.get("/scrape")
-def trigger_scrape(background_tasks: BackgroundTasks, db: Session = Depends(database.get_db)):
-    # BackgroundTasks allow the function to return immediately while the task runs in the background.
-    # This prevents the request from timing out during long operations like scraping.
-    background_tasks.add_task(scraper.scrape_dse_data, db)
-    return {"message": "Scraping started in background"}
+def trigger_scrape(db: Session = Depends(database.get_db)):
+    # Queues a scrape for the job worker (worker.py) and returns immediately. While one is already
+    # queued or running, the same job is returned instead of a second one.
+    job = jobs.enqueue(db, "scrape", priority=10, dedupe_key="scrape")
+    return {"message": "Scrape queued", "job_id": job.id, "status": job.status}
 
 @router.get("/stocks", response_model=List[schemas.StockDetail])
-def read_stocks(skip: int = 0, limit: int = 100, db: Session = Depends(database.get_db)):
+def read_stocks(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db)
+):
     # Depends(database.get_db) injects a database session into the function.
-    stocks = crud.get_stocks(db, skip=skip, limit=limit)
+    # Polling clients send back the ETag they got; if nothing changed they get an empty 304.
+    headers = http_cache.market_headers(request, db)
+    if http_cache.is_not_modified(request, headers):
+        return http_cache.not_modified_response(headers)
+
+    # ?fields=trading_code,market_data.ltp returns only those attributes (see app/projection.py).
+    spec = projection.parse_fields(fields)
+    stocks = crud.get_stocks(db, skip=skip, limit=limit, options=projection.stock_load_options(spec))
+    if spec is not None:
+        return JSONResponse([projection.project_stock(stock, spec) for stock in stocks], headers=headers)
+    response.headers.update(headers)
     return stocks
 
+@router.get("/quotes", response_model=schemas.QuoteBatch, response_model_exclude_none=True)
+def read_quotes(
+    codes: str,
+    layout: str = Query("rows", pattern="^(rows|columns)$"),
+    db: Session = Depends(database.get_read_db)
+):
+    # Price-only quotes for many symbols in one call, e.g. /market/quotes?codes=GP,BATBC
+    return quotes.pack(quotes.get_quotes(db, quotes.parse_codes(codes)), layout)
+
+@router.get("/search", response_model=List[schemas.StockSearchResult])
+def search_stocks(
+    q: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(database.get_read_db)
+):
+    # Autocomplete over trading code, company name and sector, answered from memory.
+    return search.search(db, q, limit)
+
+@router.get("/movers", response_model=schemas.MarketMovers)
+def read_movers(limit: int = Query(10, ge=1, le=movers.MAX_LIMIT), db: Session = Depends(database.get_read_db)):
+    # Top gainers, losers, most active and new 52-week highs, served from the in-memory board.
+    return movers.market_movers(db, limit)
+
+@router.get("/breadth", response_model=schemas.MarketBreadth)
+def read_breadth(db: Session = Depends(database.get_read_db)):
+    # Advance/decline counts and turnover totals for the whole board.
+    return movers.market_breadth(db)
+
+@router.get("/indices", response_model=List[schemas.MarketIndexLevel])
+def read_indices(db: Session = Depends(database.get_read_db)):
+    # Latest level of every index, as stored by the last scrape that moved it.
+    return market_indices.latest(db)
+
+@router.post("/indices", response_model=schemas.MarketIndexDefinition)
+def create_index(
+    index: schemas.MarketIndexCreate,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user),
+    admin: None = Depends(auth.require_admin)
+):
+    # Admins only (see auth.require_admin). The new index gets its first level (the base value at
+    # yesterday's close) on the next scrape.
+    try:
+        return market_indices.create_index(db, index.code, index.name, index.kind, index.size, index.sector)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/indices/{code}/ticks", response_model=List[schemas.IndexTick])
+def read_index_ticks(
+    code: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(database.get_read_db)
+):
+    index = market_indices.get_index(db, code)
+    if not index:
+        raise HTTPException(status_code=404, detail="Index not found")
+    return market_indices.ticks(db, index, start, end, limit)
+
 @router.get("/stocks/{trading_code}", response_model=schemas.StockDetail)
-def read_stock(trading_code: str, db: Session = Depends(database.get_db)):
+def read_stock(
+    trading_code: str,
+    request: Request,
+    response: Response,
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db)
+):
     # Path parameter {trading_code} is passed as an argument to the function.
-    stock = crud.get_stock_by_code(db, trading_code=trading_code)
+    headers = http_cache.market_headers(request, db)
+    if http_cache.is_not_modified(request, headers):
+        return http_cache.not_modified_response(headers)
+
+    spec = projection.parse_fields(fields)
+    stock = crud.get_stock_by_code(db, trading_code=trading_code, options=projection.stock_load_options(spec))
     if stock is None:
         # Raise HTTP 404 error if stock not found.
         raise HTTPException(status_code=404, detail="Stock not found")
+    if spec is not None:
+        return JSONResponse(projection.project_stock(stock, spec), headers=headers)
+    response.headers.update(headers)
     return stock
+
+@router.get("/stocks/{trading_code}/indicators", response_model=schemas.Indicators)
+def read_indicators(trading_code: str, db: Session = Depends(database.get_read_db)):
+    stock = crud.get_stock_by_code(db, trading_code=trading_code)
+    if stock is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    # Served from the in-memory engine, which covers every stock with price history.
+    engine = indicators.get_engine(db)
+    values = engine.get(stock.id)
+    if values is None:
+        raise HTTPException(status_code=404, detail="No price history for this stock")
+    return {"trading_code": stock.trading_code, "as_of": engine.last_date, **values}
+
+@router.get("/stocks/{trading_code}/history", response_model=schemas.PriceHistory)
+def read_price_history(
+    trading_code: str,
+    request: Request,
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    interval: str = "1d",
+    points: Optional[int] = Query(None, ge=3, le=5000),
+    db: Session = Depends(database.get_read_db)
+):
+    # OHLCV bars for charts, e.g. ?from=2022-01-01&interval=1w, or a line of ?points=500 closes.
+    if interval not in chart_history.INTERVALS:
+        raise HTTPException(status_code=422, detail=f"interval must be one of {', '.join(chart_history.INTERVALS)} "
+                                                    "(only daily bars are stored)")
+    end = end or date.today()
+    start = start or end - timedelta(days=365)
+    if start > end:
+        raise HTTPException(status_code=422, detail="'from' must not be after 'to'")
+
+    stock = crud.get_stock_by_code(db, trading_code=trading_code, options=[load_only(models.Stock.id, models.Stock.trading_code)])
+    if stock is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+    headers = http_cache.history_headers(request, db, stock.id, start, end)
+    if http_cache.is_not_modified(request, headers):
+        return http_cache.not_modified_response(headers)
+    # Already encoded JSON (cached), so it is sent as is.
+    body = chart_history.get_history(db, stock, start, end, interval, headers["ETag"], points)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/stocks/{trading_code}/fundamentals", response_model=schemas.FundamentalSnapshot)
+def read_fundamentals_as_of(trading_code: str, as_of: Optional[datetime] = None, db: Session = Depends(database.get_read_db)):
+    # ?as_of=2024-06-30 returns the values recorded by the last import at or before that time.
+    stock = crud.get_stock_by_code(db, trading_code=trading_code)
+    if stock is None:
+        raise HTTPException(status_code=404, detail="Stock not found")
+
+    state = fundamental_history.as_of(db, stock.id, as_of)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No fundamentals recorded for this date")
+    return {"trading_code": stock.trading_code, "version": state["version"],
+            "recorded_at": state["recorded_at"], **state["values"]}
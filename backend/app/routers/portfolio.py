@@ -1,8 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Query, Response
+from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
-from datetime import datetime
-from .. import schemas, models, database, auth, crud
+from datetime import datetime, date
+import base64
+import csv
+import io
+import json
+from .. import schemas, models, database, auth, crud, projection
+from ..services import statement_import, quotes, risk, simulator, portfolio_snapshots
 
 router = APIRouter(
     prefix="/portfolio",
@@ -11,37 +17,20 @@ router = APIRouter(
 
 @router.get("/", response_model=List[schemas.PortfolioItem])
 def get_portfolio(
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    # Aggregate transactions to calculate portfolio
+    # Aggregate transactions to calculate portfolio, in trade order (the average cost depends on it)
     transactions = db.query(models.Transaction)\
         .options(joinedload(models.Transaction.stock).joinedload(models.Stock.market_data))\
-        .filter(models.Transaction.user_id == current_user.id).all()
-    
-    portfolio_map = {}
+        .filter(models.Transaction.user_id == current_user.id)\
+        .order_by(models.Transaction.date, models.Transaction.id).all()
     
-    for t in transactions:
-        if t.stock_id not in portfolio_map:
-            portfolio_map[t.stock_id] = {
-                "stock": t.stock,
-                "quantity": 0.0,
-                "total_cost": 0.0,
-            }
-        
-        item = portfolio_map[t.stock_id]
-        
-        if t.type == models.TransactionType.BUY:
-            item["quantity"] += t.quantity
-            item["total_cost"] += (t.quantity * t.price)
-        elif t.type == models.TransactionType.SELL:
-             # Calculate average cost before selling to reduce total_cost correctly
-             if item["quantity"] > 0:
-                 avg_cost = item["total_cost"] / item["quantity"]
-                 item["quantity"] -= t.quantity
-                 item["total_cost"] -= (t.quantity * avg_cost)
-             else:
-                 item["quantity"] -= t.quantity
+    stocks = {t.stock_id: t.stock for t in transactions}
+    portfolio_map = {
+        stock_id: {"stock": stocks[stock_id], "quantity": quantity, "total_cost": total_cost}
+        for stock_id, (quantity, total_cost) in crud.replay_cost_basis(transactions).items()
+    }
             
     # Calculate final lists
     result = []
@@ -67,18 +56,128 @@ def get_portfolio(
             
     return result
 
+@router.get("/risk", response_model=schemas.PortfolioRisk)
+def get_portfolio_risk(
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # Volatility, 1-day value-at-risk, per-holding risk contribution and correlations.
+    # The exchange covariance matrix is cached per trading day, see services/risk.py.
+    return risk.portfolio_risk(db, crud.get_positions(db, current_user.id))
+
+@router.post("/simulate", response_model=schemas.SimulationResult)
+def simulate_portfolio(
+    request: schemas.SimulationRequest,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # Hypothetical trades or target weights, evaluated at current prices. Nothing is saved.
+    try:
+        return simulator.simulate(db, current_user.id, request.scenarios, whole_shares=request.whole_shares)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@router.get("/equity-curve", response_model=List[schemas.EquityPoint])
+def get_equity_curve(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # One precomputed row per trading day, written by the end-of-day snapshot job.
+    return portfolio_snapshots.equity_curve(db, current_user.id, start_date, end_date)
+
+@router.get("/daily-change", response_model=List[schemas.DailyChange])
+def get_daily_change(
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    return portfolio_snapshots.daily_changes(db, current_user.id, start_date, end_date)
+
+# Pagination cursors are opaque to clients: base64 of "<iso date>|<id>" of the last row returned.
+# The date part is empty for a transaction without a date.
+def _encode_cursor(tx: models.Transaction):
+    date_part = tx.date.isoformat() if tx.date else ""
+    return base64.urlsafe_b64encode(f"{date_part}|{tx.id}".encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        date_part, id_part = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return (datetime.fromisoformat(date_part) if date_part else None), int(id_part)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @router.get("/transactions", response_model=List[schemas.Transaction])
 def get_transaction_history(
+    response: Response,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-    db: Session = Depends(database.get_db),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    return crud.get_transactions(
+    transactions = crud.get_transactions(
         db, 
         user_id=current_user.id, 
         start_date=start_date, 
-        end_date=end_date
+        end_date=end_date,
+        limit=limit,
+        before=_decode_cursor(cursor) if cursor else None
+    )
+
+    # A full page means there may be more rows. Pass ?cursor=<X-Next-Cursor> to fetch the next page.
+    if len(transactions) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(transactions[-1])
+    return transactions
+
+EXPORT_COLUMNS = ["id", "date", "trading_code", "type", "quantity", "price"]
+EXPORT_BATCH_SIZE = 1000
+
+def _export_rows(user_id: int, fmt: str):
+    # Generator with its own session: it keeps running after the endpoint has returned.
+    # yield_per() uses a server-side cursor, so only one batch of rows is in memory at a time.
+    db = database.SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == "csv":
+            writer.writerow(EXPORT_COLUMNS)
+
+        query = crud.get_transaction_export_query(db, user_id).yield_per(EXPORT_BATCH_SIZE)
+        for count, row in enumerate(query, start=1):
+            values = [row.id, row.date.isoformat() if row.date else None, row.trading_code,
+                      row.type.value if row.type else None, row.quantity, row.price]
+            if fmt == "csv":
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values))) + "\n")
+
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+@router.get("/transactions/export")
+def export_transactions(
+    format: str = "csv",
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # Streams the complete history with constant memory, however many rows the account has.
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'ndjson'")
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _export_rows(current_user.id, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=transactions.{format}"}
     )
 
 @router.post("/transactions", response_model=schemas.Transaction)
@@ -112,12 +211,50 @@ def create_transaction(
     db.refresh(new_transaction)
     return new_transaction
 
+@router.post("/transactions/import", response_model=schemas.TransactionImportResult)
+def import_transactions(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # Bulk import of a broker statement (CSV or NDJSON).
+    # Expected columns: trading_code, type (BUY/SELL), quantity, price, date (ISO 8601).
+    fmt = format or statement_import.detect_format(file.filename, file.content_type)
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'ndjson'")
+
+    try:
+        return statement_import.import_statement(db, current_user.id, file.file, fmt)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
 @router.get("/watchlist", response_model=List[schemas.Watchlist])
 def read_watchlist(
-    db: Session = Depends(database.get_db),
+    fields: Optional[str] = None,
+    db: Session = Depends(database.get_read_db),
+    current_user: models.User = Depends(auth.get_current_user)
+):
+    # ?fields=... projects the nested stock the same way as /market/stocks.
+    spec = projection.parse_fields(fields)
+    items = db.query(models.Watchlist)\
+        .options(*projection.stock_load_options(spec, via=models.Watchlist.stock))\
+        .filter(models.Watchlist.user_id == current_user.id).all()
+    if spec is not None:
+        return JSONResponse([
+            {"id": item.id, "stock_id": item.stock_id, "stock": projection.project_stock(item.stock, spec)}
+            for item in items
+        ])
+    return items
+
+@router.get("/watchlist/quotes", response_model=schemas.QuoteBatch, response_model_exclude_none=True)
+def read_watchlist_quotes(
+    layout: str = Query("rows", pattern="^(rows|columns)$"),
+    db: Session = Depends(database.get_read_db),
     current_user: models.User = Depends(auth.get_current_user)
 ):
-    return db.query(models.Watchlist).filter(models.Watchlist.user_id == current_user.id).all()
+    # Same data as /watchlist but only the price fields, for frequently refreshing widgets.
+    return quotes.pack(quotes.get_watchlist_quotes(db, current_user.id), layout)
 
 @router.post("/watchlist", response_model=schemas.Watchlist)
 def add_to_watchlist(
@@ -1,7 +1,7 @@
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 from datetime import datetime, date
-from .models import TransactionType, AlertCondition
+from .models import TransactionType, AlertCondition, JobStatus
 
 # Pydantic models (Schemas) are used for data validation and serialization (converting to JSON).
 # They define the structure of data expected in requests and returned in responses.
@@ -61,6 +61,12 @@ class MarketData(BaseModel):
     class Config:
         from_attributes = True
 
+# Compact quote payload: field names once, then values as rows or as one array per field.
+class QuoteBatch(BaseModel):
+    fields: List[str]
+    rows: Optional[List[List[Any]]] = None
+    columns: Optional[Dict[str, List[Any]]] = None
+
 class Sector(BaseModel):
     id: int
     name: str
@@ -90,6 +96,50 @@ class Fundamental(BaseModel):
     class Config:
         from_attributes = True
 
+class StockSearchResult(BaseModel):
+    id: int
+    trading_code: str
+    name: Optional[str] = None
+    sector: Optional[str] = None
+    match: str # code, code_prefix, name, sector or fuzzy
+
+# Technical indicators computed from our own price history (see services/indicators.py).
+class Indicators(BaseModel):
+    trading_code: str
+    as_of: date
+    close: Optional[float] = None
+    sma_20: Optional[float] = None
+    sma_50: Optional[float] = None
+    ema_12: Optional[float] = None
+    ema_26: Optional[float] = None
+    macd: Optional[float] = None
+    macd_signal: Optional[float] = None
+    macd_hist: Optional[float] = None
+    rsi: Optional[float] = None
+    bb_upper: Optional[float] = None
+    bb_middle: Optional[float] = None
+    bb_lower: Optional[float] = None
+    atr: Optional[float] = None
+    beta: Optional[float] = None
+
+# Fundamentals as they were at a point in time, rebuilt from the change history.
+class FundamentalSnapshot(BaseModel):
+    trading_code: str
+    version: int
+    recorded_at: datetime
+    audited_pe: Optional[float] = None
+    forward_pe: Optional[float] = None
+    eps: Optional[float] = None
+    nav: Optional[float] = None
+    dividend_yield: Optional[float] = None
+    director_holdings: Optional[float] = None
+    govt_holdings: Optional[float] = None
+    institute_holdings: Optional[float] = None
+    foreign_holdings: Optional[float] = None
+    public_holdings: Optional[float] = None
+    market_cap: Optional[float] = None
+    paid_up_capital: Optional[float] = None
+
 # Extended Stock schema that includes nested Market Data.
 class StockDetail(Stock):
     market_data: Optional[MarketData] = None
@@ -107,12 +157,22 @@ class TransactionCreate(TransactionBase):
 
 class Transaction(TransactionBase):
     id: int
-    date: datetime
+    type: Optional[TransactionType] = None # rows from before the columns were required can lack these
+    date: Optional[datetime] = None
     stock: Optional[Stock] = None # Include stock details in transaction response
 
     class Config:
         from_attributes = True
 
+# Result of a bulk broker statement import.
+class TransactionImportError(BaseModel):
+    row: int
+    detail: str
+
+class TransactionImportResult(BaseModel):
+    imported: int
+    errors: List[TransactionImportError]
+
 class WatchlistBase(BaseModel):
     stock_id: int
 
@@ -151,6 +211,89 @@ class PortfolioItem(BaseModel):
     gain_loss: float
     gain_loss_percent: float
 
+# Portfolio risk (see services/risk.py). Money amounts are in the portfolio currency,
+# volatilities and weights are fractions (0.2 = 20%).
+class RiskContribution(BaseModel):
+    trading_code: str
+    value: float
+    weight: float
+    volatility_annual: float
+    risk_contribution: float
+    risk_contribution_percent: float
+
+class CorrelationMatrix(BaseModel):
+    codes: List[str]
+    matrix: List[List[float]]
+
+class PortfolioRisk(BaseModel):
+    as_of: Optional[date] = None
+    value: float
+    volatility_daily: Optional[float] = None
+    volatility_annual: Optional[float] = None
+    var_95: Optional[float] = None
+    var_99: Optional[float] = None
+    historical_var_95: Optional[float] = None
+    holdings: List[RiskContribution]
+    correlation: CorrelationMatrix
+    missing_history: List[str]
+
+# What-if simulation (see services/simulator.py). A scenario is either a list of trades (positive
+# quantity buys, negative sells) or target weights (fractions of the portfolio value plus 'invest').
+class SimulatedTrade(BaseModel):
+    trading_code: str
+    quantity: float
+
+class SimulationScenario(BaseModel):
+    name: Optional[str] = None
+    trades: List[SimulatedTrade] = []
+    target_weights: Optional[Dict[str, float]] = None         # trading code -> weight
+    target_sector_weights: Optional[Dict[str, float]] = None  # sector name -> weight
+    invest: float = 0.0 # cash added (or withdrawn, if negative) when rebalancing to target weights
+
+class SimulationRequest(BaseModel):
+    scenarios: List[SimulationScenario] = Field(min_length=1)
+    whole_shares: bool = True # round target quantities down to whole shares
+
+class SimulatedPosition(BaseModel):
+    trading_code: str
+    quantity: float
+    change: float
+    price: float
+    value: float
+    weight: float
+
+class ScenarioResult(BaseModel):
+    name: str
+    value: float
+    cash_required: float # negative when the scenario frees cash
+    expected_dividend_income: float # per year, at current dividend yields
+    max_drawdown: Optional[float] = None # over the risk window, as a fraction
+    positions: List[SimulatedPosition]
+    sector_exposure: Dict[str, float]
+    warnings: List[str]
+
+class SimulationResult(BaseModel):
+    as_of: Optional[date] = None
+    current: ScenarioResult
+    scenarios: List[ScenarioResult]
+    missing_prices: List[str]
+    missing_history: List[str]
+
+# Portfolio history from the end-of-day snapshots (see services/portfolio_snapshots.py).
+class EquityPoint(BaseModel):
+    date: date
+    value: float
+    net_invested: float
+    gain_loss: float
+    holdings: int
+
+class DailyChange(BaseModel):
+    date: date
+    value: float
+    net_flow: float # buys minus sells that day, not counted as a gain or loss
+    change: float
+    change_percent: Optional[float] = None
+
 class PortfolioBase(BaseModel):
     stock_id: int
     quantity: float
@@ -166,3 +309,138 @@ class Portfolio(PortfolioBase):
 
     class Config:
         from_attributes = True
+
+# Home screen summary (/dashboard/summary).
+class DashboardHolding(BaseModel):
+    trading_code: str
+    quantity: float
+    average_cost: Optional[float] = None
+    ltp: float
+    value: float
+    day_change: float
+
+class Mover(BaseModel):
+    trading_code: str
+    ltp: float
+    change: float
+    change_percent: float
+
+class Movers(BaseModel):
+    gainers: List[Mover]
+    losers: List[Mover]
+
+# /market/stocks/{code}/history: one array per field, index i of each array is the same bar.
+# With ?points=N only t and close are returned (a downsampled line).
+class PriceHistory(BaseModel):
+    trading_code: str
+    interval: str
+    from_: date = Field(alias="from")
+    to: date
+    points: Optional[int] = None
+    t: List[int] # bar start, epoch seconds (UTC)
+    open: Optional[List[Optional[float]]] = None
+    high: Optional[List[Optional[float]]] = None
+    low: Optional[List[Optional[float]]] = None
+    close: List[Optional[float]]
+    volume: Optional[List[Optional[float]]] = None
+
+# /market/movers: each list holds at most 'limit' stocks.
+class MarketMover(Mover):
+    ltp: Optional[float] = None
+    change: Optional[float] = None
+    change_percent: Optional[float] = None
+    volume: Optional[float] = None
+    value: Optional[float] = None
+    high_52w: Optional[float] = None
+
+class MarketMovers(BaseModel):
+    as_of: Optional[datetime] = None
+    gainers: List[MarketMover]
+    losers: List[MarketMover]
+    most_active_by_volume: List[MarketMover]
+    most_active_by_value: List[MarketMover]
+    new_52w_highs: List[MarketMover] # trading above the previous 52-week high
+
+class MarketBreadth(BaseModel):
+    as_of: Optional[datetime] = None
+    advances: int
+    declines: int
+    unchanged: int
+    new_highs: int
+    new_lows: int
+    total_value: float
+    total_volume: float
+    total_trades: float
+
+# Market indices (see services/market_indices.py).
+class MarketIndexCreate(BaseModel):
+    code: str
+    name: str
+    kind: str # "all", "top" or "sector"
+    size: Optional[int] = None
+    sector: Optional[str] = None
+
+class MarketIndexDefinition(MarketIndexCreate):
+    id: int
+    base_value: float
+    divisor: Optional[float] = None
+    rebalanced_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class MarketIndexLevel(BaseModel):
+    code: str
+    name: str
+    kind: str
+    value: float
+    change: Optional[float] = None
+    change_percent: Optional[float] = None
+    updated_at: datetime
+
+class IndexTick(BaseModel):
+    ts: datetime
+    value: float
+    change: Optional[float] = None
+    change_percent: Optional[float] = None
+
+    class Config:
+        from_attributes = True
+
+class DashboardSummary(BaseModel):
+    total_value: float
+    total_cost: float
+    gain_loss: float
+    gain_loss_percent: float
+    day_change: float
+    day_change_percent: float
+    top_holdings: List[DashboardHolding]
+    watchlist: QuoteBatch
+    active_alerts: int
+    movers: Movers
+
+# Background jobs (/jobs).
+class JobCreate(BaseModel):
+    kind: str
+    payload: Optional[Dict[str, Any]] = None
+    priority: int = 100 # lower runs first
+    dedupe_key: Optional[str] = None
+    max_attempts: int = 3
+
+class Job(BaseModel):
+    id: int
+    kind: str
+    payload: Optional[Dict[str, Any]] = None
+    status: JobStatus
+    priority: int
+    dedupe_key: Optional[str] = None
+    attempts: int
+    max_attempts: int
+    last_error: Optional[str] = None
+    result: Optional[Any] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
@@ -0,0 +1,115 @@
+import json
+import threading
+from collections import OrderedDict
+from datetime import date
+import numpy as np
+from sqlalchemy.orm import Session
+from .. import models
+
+# Chart data for /market/stocks/{code}/history.
+#
+# Bars come from stock_prices (one row per stock per day) and are bucketed into weeks or months with
+# NumPy reduceat. Line charts can ask for a point count and get the close series reduced with LTTB
+# (Largest-Triangle-Three-Buckets), which keeps the visual shape. The response is columnar (one
+# array per field) and the encoded bytes are cached per request, so repeated fetches skip the query
+# and the JSON encoding. Entries are keyed on the endpoint's ETag (http_cache.history_headers), so
+# new or rewritten bars make old entries unused.
+
+# stock_prices only has daily bars, so there are no intraday intervals.
+INTERVALS = ["1d", "1w", "1mo"]
+CACHE_SIZE = 512
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def load_bars(db: Session, stock_id: int, start: date, end: date):
+    rows = db.query(models.StockPrice.date, models.StockPrice.open, models.StockPrice.high,
+                    models.StockPrice.low, models.StockPrice.close, models.StockPrice.volume)\
+        .filter(models.StockPrice.stock_id == stock_id,
+                models.StockPrice.date >= start, models.StockPrice.date <= end)\
+        .order_by(models.StockPrice.date).all()
+    if not rows:
+        return np.empty(0, dtype="datetime64[D]"), {f: np.empty(0) for f in ("open", "high", "low", "close", "volume")}
+    columns = list(zip(*rows))
+    days = np.array(columns[0], dtype="datetime64[D]")
+    values = {f: np.array(columns[i + 1], dtype=np.float64) # None -> nan
+              for i, f in enumerate(("open", "high", "low", "close", "volume"))}
+    # A bar without a close can't be charted.
+    keep = ~np.isnan(values["close"])
+    return days[keep], {f: v[keep] for f, v in values.items()}
+
+def _bucket_keys(days, interval):
+    if interval == "1w":
+        # DSE weeks run Sunday to Thursday; 1970-01-01 was a Thursday, so shift by 4 days.
+        return (days.astype(np.int64) + 4) // 7
+    if interval == "1mo":
+        return days.astype("datetime64[M]").astype(np.int64)
+    return days.astype(np.int64)
+
+def resample(days, values, interval):
+    # OHLCV per bucket: first open, max high, min low, last close, summed volume.
+    if interval == "1d" or len(days) == 0:
+        return days, values
+    keys = _bucket_keys(days, interval)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(days)] - 1
+    return days[starts], {
+        "open": values["open"][starts],
+        "high": np.fmax.reduceat(values["high"], starts),
+        "low": np.fmin.reduceat(values["low"], starts),
+        "close": values["close"][ends],
+        "volume": np.add.reduceat(np.nan_to_num(values["volume"]), starts),
+    }
+
+def lttb(x, y, points: int):
+    # Indexes of the points kept by Largest-Triangle-Three-Buckets. Always keeps the first and last.
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64) # points - 2 buckets between the ends
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start = edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Twice the triangle area between the previous kept point, each candidate and the next average.
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        kept[i + 1] = a
+    return kept
+
+def _column(values):
+    return [None if v != v else v for v in np.round(values, 4).tolist()]
+
+def build(db: Session, stock: models.Stock, start: date, end: date, interval: str, points: int = None):
+    days, values = resample(*load_bars(db, stock.id, start, end), interval)
+    # Timestamps are UTC midnight in epoch seconds, which chart libraries take directly.
+    t = days.astype("datetime64[s]").astype(np.int64)
+    result = {"trading_code": stock.trading_code, "interval": interval, "from": start.isoformat(), "to": end.isoformat()}
+    if points:
+        kept = lttb(t.astype(np.float64), values["close"], points)
+        result.update({"points": len(kept), "t": t[kept].tolist(), "close": _column(values["close"][kept])})
+    else:
+        result.update({"t": t.tolist(), **{f: _column(v) for f, v in values.items()}})
+    return result
+
+def get_history(db: Session, stock: models.Stock, start: date, end: date, interval: str, version: str,
+                points: int = None):
+    # Encoded JSON body, cached per (stock, range, interval, points) and data version (the ETag).
+    key = (stock.id, start, end, interval, points)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            _cache.move_to_end(key)
+            return entry[1]
+
+    body = json.dumps(build(db, stock, start, end, interval, points), separators=(",", ":")).encode()
+    with _lock:
+        _cache[key] = (version, body)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return body
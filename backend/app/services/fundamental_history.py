@@ -0,0 +1,107 @@
+from datetime import datetime
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from .. import models
+
+# Versioned fundamentals history (see models.FundamentalVersion).
+#
+# ChangeRecorder stores only the columns an import changed. compact() writes a full checkpoint
+# once a stock has CHECKPOINT_EVERY deltas since its last one, so an as-of lookup never replays
+# more than that many rows.
+
+# rsi and beta are derived from our own price history (services/indicators.py), so they are not kept.
+TRACKED_COLUMNS = [
+    "audited_pe", "forward_pe", "eps", "nav", "dividend_yield",
+    "director_holdings", "govt_holdings", "institute_holdings", "foreign_holdings", "public_holdings",
+    "market_cap", "paid_up_capital",
+]
+CHECKPOINT_EVERY = 20
+
+def snapshot_of(fundamental: models.Fundamental):
+    return {c: getattr(fundamental, c) for c in TRACKED_COLUMNS}
+
+def _changed(old, new):
+    if old is None or new is None:
+        return old != new
+    return abs(old - new) > 1e-9 * max(1.0, abs(old))
+
+def latest_versions(db: Session):
+    # {stock_id: latest version}, loaded once per import run.
+    rows = db.query(models.FundamentalVersion.stock_id, func.max(models.FundamentalVersion.version))\
+        .group_by(models.FundamentalVersion.stock_id).all()
+    return dict(rows)
+
+class ChangeRecorder:
+    # Collects version rows during an import and writes them with one bulk INSERT per flush.
+    def __init__(self, db: Session):
+        self.db = db
+        self.versions = latest_versions(db)
+        self.pending = []
+
+    def record(self, stock_id: int, old: dict, new: dict, recorded_at: datetime = None):
+        # old is None for a stock seen for the first time: its first version is a checkpoint.
+        if old is None or stock_id not in self.versions:
+            values, checkpoint = dict(new), True
+        else:
+            values = {c: new[c] for c in TRACKED_COLUMNS if _changed(old.get(c), new.get(c))}
+            checkpoint = False
+            if not values:
+                return False
+        version = self.versions.get(stock_id, 0) + 1
+        self.versions[stock_id] = version
+        self.pending.append({
+            "stock_id": stock_id, "version": version, "recorded_at": recorded_at or datetime.utcnow(),
+            "is_checkpoint": checkpoint, "values": values,
+        })
+        return True
+
+    def flush(self):
+        # The caller commits, together with the fundamentals rows themselves.
+        if self.pending:
+            self.db.execute(insert(models.FundamentalVersion), self.pending)
+            self.pending = []
+
+def _rows_as_of(db: Session, stock_ids, when: datetime):
+    # The latest checkpoint at or before 'when' and every delta after it, per stock, in one query.
+    fv = models.FundamentalVersion
+    checkpoint = db.query(fv.stock_id, func.max(fv.version).label("version"))\
+        .filter(fv.stock_id.in_(list(stock_ids)), fv.is_checkpoint == True, fv.recorded_at <= when)\
+        .group_by(fv.stock_id).subquery()
+    return db.query(fv.stock_id, fv.version, fv.recorded_at, fv.values)\
+        .join(checkpoint, (checkpoint.c.stock_id == fv.stock_id) & (fv.version >= checkpoint.c.version))\
+        .filter(fv.recorded_at <= when)\
+        .order_by(fv.stock_id, fv.version).all()
+
+def as_of_many(db: Session, stock_ids, when: datetime = None):
+    # {stock_id: {"version", "recorded_at", "values"}} as they were at 'when' (default: now).
+    states = {}
+    for row in _rows_as_of(db, stock_ids, when or datetime.utcnow()):
+        state = states.setdefault(row.stock_id, {"values": {c: None for c in TRACKED_COLUMNS}})
+        state["values"].update(row.values)
+        state["version"] = row.version
+        state["recorded_at"] = row.recorded_at
+    return states
+
+def as_of(db: Session, stock_id: int, when: datetime = None):
+    return as_of_many(db, [stock_id], when).get(stock_id)
+
+def compact(db: Session, every: int = CHECKPOINT_EVERY):
+    # Write a checkpoint for every stock with at least 'every' deltas since its last checkpoint.
+    fv = models.FundamentalVersion
+    rows = db.query(
+        fv.stock_id,
+        func.max(fv.version).label("latest"),
+        func.max(fv.version).filter(fv.is_checkpoint == True).label("checkpoint"),
+    ).group_by(fv.stock_id).all()
+
+    due = [r.stock_id for r in rows if r.latest - (r.checkpoint or 0) >= every]
+    if not due:
+        return 0
+    states = as_of_many(db, due)
+    db.execute(insert(fv), [
+        {"stock_id": stock_id, "version": state["version"] + 1, "recorded_at": state["recorded_at"],
+         "is_checkpoint": True, "values": state["values"]}
+        for stock_id, state in states.items()
+    ])
+    db.commit()
+    return len(states)
@@ -0,0 +1,295 @@
+import logging
+import threading
+import time
+from datetime import date, timedelta
+import numpy as np
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.orm import Session
+from .. import models
+from .price_history import load_price_matrix, forward_fill
+from . import snapshot
+
+logger = logging.getLogger(__name__)
+
+# Technical indicators for the whole exchange, computed from our own stock_prices history.
+#
+# Every quantity is a vector over all stocks, so each day is processed with a handful of NumPy
+# operations instead of a Python loop per stock. Recursive indicators (EMA, Wilder RSI/ATR) keep
+# their state, so a new daily bar is applied with one step instead of a full recompute.
+
+SMA_WINDOWS = (20, 50)
+EMA_FAST, EMA_SLOW, MACD_SIGNAL = 12, 26, 9
+RSI_PERIOD = 14
+ATR_PERIOD = 14
+BOLLINGER_WINDOW, BOLLINGER_K = 20, 2.0
+BETA_WINDOW = 250 # ~one trading year of daily returns
+
+# Recursive indicators converge long before this many days, so older history is not needed.
+WARMUP_DAYS = 300
+WINDOW = max(max(SMA_WINDOWS), BOLLINGER_WINDOW, BETA_WINDOW + 1)
+
+INDICATOR_NAMES = [
+    "close", "sma_20", "sma_50", "ema_12", "ema_26", "macd", "macd_signal", "macd_hist",
+    "rsi", "bb_upper", "bb_middle", "bb_lower", "atr", "beta",
+]
+
+def _alpha(period):
+    return 2.0 / (period + 1)
+
+def _nan_to(value, fill):
+    return np.where(np.isnan(value), fill, value)
+
+class IndicatorState:
+    # Recursive state for all stocks after the last processed day. Each attribute is an (S,) vector
+    # except 'closes', the (S, WINDOW) tail of closing prices used by the window based indicators.
+    def __init__(self, n_stocks):
+        nan = np.full(n_stocks, np.nan)
+        self.last_close = nan.copy()
+        self.ema_fast = nan.copy()
+        self.ema_slow = nan.copy()
+        self.macd_signal = nan.copy()
+        self.avg_gain = nan.copy()
+        self.avg_loss = nan.copy()
+        self.atr = nan.copy()
+        self.seen = np.zeros(n_stocks) # number of bars processed per stock
+        self.closes = np.full((n_stocks, WINDOW), np.nan)
+
+    def copy(self):
+        other = IndicatorState.__new__(IndicatorState)
+        other.__dict__ = {k: v.copy() for k, v in self.__dict__.items()}
+        return other
+
+    def step(self, close, high, low, roll_window=True):
+        # Advance every stock by one day. NaN inputs (no trade that day) leave a stock unchanged.
+        has_bar = ~np.isnan(close)
+        prev = self.last_close
+        first = has_bar & np.isnan(prev)
+
+        # EMAs / MACD (seeded with the first close)
+        for name, period in (("ema_fast", EMA_FAST), ("ema_slow", EMA_SLOW)):
+            ema = getattr(self, name)
+            updated = np.where(np.isnan(ema), close, ema + _alpha(period) * (close - ema))
+            setattr(self, name, np.where(has_bar, updated, ema))
+        macd = self.ema_fast - self.ema_slow
+        signal = np.where(np.isnan(self.macd_signal), macd,
+                          self.macd_signal + _alpha(MACD_SIGNAL) * (macd - self.macd_signal))
+        self.macd_signal = np.where(has_bar, signal, self.macd_signal)
+
+        # Wilder smoothing for RSI and ATR
+        delta = np.where(first, 0.0, close - prev)
+        gain, loss = np.clip(delta, 0, None), np.clip(-delta, 0, None)
+        n = np.minimum(self.seen + 1, RSI_PERIOD)
+        self.avg_gain = np.where(has_bar, _nan_to(self.avg_gain, 0.0) * (n - 1) / n + gain / n, self.avg_gain)
+        self.avg_loss = np.where(has_bar, _nan_to(self.avg_loss, 0.0) * (n - 1) / n + loss / n, self.avg_loss)
+
+        prev_close = np.where(np.isnan(prev), close, prev)
+        high = np.where(np.isnan(high), close, high)
+        low = np.where(np.isnan(low), close, low)
+        true_range = np.maximum(high - low, np.maximum(np.abs(high - prev_close), np.abs(low - prev_close)))
+        n = np.minimum(self.seen + 1, ATR_PERIOD)
+        self.atr = np.where(has_bar, _nan_to(self.atr, 0.0) * (n - 1) / n + true_range / n, self.atr)
+
+        # Rolling close window: shift left by one day, carrying the last close for stocks without a bar.
+        self.last_close = np.where(has_bar, close, prev)
+        if roll_window:
+            self.closes[:, :-1] = self.closes[:, 1:]
+            self.closes[:, -1] = self.last_close
+        self.seen = self.seen + has_bar
+
+    def values(self):
+        # Current indicator values, one (S,) vector per name.
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out = {"close": self.last_close}
+            for window in SMA_WINDOWS:
+                out[f"sma_{window}"] = self.closes[:, -window:].mean(axis=1)
+
+            out["ema_12"], out["ema_26"] = self.ema_fast, self.ema_slow
+            out["macd"] = self.ema_fast - self.ema_slow
+            out["macd_signal"] = self.macd_signal
+            out["macd_hist"] = out["macd"] - self.macd_signal
+
+            rs = self.avg_gain / self.avg_loss
+            rsi = 100.0 - 100.0 / (1.0 + rs)
+            rsi = np.where((self.avg_loss == 0) & (self.avg_gain > 0), 100.0, rsi)
+            out["rsi"] = np.where(self.seen > RSI_PERIOD, rsi, np.nan)
+
+            window = self.closes[:, -BOLLINGER_WINDOW:]
+            middle, std = window.mean(axis=1), window.std(axis=1)
+            out["bb_middle"] = middle
+            out["bb_upper"] = middle + BOLLINGER_K * std
+            out["bb_lower"] = middle - BOLLINGER_K * std
+            out["atr"] = np.where(self.seen >= ATR_PERIOD, self.atr, np.nan)
+            out["beta"] = self._beta()
+        return out
+
+    def _beta(self):
+        # beta_i = cov(r_i, r_m) / var(r_m) over the last BETA_WINDOW daily returns, where the
+        # market return r_m is the equal-weighted average return of all stocks that day.
+        closes = self.closes[:, -(BETA_WINDOW + 1):]
+        returns = closes[:, 1:] / closes[:, :-1] - 1.0
+        market = np.nanmean(returns, axis=0)
+        valid = ~np.isnan(returns) & ~np.isnan(market)
+        count = valid.sum(axis=1)
+
+        r = np.where(valid, returns, 0.0)
+        m = np.where(valid, market, 0.0)
+        r_mean = r.sum(axis=1) / count
+        m_mean = m.sum(axis=1) / count
+        cov = (r * m).sum(axis=1) / count - r_mean * m_mean
+        var = (m * m).sum(axis=1) / count - m_mean * m_mean
+        beta = cov / var
+        return np.where(count >= 20, beta, np.nan) # not meaningful with less than a month of data
+
+class IndicatorEngine:
+    def __init__(self):
+        self.stock_ids = np.empty(0, dtype=np.int64)
+        self.row = {}
+        self.last_date = None
+        self.state = IndicatorState(0)
+        self._before_last = None # state before last_date's bar, to re-apply an intraday update
+        self._values = {}
+
+    @property
+    def ready(self):
+        return self.last_date is not None
+
+    def fit(self, db: Session):
+        # Full recompute: only the last WARMUP_DAYS calendar days of history are needed.
+        latest = db.query(func.max(models.StockPrice.date)).scalar()
+        if latest is None:
+            self.__init__()
+            return self
+        matrix = load_price_matrix(db, start_date=latest - timedelta(days=WARMUP_DAYS * 7 // 5))
+
+        started = time.perf_counter()
+        state = IndicatorState(len(matrix.stock_ids))
+        before_last = state
+        for t in range(len(matrix.dates)):
+            if t == len(matrix.dates) - 1:
+                before_last = state.copy()
+            # One vectorized step per day for all stocks. A NaN close (no trade) skips that stock.
+            # The close window is filled in one go below instead of being rolled every day.
+            state.step(matrix.close[:, t], matrix.high[:, t], matrix.low[:, t], roll_window=False)
+        tail = forward_fill(matrix.close)[:, -WINDOW:]
+        state.closes[:, WINDOW - tail.shape[1]:] = tail
+        if before_last is not state:
+            before_last.closes = state.closes.copy()
+            before_last.closes[:, 1:] = before_last.closes[:, :-1]
+            before_last.closes[:, 0] = np.nan
+
+        self.stock_ids, self.row = matrix.stock_ids, matrix.row
+        self.state, self._before_last = state, before_last
+        self.last_date = matrix.last_date
+        self._values = state.values()
+        logger.info(f"Indicators computed for {len(self.stock_ids)} stocks x {len(matrix.dates)} days "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return self
+
+    def update(self, bar_date: date, bars):
+        # Apply one daily bar for many stocks: bars = {stock_id: (close, high, low)}.
+        # The same day can be applied repeatedly during trading hours; it replaces the previous version.
+        if not self.ready or bar_date < self.last_date:
+            return False
+        if any(stock_id not in self.row for stock_id in bars):
+            return False # a new listing: the caller should fit() again
+
+        close, high, low = (np.full(len(self.stock_ids), np.nan) for _ in range(3))
+        for stock_id, (c, h, l) in bars.items():
+            i = self.row[stock_id]
+            close[i], high[i], low[i] = c, h, l
+
+        if bar_date == self.last_date:
+            self.state = self._before_last.copy()
+        else:
+            self._before_last = self.state.copy()
+            self.last_date = bar_date
+        self.state.step(close, high, low)
+        self._values = self.state.values()
+        return True
+
+    def get(self, stock_id: int):
+        i = self.row.get(stock_id)
+        if i is None:
+            return None
+        values = {name: float(self._values[name][i]) for name in INDICATOR_NAMES}
+        return {name: (None if v != v else v) for name, v in values.items()}
+
+    def save(self, db: Session):
+        # Write RSI and beta back to fundamentals in one executemany UPDATE.
+        # Stocks without enough history keep their previous (imported) values.
+        params = []
+        for i, stock_id in enumerate(self.stock_ids.tolist()):
+            rsi, beta = self._values["rsi"][i], self._values["beta"][i]
+            if not (np.isnan(rsi) and np.isnan(beta)):
+                params.append({
+                    "b_stock_id": stock_id,
+                    "b_rsi": None if np.isnan(rsi) else float(rsi),
+                    "b_beta": None if np.isnan(beta) else float(beta),
+                })
+        if params:
+            table = models.Fundamental.__table__
+            db.execute(
+                update(table)
+                .where(table.c.stock_id == bindparam("b_stock_id"))
+                .values(rsi=func.coalesce(bindparam("b_rsi"), table.c.rsi),
+                        beta=func.coalesce(bindparam("b_beta"), table.c.beta)),
+                params
+            )
+            db.commit()
+        return len(params)
+
+# Process-wide engine, loaded on first use.
+engine = IndicatorEngine()
+_lock = threading.Lock()
+_checked_at = 0.0
+_seen_version = None
+REFRESH_CHECK_SECONDS = 60
+
+def _apply_new_bars(db: Session):
+    # Re-read the bars of engine.last_date and later and apply them as incremental updates.
+    # Intraday scrapes rewrite today's bar, so this also picks up price changes within the day.
+    rows = (
+        db.query(models.StockPrice.date, models.StockPrice.stock_id, models.StockPrice.close,
+                 models.StockPrice.high, models.StockPrice.low)
+        .filter(models.StockPrice.date >= engine.last_date, models.StockPrice.close.isnot(None))
+        .order_by(models.StockPrice.date)
+        .all()
+    )
+    days = {}
+    for day, stock_id, close, high, low in rows:
+        days.setdefault(day, {})[stock_id] = (close, high, low)
+    for day, bars in days.items():
+        if not engine.update(day, bars):
+            engine.fit(db) # a new listing
+            return
+
+def get_engine(db: Session):
+    # Returns the shared engine, kept in step with bars written by another process (the scraper).
+    # The scraper publishes a new snapshot version after every scrape, so a version change here means
+    # new or updated bars: they are applied with update(), not a full refit. Reading the version is a
+    # memory read; without a snapshot we fall back to checking the database once a minute.
+    global _checked_at, _seen_version
+    with _lock:
+        version = snapshot.reader.version
+        if not engine.ready:
+            engine.fit(db)
+        elif (version and version != _seen_version) or time.monotonic() - _checked_at > REFRESH_CHECK_SECONDS:
+            _apply_new_bars(db)
+        else:
+            return engine
+        _seen_version, _checked_at = version, time.monotonic()
+    return engine
+
+def on_daily_bars(db: Session, bar_date: date, bars):
+    # Hook for the scraper: bars = {stock_id: (close, high, low)}.
+    with _lock:
+        if engine.ready and engine.update(bar_date, bars):
+            return engine
+        engine.fit(db)
+    return engine
+
+def recompute(db: Session):
+    # Full recompute + write back, used by imports and scheduled jobs.
+    with _lock:
+        engine.fit(db)
+        return engine.save(db)
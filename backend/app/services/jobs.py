@@ -0,0 +1,173 @@
+import logging
+import os
+import socket
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Durable job queue in Postgres (the jobs table).
+#
+# The API only enqueues; worker.py claims and runs jobs in its own process pool:
+#   - claim() takes due QUEUED jobs, lowest priority number first, with FOR UPDATE SKIP LOCKED, so
+#     any number of workers can poll the same table without taking the same job,
+#   - a claimed job is RUNNING with a lease (run_after = now + LEASE_SECONDS) that the worker keeps
+#     renewing; if the worker dies, the lease runs out and another worker picks the job up again,
+#   - a failed job is retried with backoff until max_attempts, then marked FAILED,
+#   - a dedupe_key allows only one queued/running job per key (e.g. one pending scrape).
+#
+# The handlers for each kind live in worker.py. Payloads are checked against PAYLOAD_FIELDS when a
+# job is queued; file paths must lie inside IMPORT_DIR, and worker.py checks them again before use.
+
+JOB_KINDS = ["scrape", "import_fundamentals", "recompute_indicators", "portfolio_snapshots",
+             "backfill_history"]
+# Kinds any logged-in user may queue through /jobs; the others need the admin token.
+USER_JOB_KINDS = ["scrape"]
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+IMPORT_DIR = os.path.realpath(os.getenv("IMPORT_DIR", os.path.join(os.path.dirname(__file__), "..", "..", "imports")))
+ACTIVE = (models.JobStatus.QUEUED, models.JobStatus.RUNNING)
+
+def import_path(path):
+    # Absolute path of a file or directory inside IMPORT_DIR (relative paths are taken from there).
+    if not isinstance(path, str) or not path:
+        raise ValueError("Path must be a non-empty string")
+    resolved = os.path.realpath(os.path.join(IMPORT_DIR, path))
+    if os.path.commonpath([resolved, IMPORT_DIR]) != IMPORT_DIR:
+        raise ValueError(f"Path must be inside the import directory ({IMPORT_DIR})")
+    return resolved
+
+def _iso_date(value):
+    if not isinstance(value, str):
+        raise ValueError("Dates must be YYYY-MM-DD strings")
+    date.fromisoformat(value) # raises ValueError
+    return value
+
+def _workers(value):
+    if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= 64:
+        raise ValueError("workers must be an integer from 1 to 64")
+    return value
+
+def _flag(value):
+    if not isinstance(value, bool):
+        raise ValueError("restart must be true or false")
+    return value
+
+# Allowed payload keys per kind, each with a function that checks (and normalises) the value.
+PAYLOAD_FIELDS = {
+    "scrape": {},
+    "import_fundamentals": {"path": import_path},
+    "recompute_indicators": {},
+    "portfolio_snapshots": {"date": _iso_date, "start": _iso_date, "end": _iso_date},
+    "backfill_history": {"directory": import_path, "workers": _workers, "restart": _flag},
+}
+REQUIRED_FIELDS = {"backfill_history": ["directory"]}
+
+def validate_payload(kind: str, payload: dict):
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    payload = payload or {}
+    fields = PAYLOAD_FIELDS[kind]
+    unknown = set(payload) - set(fields)
+    if unknown:
+        raise ValueError(f"Unexpected payload field(s) for '{kind}': {', '.join(sorted(unknown))}")
+    missing = [f for f in REQUIRED_FIELDS.get(kind, []) if f not in payload]
+    if missing:
+        raise ValueError(f"Missing payload field(s) for '{kind}': {', '.join(missing)}")
+    return {key: fields[key](value) for key, value in payload.items()}
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _backoff(attempts: int):
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+def enqueue(db: Session, kind: str, payload: dict = None, priority: int = 100, dedupe_key: str = None,
+            max_attempts: int = 3, run_after: datetime = None, user_id: int = None):
+    # Returns the new job, or the already active job with the same dedupe_key.
+    payload = validate_payload(kind, payload)
+    job = models.Job(kind=kind, payload=payload, priority=priority, dedupe_key=dedupe_key, user_id=user_id,
+                     max_attempts=max_attempts, run_after=run_after or datetime.utcnow())
+    try:
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+    except IntegrityError:
+        # The partial unique index on dedupe_key is the atomic check.
+        db.rollback()
+        return db.query(models.Job)\
+            .filter(models.Job.dedupe_key == dedupe_key, models.Job.status.in_(ACTIVE)).first()
+
+def get_job(db: Session, job_id: int):
+    return db.query(models.Job).filter(models.Job.id == job_id).first()
+
+def list_jobs(db: Session, status: models.JobStatus = None, kind: str = None, limit: int = 50, user_id: int = None):
+    query = db.query(models.Job)
+    if user_id is not None:
+        query = query.filter(models.Job.user_id == user_id)
+    if status:
+        query = query.filter(models.Job.status == status)
+    if kind:
+        query = query.filter(models.Job.kind == kind)
+    return query.order_by(models.Job.id.desc()).limit(limit).all()
+
+def claim(db: Session, owner: str, limit: int, kinds=None):
+    # Claim up to 'limit' due jobs: queued ones, and running ones whose worker stopped renewing the lease.
+    now = datetime.utcnow()
+    query = select(models.Job.id, models.Job.kind, models.Job.payload, models.Job.attempts,
+                   models.Job.max_attempts, models.Job.status)\
+        .where(models.Job.run_after <= now, models.Job.status.in_(ACTIVE))\
+        .order_by(models.Job.priority, models.Job.run_after, models.Job.id)\
+        .limit(limit)\
+        .with_for_update(skip_locked=True)
+    if kinds:
+        query = query.where(models.Job.kind.in_(list(kinds)))
+    rows = db.execute(query).all()
+    # A job whose worker died on its last allowed attempt (e.g. killed for using too much memory)
+    # is not started again.
+    exhausted = [r.id for r in rows if r.status == models.JobStatus.RUNNING and r.attempts >= r.max_attempts]
+    if exhausted:
+        db.execute(
+            update(models.Job).where(models.Job.id.in_(exhausted))
+            .values(status=models.JobStatus.FAILED, finished_at=now, locked_by=None,
+                    last_error="Worker stopped while running the job (lease expired)")
+        )
+        rows = [r for r in rows if r.id not in exhausted]
+    if rows:
+        db.execute(
+            update(models.Job)
+            .where(models.Job.id.in_([r.id for r in rows]))
+            .values(status=models.JobStatus.RUNNING, attempts=models.Job.attempts + 1, locked_by=owner,
+                    started_at=now, run_after=now + timedelta(seconds=LEASE_SECONDS))
+        )
+    db.commit()
+    return rows
+
+def renew(db: Session, owner: str, job_ids):
+    # Called by the worker while its jobs run.
+    if job_ids:
+        db.execute(
+            update(models.Job)
+            .where(models.Job.id.in_(list(job_ids)), models.Job.locked_by == owner,
+                   models.Job.status == models.JobStatus.RUNNING)
+            .values(run_after=datetime.utcnow() + timedelta(seconds=LEASE_SECONDS))
+        )
+        db.commit()
+
+def finish(db: Session, job_id: int, owner: str, result=None, error: str = None):
+    job = db.query(models.Job).filter(models.Job.id == job_id, models.Job.locked_by == owner).first()
+    if job is None or job.status != models.JobStatus.RUNNING:
+        return # the lease ran out and another worker took the job over
+    now = datetime.utcnow()
+    if error is None:
+        job.status, job.result, job.last_error, job.finished_at = models.JobStatus.SUCCEEDED, result, None, now
+    elif job.attempts >= job.max_attempts:
+        job.status, job.last_error, job.finished_at = models.JobStatus.FAILED, error[:2000], now
+    else:
+        job.status, job.last_error, job.run_after = models.JobStatus.QUEUED, error[:2000], now + _backoff(job.attempts)
+    job.locked_by = None
+    db.commit()
+    logger.info(f"Job {job_id} {job.status.value.lower()}" + (f": {error}" if error else ""))
@@ -0,0 +1,231 @@
+import logging
+import os
+import re
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# Free-float market-cap weighted indices (all-share, top N by market cap, one per sector).
+#
+#   level = sum(free float shares * price) / divisor
+#
+# Constituents and their free float shares are fixed at a rebalance: once a day, and whenever the
+# fundamentals or the index definitions change. At a rebalance the divisor is scaled so the level
+# doesn't jump (new cap / old cap at the same prices), and stored, so a restart continues the series.
+# The rebalance values the constituents at the prices the caps were last computed with; the scrape
+# that triggered it then moves them to the new prices like any other scrape.
+# Between rebalances a scrape only touches the stocks whose price changed: each one moves the cached
+# cap of the indices it belongs to by shares * (new price - old price). A tick is stored for every
+# index that moved.
+#
+# Scrapes can run in any worker process, each with its own calculator. The stored divisor is the one
+# that counts: a process only scales it if it is still the divisor that process last saw, otherwise
+# another process has already rebalanced and its divisor is used as it is.
+
+BASE_VALUE = 1000.0
+FACE_VALUE = 10.0 # DSE shares have a face value of Tk 10, so paid-up capital / 10 is the share count
+DEFAULT_INDICES = [
+    {"code": "ALL", "name": "All Share Index", "kind": "all"},
+    {"code": "TOP30", "name": "Top 30 Index", "kind": "top", "size": 30},
+]
+# One index per sector, created automatically for every sector that has stocks.
+SECTOR_INDICES = os.getenv("SECTOR_INDICES", "true").lower() == "true"
+KINDS = ["all", "top", "sector"]
+
+def sector_code(sector: str):
+    return "SECTOR-" + re.sub(r"[^A-Z0-9]+", "-", sector.upper()).strip("-")
+
+class IndexState:
+    def __init__(self, definition: models.MarketIndex, shares, prices, previous_prices):
+        self.id = definition.id
+        self.code = definition.code
+        self.shares = shares # stock_id -> free float shares
+        self.cap = sum(s * prices[sid] for sid, s in shares.items())
+        self.previous_cap = sum(s * previous_prices[sid] for sid, s in shares.items())
+        self.divisor = definition.divisor
+        self.previous_close = None # level at the previous trading day's close, set by the rebalance
+
+    @property
+    def value(self):
+        return self.cap / self.divisor if self.divisor else None
+
+    def tick(self, now):
+        change = self.value - self.previous_close
+        return {"index_id": self.id, "ts": now, "value": self.value, "change": change,
+                "change_percent": change / self.previous_close * 100 if self.previous_close else None}
+
+class IndexCalculator:
+    def __init__(self):
+        self.indices = {}                # index id -> IndexState
+        self.members = defaultdict(list) # stock_id -> [IndexState] containing it
+        self.prices = {}                 # stock_id -> price the caps were computed with
+        self.rebalance_key = None
+        self.day = None
+        self._lock = threading.Lock()
+
+    def _ensure_definitions(self, db: Session):
+        existing = {code for (code,) in db.query(models.MarketIndex.code).all()}
+        wanted = list(DEFAULT_INDICES)
+        if SECTOR_INDICES:
+            sectors = db.query(func.coalesce(models.Sector.name, models.Stock.sector)).select_from(models.Stock)\
+                .outerjoin(models.Sector, models.Sector.id == models.Stock.sector_id).distinct().all()
+            wanted += [{"code": sector_code(s), "name": f"{s} Index", "kind": "sector", "sector": s}
+                       for (s,) in sectors if s]
+        for definition in wanted:
+            if definition["code"] not in existing:
+                db.add(models.MarketIndex(**definition, base_value=BASE_VALUE))
+        db.commit()
+
+    def _rebalance_key(self, db: Session):
+        # Changes when a rebalance is due: a new day, a fundamentals import, a new index definition.
+        fundamentals = db.query(func.max(models.Fundamental.last_updated)).scalar()
+        definitions = db.query(func.count(models.MarketIndex.id), func.max(models.MarketIndex.id)).one()
+        return (date.today(), fundamentals, tuple(definitions))
+
+    def _rebalance(self, db: Session):
+        self._ensure_definitions(db)
+        # Locked until the commit below, so two processes don't scale the same divisor.
+        definitions = db.query(models.MarketIndex).with_for_update().all()
+        if any(d.id in self.indices and self.indices[d.id].divisor != d.divisor for d in definitions):
+            # Another process has rebalanced since this one last did, so its state is out of date:
+            # start over from the stored divisors and the current prices, as after a restart.
+            self.indices, self.prices = {}, {}
+        md, f = models.MarketData, models.Fundamental
+        rows = db.query(
+            models.Stock.id, func.coalesce(models.Sector.name, models.Stock.sector), md.ltp, md.ycp,
+            f.paid_up_capital, f.market_cap, f.director_holdings, f.govt_holdings,
+        ).outerjoin(models.Sector, models.Sector.id == models.Stock.sector_id)\
+            .join(md, md.stock_id == models.Stock.id)\
+            .join(f, f.stock_id == models.Stock.id).all()
+
+        prices, previous, shares, full_cap, sectors = {}, {}, {}, {}, {}
+        for stock_id, sector, ltp, ycp, paid_up, market_cap, director, govt in rows:
+            # The market data already holds this scrape's prices; the caps are still at self.prices.
+            price = self.prices.get(stock_id) or ltp or ycp
+            if not price:
+                continue
+            count = paid_up / FACE_VALUE if paid_up else (market_cap / price if market_cap else None)
+            # Free float: everything not held by sponsors/directors or the government.
+            free_float = max(0.0, 1.0 - ((director or 0.0) + (govt or 0.0)) / 100)
+            if not count or not free_float:
+                continue
+            prices[stock_id], previous[stock_id] = price, ycp or price
+            shares[stock_id] = count * free_float
+            full_cap[stock_id] = count * price
+            sectors[stock_id] = sector
+
+        by_cap = sorted(shares, key=lambda sid: -full_cap[sid])
+        old_states = self.indices
+        self.indices, self.members = {}, defaultdict(list)
+        now = datetime.utcnow()
+        for definition in definitions:
+            if definition.kind == "all":
+                members = list(shares)
+            elif definition.kind == "top":
+                members = by_cap[:definition.size or 30]
+            else:
+                members = [sid for sid in shares if sectors[sid] == definition.sector]
+            if not members:
+                continue
+            state = IndexState(definition, {sid: shares[sid] for sid in members}, prices, previous)
+            old = old_states.get(definition.id)
+            if definition.divisor is None:
+                # A new index starts at its base value at yesterday's close.
+                definition.divisor = state.previous_cap / (definition.base_value or BASE_VALUE)
+            elif old is not None and old.cap:
+                # Same level before and after the rebalance, both valued at self.prices.
+                definition.divisor = old.divisor * state.cap / old.cap
+            # After a restart (or another process's rebalance) the stored divisor carries the series on.
+            definition.rebalanced_at = now
+            state.divisor = definition.divisor
+            if old is not None:
+                # Within a day the previous close stays as it was; on a new day it is the last level.
+                state.previous_close = old.previous_close if self.day == date.today() else old.value
+            else:
+                state.previous_close = state.previous_cap / state.divisor if state.divisor else None
+            self.indices[definition.id] = state
+            for sid in members:
+                self.members[sid].append(state)
+        db.commit()
+        self.prices = prices
+        self.day = date.today()
+        logger.info(f"Rebalanced {len(self.indices)} indices over {len(shares)} stocks")
+        return list(self.indices.values())
+
+    def update(self, db: Session, prices):
+        # prices: {stock_id: last traded price} for the stocks that traded in this scrape.
+        # Returns the number of ticks stored.
+        with self._lock:
+            key = self._rebalance_key(db)
+            if key != self.rebalance_key:
+                moved = set(self._rebalance(db))
+                self.rebalance_key = key
+            else:
+                moved = set()
+            for stock_id, price in prices.items():
+                old = self.prices.get(stock_id)
+                if not price or old is None or price == old:
+                    continue # unchanged, or not an index constituent
+                self.prices[stock_id] = price
+                for state in self.members.get(stock_id, ()):
+                    state.cap += state.shares[stock_id] * (price - old)
+                    moved.add(state)
+            now = datetime.utcnow()
+            ticks = [state.tick(now) for state in moved if state.divisor]
+            if ticks:
+                db.execute(insert(models.IndexTick), ticks)
+                db.commit()
+            return len(ticks)
+
+# Per-process calculator, fed by the scraper.
+calculator = IndexCalculator()
+
+def on_prices(db: Session, prices):
+    return calculator.update(db, prices)
+
+# --- Reads for the API (from the stored ticks, so any process can answer) ---
+
+def latest(db: Session):
+    last = db.query(models.IndexTick.index_id, func.max(models.IndexTick.ts).label("ts"))\
+        .group_by(models.IndexTick.index_id).subquery()
+    rows = db.query(models.MarketIndex, models.IndexTick)\
+        .join(last, last.c.index_id == models.MarketIndex.id)\
+        .join(models.IndexTick, (models.IndexTick.index_id == last.c.index_id) & (models.IndexTick.ts == last.c.ts))\
+        .order_by(models.MarketIndex.id).all()
+    return [
+        {"code": index.code, "name": index.name, "kind": index.kind, "value": tick.value,
+         "change": tick.change, "change_percent": tick.change_percent, "updated_at": tick.ts}
+        for index, tick in rows
+    ]
+
+def get_index(db: Session, code: str):
+    return db.query(models.MarketIndex).filter(models.MarketIndex.code == code.upper()).first()
+
+def ticks(db: Session, index: models.MarketIndex, start: datetime = None, end: datetime = None, limit: int = 1000):
+    query = db.query(models.IndexTick).filter(models.IndexTick.index_id == index.id)
+    if start:
+        query = query.filter(models.IndexTick.ts >= start)
+    if end:
+        query = query.filter(models.IndexTick.ts <= end)
+    # The most recent 'limit' ticks, oldest first.
+    return list(reversed(query.order_by(models.IndexTick.ts.desc()).limit(limit).all()))
+
+def create_index(db: Session, code: str, name: str, kind: str, size: int = None, sector: str = None):
+    if kind not in KINDS:
+        raise ValueError(f"Index kind must be one of {', '.join(KINDS)}")
+    if kind == "top" and not size:
+        raise ValueError("A 'top' index needs a size")
+    if kind == "sector" and not sector:
+        raise ValueError("A 'sector' index needs a sector")
+    if get_index(db, code):
+        raise ValueError(f"Index '{code.upper()}' already exists")
+    index = models.MarketIndex(code=code.upper(), name=name, kind=kind, size=size, sector=sector, base_value=BASE_VALUE)
+    db.add(index)
+    db.commit()
+    db.refresh(index)
+    return index
@@ -0,0 +1,206 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import date, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models
+from . import snapshot
+
+# Market movers and breadth, kept up to date incrementally.
+#
+# Each worker keeps the board in memory: one sorted array per ranking (percent change, volume, value,
+# distance to the 52-week high) and running totals for breadth. When a new snapshot is published
+# (or, without a snapshot, every DB_REFRESH_SECONDS) only the stocks whose numbers changed are moved
+# inside the arrays and the totals. A read takes K entries from one end of an array.
+#
+# updated_at is bumped for every stock on every scrape, so it is not part of the comparison: it only
+# feeds as_of, the newest update on the board.
+
+DB_REFRESH_SECONDS = 15
+MAX_LIMIT = 50
+RANKINGS = ["change_percent", "volume", "value", "high_gap"]
+
+class Ranking:
+    # Stocks ordered by one value, ascending. Entries are (value, stock_id) so equal values stay stable.
+    def __init__(self):
+        self.entries = []
+        self.current = {} # stock_id -> its entry
+
+    def set(self, stock_id: int, value):
+        old = self.current.pop(stock_id, None)
+        if old is not None:
+            del self.entries[bisect_left(self.entries, old)]
+        if value is not None:
+            entry = (value, stock_id)
+            insort(self.entries, entry)
+            self.current[stock_id] = entry
+
+    def lowest(self):
+        return iter(self.entries)
+
+    def highest(self):
+        return reversed(self.entries)
+
+class MarketBoard:
+    def __init__(self):
+        self.rows = {}       # stock_id -> row dict
+        self.rankings = {name: Ranking() for name in RANKINGS}
+        self.extremes = {}   # stock_id -> (52-week high, 52-week low), before today
+        self.extremes_date = None
+        self.version = None
+        self.loaded_at = 0.0
+        self.as_of = None
+        self.totals = {"advances": 0, "declines": 0, "unchanged": 0, "new_highs": 0, "new_lows": 0,
+                       "total_value": 0.0, "total_volume": 0.0, "total_trades": 0.0}
+        self._lock = threading.Lock()
+
+    # --- loading ---
+
+    def _load_extremes(self, db: Session):
+        # 52-week high/low from the daily bars before today (today's bar is still moving).
+        today = date.today()
+        rows = db.query(models.StockPrice.stock_id, func.max(models.StockPrice.high), func.min(models.StockPrice.low))\
+            .filter(models.StockPrice.date >= today - timedelta(days=365), models.StockPrice.date < today)\
+            .group_by(models.StockPrice.stock_id).all()
+        self.extremes = {stock_id: (high, low) for stock_id, high, low in rows}
+        self.extremes_date = today
+
+    def _rows_from_snapshot(self):
+        def copy(records, version):
+            columns = [records[f].tolist() for f in ("stock_id", "trading_code", "ltp", "ycp", "change",
+                                                     "volume", "value", "trade", "updated_at")]
+            return version, {
+                stock_id: ((code.decode(), *[None if v != v else v for v in values]),
+                           None if updated_at != updated_at else updated_at)
+                for stock_id, code, *values, updated_at in zip(*columns)
+            }
+        return snapshot.reader.read(copy)
+
+    def _rows_from_db(self, db: Session):
+        md = models.MarketData
+        rows = db.query(models.Stock.id, models.Stock.trading_code, md.ltp, md.ycp, md.change,
+                        md.volume, md.value, md.trade, md.updated_at)\
+            .join(md, md.stock_id == models.Stock.id).all()
+        return {row[0]: ((row[1], *row[2:8]), snapshot.to_timestamp(row[8])) for row in rows}
+
+    def sync(self, db: Session):
+        # Bring the board up to date. Cheap when nothing was published since the last call.
+        with self._lock:
+            if self.extremes_date != date.today():
+                self._load_extremes(db)
+                self._clear() # every high_gap changes with the new extremes
+
+            loaded = self._rows_from_snapshot()
+            if loaded is not None:
+                version, rows = loaded
+                if version == self.version:
+                    return
+            elif self.version is None and time.monotonic() - self.loaded_at < DB_REFRESH_SECONDS:
+                return
+            else:
+                version, rows = None, self._rows_from_db(db)
+            self._apply(rows)
+            self.version = version
+            self.loaded_at = time.monotonic()
+
+    def _clear(self):
+        for stock_id in list(self.rows):
+            self._remove(stock_id)
+        self.version = None
+        self.loaded_at = 0.0
+
+    # --- incremental updates ---
+
+    def _apply(self, new_rows):
+        # new_rows: stock_id -> (raw, updated_at)
+        for stock_id in [s for s in self.rows if s not in new_rows]:
+            self._remove(stock_id)
+        for stock_id, (raw, _) in new_rows.items():
+            old = self.rows.get(stock_id)
+            if old is None or old["raw"] != raw:
+                if old is not None:
+                    self._remove(stock_id)
+                self._add(stock_id, raw)
+        self.as_of = max((u for _, u in new_rows.values() if u is not None), default=None)
+
+    def _add(self, stock_id, raw):
+        code, ltp, ycp, change, volume, value, trade = raw
+        percent = (ltp - ycp) / ycp * 100 if ltp and ycp else None
+        high, low = self.extremes.get(stock_id, (None, None))
+        row = {
+            "raw": raw, "trading_code": code, "ltp": ltp, "change": change, "change_percent": percent,
+            "volume": volume, "value": value, "trades": trade,
+            "high_52w": high, "low_52w": low,
+            "high_gap": (ltp - high) / high * 100 if ltp and high else None,
+        }
+        self.rows[stock_id] = row
+        for name in RANKINGS:
+            self.rankings[name].set(stock_id, row[name])
+        self._count(row, 1)
+
+    def _remove(self, stock_id):
+        row = self.rows.pop(stock_id)
+        for name in RANKINGS:
+            self.rankings[name].set(stock_id, None)
+        self._count(row, -1)
+
+    def _count(self, row, sign):
+        totals = self.totals
+        percent = row["change_percent"]
+        if percent is not None:
+            key = "advances" if percent > 0 else "declines" if percent < 0 else "unchanged"
+            totals[key] += sign
+        if row["ltp"] and row["high_52w"] and row["ltp"] > row["high_52w"]:
+            totals["new_highs"] += sign
+        if row["ltp"] and row["low_52w"] and row["ltp"] < row["low_52w"]:
+            totals["new_lows"] += sign
+        totals["total_value"] += sign * (row["value"] or 0.0)
+        totals["total_volume"] += sign * (row["volume"] or 0.0)
+        totals["total_trades"] += sign * (row["trades"] or 0.0)
+
+    # --- reads, O(K) ---
+
+    def _take(self, entries, k, keep=lambda value: True):
+        result = []
+        for value, stock_id in entries:
+            if len(result) == k or not keep(value):
+                break
+            row = self.rows[stock_id]
+            result.append({f: row[f] for f in ("trading_code", "ltp", "change", "change_percent",
+                                               "volume", "value", "high_52w")})
+        return result
+
+    def movers(self, k: int):
+        with self._lock:
+            r = self.rankings
+            return {
+                "as_of": snapshot.from_timestamp(self.as_of) if self.as_of is not None else None,
+                "gainers": self._take(r["change_percent"].highest(), k, lambda v: v > 0),
+                "losers": self._take(r["change_percent"].lowest(), k, lambda v: v < 0),
+                "most_active_by_volume": self._take(r["volume"].highest(), k, lambda v: v > 0),
+                "most_active_by_value": self._take(r["value"].highest(), k, lambda v: v > 0),
+                "new_52w_highs": self._take(r["high_gap"].highest(), k, lambda v: v > 0),
+            }
+
+    def breadth(self):
+        with self._lock:
+            totals = dict(self.totals)
+            totals["as_of"] = snapshot.from_timestamp(self.as_of) if self.as_of is not None else None
+            return totals
+
+# Per-process board.
+board = MarketBoard()
+
+def market_movers(db: Session, k: int = 10):
+    board.sync(db)
+    return board.movers(min(k, MAX_LIMIT))
+
+def market_breadth(db: Session):
+    board.sync(db)
+    return board.breadth()
+
+def top_movers(db: Session, k: int = 5):
+    # Gainers and losers for the dashboard summary.
+    movers = market_movers(db, k)
+    return {"gainers": movers["gainers"], "losers": movers["losers"]}
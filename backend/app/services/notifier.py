@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from .. import models, database
+
+logger = logging.getLogger(__name__)
+
+# Notification dispatcher.
+#
+# Drains the notifications outbox in batches, independently of scraping and of the API:
+#   1. claim a batch of due rows with FOR UPDATE SKIP LOCKED, so several dispatchers never
+#      pick the same row, and push their next_attempt_at forward as a lease (if a dispatcher
+#      dies mid-batch the rows become due again when the lease runs out),
+#   2. coalesce the batch per (user, channel), so a user whose ten alerts fired in the same
+#      scrape gets one message,
+#   3. send with bounded concurrency, then mark rows SENT, or schedule a retry with backoff,
+#      or give up (FAILED) after MAX_ATTEMPTS.
+
+BATCH_SIZE = int(os.getenv("NOTIFIER_BATCH_SIZE", "200"))
+CONCURRENCY = int(os.getenv("NOTIFIER_CONCURRENCY", "20"))
+MAX_ATTEMPTS = int(os.getenv("NOTIFIER_MAX_ATTEMPTS", "5"))
+LEASE_SECONDS = 60
+POLL_SECONDS = 2.0
+
+class LogSink:
+    # Default channel: writes the message to the log.
+    async def send(self, user_id, payloads):
+        logger.info(f"Notify user {user_id}: " + ", ".join(
+            f"{p['trading_code']} {p['condition']} {p['target_price']} (ltp {p['ltp']})" for p in payloads
+        ))
+
+class MemorySink:
+    # Local stand-in for tests and development: keeps every delivery in memory.
+    # fail_times makes the first N sends raise, to exercise retries.
+    def __init__(self, fail_times: int = 0):
+        self.sent = []
+        self.fail_times = fail_times
+
+    async def send(self, user_id, payloads):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise RuntimeError("Simulated delivery failure")
+        self.sent.append((user_id, list(payloads)))
+
+class WebhookSink:
+    # POSTs {"user_id": ..., "alerts": [...]} to NOTIFICATION_WEBHOOK_URL.
+    def __init__(self, url: str, timeout: float = 10.0):
+        import httpx
+        self.url = url
+        self.client = httpx.AsyncClient(timeout=timeout)
+
+    async def send(self, user_id, payloads):
+        response = await self.client.post(self.url, json={"user_id": user_id, "alerts": payloads})
+        response.raise_for_status()
+
+def default_sinks():
+    sinks = {"log": LogSink()}
+    if os.getenv("NOTIFICATION_WEBHOOK_URL"):
+        sinks["webhook"] = WebhookSink(os.getenv("NOTIFICATION_WEBHOOK_URL"))
+    return sinks
+
+def _backoff(attempts: int):
+    return timedelta(seconds=min(30 * 2 ** (attempts - 1), 3600))
+
+class Dispatcher:
+    def __init__(self, sinks=None, session_factory=database.SessionLocal,
+                 batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY, max_attempts: int = MAX_ATTEMPTS):
+        self.sinks = sinks if sinks is not None else default_sinks()
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_attempts = max_attempts
+
+    def claim(self):
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            rows = db.execute(
+                select(models.Notification.id, models.Notification.user_id, models.Notification.channel,
+                       models.Notification.payload, models.Notification.attempts)
+                .where(models.Notification.status == models.NotificationStatus.PENDING,
+                       models.Notification.next_attempt_at <= now)
+                .order_by(models.Notification.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                db.execute(
+                    update(models.Notification)
+                    .where(models.Notification.id.in_([r.id for r in rows]))
+                    .values(attempts=models.Notification.attempts + 1,
+                            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS))
+                )
+            db.commit()
+            return rows
+        finally:
+            db.close()
+
+    def finish(self, sent_ids, failed):
+        # failed: list of (id, attempts after this try, error message)
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            if sent_ids:
+                db.execute(
+                    update(models.Notification)
+                    .where(models.Notification.id.in_(sent_ids))
+                    .values(status=models.NotificationStatus.SENT, sent_at=now, last_error=None)
+                )
+            for notification_id, attempts, error in failed:
+                final = attempts >= self.max_attempts
+                db.execute(
+                    update(models.Notification)
+                    .where(models.Notification.id == notification_id)
+                    .values(status=models.NotificationStatus.FAILED if final else models.NotificationStatus.PENDING,
+                            next_attempt_at=now + _backoff(attempts), last_error=error[:500])
+                )
+            db.commit()
+        finally:
+            db.close()
+
+    async def _deliver(self, user_id, channel, rows):
+        sink = self.sinks.get(channel)
+        async with self.semaphore:
+            try:
+                if sink is None:
+                    raise RuntimeError(f"No sink configured for channel '{channel}'")
+                await sink.send(user_id, [r.payload for r in rows])
+                return rows, None
+            except Exception as e:
+                logger.warning(f"Delivery to user {user_id} via {channel} failed: {e}")
+                return rows, str(e) or e.__class__.__name__
+
+    async def run_once(self):
+        # Process one batch. Returns the number of notifications claimed.
+        rows = await asyncio.to_thread(self.claim)
+        if not rows:
+            return 0
+
+        groups = {}
+        for row in rows:
+            groups.setdefault((row.user_id, row.channel), []).append(row)
+
+        results = await asyncio.gather(*[
+            self._deliver(user_id, channel, group) for (user_id, channel), group in groups.items()
+        ])
+        sent_ids = [r.id for group, error in results if error is None for r in group]
+        failed = [(r.id, r.attempts + 1, error) for group, error in results if error is not None for r in group]
+        await asyncio.to_thread(self.finish, sent_ids, failed)
+        return len(rows)
+
+    async def run_forever(self, poll_seconds: float = POLL_SECONDS):
+        logger.info("Notification dispatcher started.")
+        while True:
+            try:
+                claimed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Dispatcher error: {e}")
+                claimed = 0
+            # Keep draining while there is a backlog, otherwise wait for new rows.
+            if claimed < self.batch_size:
+                await asyncio.sleep(poll_seconds)
@@ -0,0 +1,127 @@
+import logging
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, text
+from sqlalchemy.orm import Session
+from .. import models
+
+logger = logging.getLogger(__name__)
+
+# End-of-day portfolio valuation.
+#
+# snapshot_day() values every user's holdings for one day with a single INSERT ... SELECT: positions
+# are aggregated from transactions with GROUP BY, joined to that day's closing prices and summed per
+# user. Re-running a day replaces its rows (ON CONFLICT DO UPDATE), so the job is idempotent and a
+# backfill can be restarted at any point. The endpoints then read one row per day, however many
+# transactions the user has.
+#
+# Prices: for today, the last traded price from market_data (the job runs after the close), or the
+# last close for stocks that didn't trade; for past days, the last stock_prices close on or before
+# that day.
+
+SNAPSHOT_SQL = """
+INSERT INTO portfolio_snapshots (user_id, date, market_value, net_invested, net_flow, holdings, created_at)
+SELECT p.user_id, :day,
+       SUM(CASE WHEN p.quantity > 0 THEN p.quantity * COALESCE({price}, 0) ELSE 0 END),
+       SUM(p.invested),
+       SUM(p.flow),
+       SUM(CASE WHEN p.quantity > 0 THEN 1 ELSE 0 END),
+       :now
+FROM (
+    SELECT t.user_id, t.stock_id,
+           SUM(CASE WHEN t.type = 'BUY' THEN t.quantity
+                    WHEN t.type = 'SELL' THEN -t.quantity ELSE 0 END) AS quantity,
+           SUM(CASE WHEN t.type = 'BUY' THEN t.quantity * t.price
+                    WHEN t.type = 'SELL' THEN -t.quantity * t.price ELSE 0 END) AS invested,
+           SUM(CASE WHEN t.date < :day_start THEN 0
+                    WHEN t.type = 'BUY' THEN t.quantity * t.price
+                    WHEN t.type = 'SELL' THEN -t.quantity * t.price ELSE 0 END) AS flow
+    FROM transactions t
+    WHERE t.user_id IS NOT NULL AND t.date < :day_end
+    GROUP BY t.user_id, t.stock_id
+) p
+LEFT JOIN market_data md ON md.stock_id = p.stock_id
+GROUP BY p.user_id
+ON CONFLICT (user_id, date) DO UPDATE SET
+    market_value = excluded.market_value,
+    net_invested = excluded.net_invested,
+    net_flow = excluded.net_flow,
+    holdings = excluded.holdings,
+    created_at = excluded.created_at
+"""
+
+# Last close on or before the day; uses the (stock_id, date) index on stock_prices.
+HISTORICAL_CLOSE = """(SELECT sp.close FROM stock_prices sp
+    WHERE sp.stock_id = p.stock_id AND sp.date <= :day AND sp.close IS NOT NULL
+    ORDER BY sp.date DESC LIMIT 1)"""
+# The scraper stores ltp 0 for stocks that haven't traded today.
+CURRENT_PRICE = f"COALESCE(NULLIF(md.ltp, 0), {HISTORICAL_CLOSE})"
+
+def snapshot_day(db: Session, day: date = None):
+    # Values all portfolios for one day and returns the number of users written.
+    day = day or date.today()
+    price = CURRENT_PRICE if day == date.today() else HISTORICAL_CLOSE
+    # Transaction dates are stored as naive datetimes; a day is [midnight, next midnight).
+    day_start = datetime.combine(day, time.min)
+    result = db.execute(text(SNAPSHOT_SQL.format(price=price)), {
+        "day": day, "day_start": day_start, "day_end": day_start + timedelta(days=1), "now": datetime.utcnow(),
+    })
+    db.commit()
+    return result.rowcount
+
+def trading_days(db: Session, start: date, end: date):
+    # Days with price bars, so weekends and holidays get no snapshot.
+    rows = db.query(models.StockPrice.date).filter(models.StockPrice.date >= start, models.StockPrice.date <= end)\
+        .distinct().order_by(models.StockPrice.date).all()
+    return [r[0] for r in rows]
+
+def backfill(db: Session, start: date = None, end: date = None):
+    # Snapshots every trading day in [start, end], one committed statement per day, oldest first.
+    # Defaults: from the first transaction up to today.
+    if start is None:
+        first = db.query(func.min(models.Transaction.date)).scalar()
+        if first is None:
+            return {"days": 0, "rows": 0}
+        start = first.date()
+    end = end or date.today()
+    days = trading_days(db, start, end)
+    if end == date.today() and end not in days:
+        days.append(end) # today's bars may not be written yet, market_data has the prices
+    rows = 0
+    for day in days:
+        rows += snapshot_day(db, day)
+    logger.info(f"Portfolio snapshots for {len(days)} days ({rows} rows) from {start} to {end}")
+    return {"days": len(days), "rows": rows}
+
+def equity_curve(db: Session, user_id: int, start: date = None, end: date = None):
+    query = db.query(models.PortfolioSnapshot.date, models.PortfolioSnapshot.market_value,
+                     models.PortfolioSnapshot.net_invested, models.PortfolioSnapshot.holdings)\
+        .filter(models.PortfolioSnapshot.user_id == user_id)
+    if start:
+        query = query.filter(models.PortfolioSnapshot.date >= start)
+    if end:
+        query = query.filter(models.PortfolioSnapshot.date <= end)
+    return [
+        {"date": d, "value": value, "net_invested": invested, "gain_loss": value - invested, "holdings": holdings}
+        for d, value, invested, holdings in query.order_by(models.PortfolioSnapshot.date).all()
+    ]
+
+def daily_changes(db: Session, user_id: int, start: date = None, end: date = None):
+    # Day-over-day change net of money put in or taken out that day, so buying more stock does not
+    # count as a gain. The previous day is looked up with LAG over the user's rows.
+    s = models.PortfolioSnapshot
+    previous = func.lag(s.market_value).over(order_by=s.date)
+    inner = db.query(s.date.label("date"), s.market_value.label("value"), s.net_flow.label("net_flow"),
+                     previous.label("previous"))\
+        .filter(s.user_id == user_id).subquery()
+    query = db.query(inner)
+    if start:
+        query = query.filter(inner.c.date >= start)
+    if end:
+        query = query.filter(inner.c.date <= end)
+    result = []
+    for d, value, flow, prev in query.order_by(inner.c.date).all():
+        change = value - (prev or 0.0) - flow
+        base = (prev or 0.0) + max(flow, 0.0) # the money that was at stake that day
+        result.append({"date": d, "value": value, "net_flow": flow, "change": change,
+                       "change_percent": change / base * 100 if base > 0 else None})
+    return result
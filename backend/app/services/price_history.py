@@ -0,0 +1,82 @@
+from datetime import date
+import numpy as np
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from .. import models
+
+# Daily price history as dense (stock x day) NumPy matrices.
+# Shared by the indicator engine, risk and simulation code so stock_prices is read with one query.
+
+class PriceMatrix:
+    def __init__(self, stock_ids, dates, open_, high, low, close, volume):
+        self.stock_ids = stock_ids   # (S,) int array
+        self.dates = dates           # list of datetime.date, length T
+        self.open = open_            # (S, T) float arrays, NaN where there is no bar
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.row = {int(sid): i for i, sid in enumerate(stock_ids)}
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if self.dates else None
+
+def load_price_matrix(db: Session, start_date: date = None, stock_ids=None):
+    query = db.query(
+        models.StockPrice.stock_id,
+        models.StockPrice.date,
+        models.StockPrice.open,
+        models.StockPrice.high,
+        models.StockPrice.low,
+        models.StockPrice.close,
+        models.StockPrice.volume,
+    )
+    if start_date:
+        query = query.filter(models.StockPrice.date >= start_date)
+    if stock_ids is not None:
+        query = query.filter(models.StockPrice.stock_id.in_(list(stock_ids)))
+    rows = query.all()
+
+    if not rows:
+        empty = np.empty((0, 0))
+        return PriceMatrix(np.empty(0, dtype=np.int64), [], empty, empty, empty, empty, empty)
+
+    # Pivot the long (stock, date) rows into matrices with vectorized indexing.
+    columns = list(zip(*rows))
+    sids, row_index = np.unique(np.array(columns[0], dtype=np.int64), return_inverse=True)
+    dates, col_index = np.unique(np.array(columns[1], dtype="datetime64[D]"), return_inverse=True)
+
+    def pivot(values):
+        matrix = np.full((len(sids), len(dates)), np.nan)
+        matrix[row_index, col_index] = np.array(values, dtype=np.float64) # None -> nan
+        return matrix
+
+    return PriceMatrix(
+        sids, dates.astype(object).tolist(),
+        pivot(columns[2]), pivot(columns[3]), pivot(columns[4]), pivot(columns[5]), pivot(columns[6])
+    )
+
+def forward_fill(matrix: np.ndarray):
+    # Carry the last known value forward along the day axis (per stock), fully vectorized.
+    valid = ~np.isnan(matrix)
+    index = np.where(valid, np.arange(matrix.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    filled = matrix[np.arange(matrix.shape[0])[:, None], index]
+    filled[~np.maximum.accumulate(valid, axis=1)] = np.nan # nothing to carry before the first bar
+    return filled
+
+def upsert_daily_bars(db: Session, bar_date: date, bars):
+    # bars: {stock_id: {"open":..., "high":..., "low":..., "close":..., "volume":...}}
+    # Insert or refresh today's bar for every stock, in one statement.
+    if not bars:
+        return
+    stmt = pg_insert(models.StockPrice).values([
+        {"stock_id": stock_id, "date": bar_date, **bar} for stock_id, bar in bars.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["stock_id", "date"],
+        set_={c: stmt.excluded[c] for c in ("high", "low", "close", "volume")}
+    )
+    db.execute(stmt)
+    db.commit()
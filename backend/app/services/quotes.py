@@ -0,0 +1,68 @@
+from sqlalchemy.orm import Session
+from .. import models
+from . import snapshot
+
+# Compact price quotes for tickers and watchlists.
+# Served from the shared market snapshot when one has been published, otherwise with
+# one query selecting only the price fields (no ORM objects, no fundamentals).
+
+QUOTE_FIELDS = ["trading_code", "ltp", "change", "high", "low", "volume", "updated_at"]
+
+# Upper bound on symbols per request, the whole board is ~400 symbols.
+MAX_CODES = 500
+
+def parse_codes(codes: str):
+    # "gp, BATBC,,GP" -> ["GP", "BATBC"] (order kept, duplicates removed)
+    seen = []
+    for code in (codes or "").split(","):
+        code = code.strip().upper()
+        if code and code not in seen:
+            seen.append(code)
+    return seen[:MAX_CODES]
+
+def _quote_query(db: Session):
+    return db.query(
+        models.Stock.trading_code,
+        models.MarketData.ltp,
+        models.MarketData.change,
+        models.MarketData.high,
+        models.MarketData.low,
+        models.MarketData.volume,
+        models.MarketData.updated_at,
+    ).outerjoin(models.MarketData, models.MarketData.stock_id == models.Stock.id)
+
+def _from_snapshot(codes):
+    rows = snapshot.reader.get_rows(codes, QUOTE_FIELDS[1:])
+    if rows is None:
+        return None
+    # NaN marks "no market data yet" in the snapshot; updated_at is stored as a UNIX timestamp.
+    return [
+        tuple(None if v != v else v for v in row[:-1]) + (snapshot.from_timestamp(row[-1]),)
+        for row in rows
+    ]
+
+def get_quotes(db: Session, codes):
+    if not codes:
+        return []
+    cached = _from_snapshot(codes)
+    if cached is not None:
+        return cached
+    rows = _quote_query(db).filter(models.Stock.trading_code.in_(codes)).all()
+    # Return rows in the order the client asked for them.
+    by_code = {row.trading_code: tuple(row) for row in rows}
+    return [by_code[code] for code in codes if code in by_code]
+
+def get_watchlist_quotes(db: Session, user_id: int):
+    rows = _quote_query(db)\
+        .join(models.Watchlist, models.Watchlist.stock_id == models.Stock.id)\
+        .filter(models.Watchlist.user_id == user_id)\
+        .order_by(models.Watchlist.id).all()
+    return [tuple(row) for row in rows]
+
+def pack(rows, layout: str = "rows"):
+    # rows:    {"fields": [...], "rows": [[...], ...]}
+    # columns: {"fields": [...], "columns": {"ltp": [...], ...}}
+    if layout == "columns":
+        columns = {field: [row[i] for row in rows] for i, field in enumerate(QUOTE_FIELDS)}
+        return {"fields": QUOTE_FIELDS, "columns": columns}
+    return {"fields": QUOTE_FIELDS, "rows": [list(row) for row in rows]}
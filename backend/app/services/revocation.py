@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, literal, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .. import models
+
+# Refresh token revocation store.
+#
+# Postgres (revoked_tokens) is the source of truth. Each worker mirrors the unexpired entries in a
+# dict, so checking a presented token is a set lookup. The mirror pulls entries revoked by other
+# workers every SYNC_SECONDS, so it can be behind by that much (more if a revoking transaction is
+# slow to commit). Rotating a token (rotate()) therefore doesn't rely on it alone: it inserts the
+# token's jti only if its family isn't revoked, in one INSERT ... SELECT ... WHERE NOT EXISTS.
+#   - a conflict on that insert means the token was already used, whatever the mirror says,
+#   - no row inserted means the family was revoked (logout, detected reuse), even on another worker.
+# A valid refresh is that one statement; the database is only read again to report a revocation.
+#
+# revoked_at is set before the commit, so a row can become visible after rows with a later
+# revoked_at. Each sync re-reads the last SYNC_OVERLAP_SECONDS before its cursor to pick those up.
+
+SYNC_SECONDS = 5
+SYNC_OVERLAP_SECONDS = 60
+COMPACT_SECONDS = 3600
+# Concurrent refreshes from the same browser (e.g. two tabs) present the same token within a few
+# seconds. Inside this window a reused token is not treated as stolen.
+REUSE_GRACE_SECONDS = 10
+
+class RevocationStore:
+    def __init__(self):
+        self._entries = {} # id -> (kind, revoked_at, expires_at)
+        self._lock = threading.Lock()
+        self._synced_at = 0.0
+        self._compacted_at = time.monotonic()
+        self._cursor = None # newest revoked_at seen in the DB
+
+    def _sync(self, db: Session, cursor):
+        # Read the entries revoked since cursor (all unexpired ones on the first sync).
+        query = db.query(models.RevokedToken.id, models.RevokedToken.kind,
+                         models.RevokedToken.revoked_at, models.RevokedToken.expires_at)\
+            .filter(models.RevokedToken.expires_at > datetime.utcnow())
+        if cursor is not None:
+            since = cursor - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+            query = query.filter(models.RevokedToken.revoked_at >= since)
+        rows = query.all()
+        with self._lock:
+            for row in rows:
+                self._entries[row.id] = (row.kind, row.revoked_at, row.expires_at)
+                if self._cursor is None or row.revoked_at > self._cursor:
+                    self._cursor = row.revoked_at
+
+    def _maybe_sync(self, db: Session):
+        # The lock only decides which request does the work; the queries run outside it, so other
+        # requests keep answering from the mirror meanwhile.
+        now = time.monotonic()
+        with self._lock:
+            sync = now - self._synced_at >= SYNC_SECONDS
+            compact = now - self._compacted_at >= COMPACT_SECONDS
+            if sync:
+                self._synced_at = now
+            if compact:
+                self._compacted_at = now
+            cursor = self._cursor
+        if sync:
+            self._sync(db, cursor)
+        if compact:
+            self._compact(db)
+
+    def revoked_at(self, db: Session, key: str):
+        # When key (a jti or family id) was revoked, or None. No query unless a sync is due.
+        self._maybe_sync(db)
+        entry = self._entries.get(key)
+        return entry[1] if entry and entry[2] > datetime.utcnow() else None
+
+    def _remember(self, db: Session, key: str):
+        # Copy one row into the mirror and return when it was revoked (None if it is gone).
+        row = db.get(models.RevokedToken, key)
+        if row is None or row.expires_at <= datetime.utcnow():
+            return None
+        with self._lock:
+            self._entries[key] = (row.kind, row.revoked_at, row.expires_at)
+        return row.revoked_at
+
+    def rotate(self, db: Session, jti: str, family_id: str, user_id: int, expires_at: datetime):
+        # Mark a refresh token as used, unless its family is revoked. Returns None if the token may be
+        # exchanged, ("family", revoked_at) if its family is revoked, or ("jti", revoked_at) if the
+        # token was already used.
+        family_at = self.revoked_at(db, family_id)
+        if family_at:
+            return ("family", family_at)
+        used_at = self.revoked_at(db, jti)
+        if used_at:
+            return ("jti", used_at)
+
+        now = datetime.utcnow()
+        table = models.RevokedToken.__table__
+        family_revoked = exists().where(table.c.id == family_id, table.c.expires_at > now)
+        try:
+            inserted = db.execute(
+                insert(table).from_select(
+                    ["id", "kind", "user_id", "revoked_at", "expires_at"],
+                    select(literal(jti), literal("jti"), literal(user_id), literal(now), literal(expires_at))
+                    .where(~family_revoked)
+                )
+            ).rowcount
+            db.commit()
+        except IntegrityError:
+            db.rollback() # primary key conflict: already used
+            return ("jti", self._remember(db, jti))
+        if not inserted:
+            return ("family", self._remember(db, family_id) or now)
+        with self._lock:
+            self._entries[jti] = ("jti", now, expires_at)
+        return None
+
+    def revoke(self, db: Session, key: str, kind: str, user_id: int, expires_at: datetime):
+        # Record a revocation. Returns the time the key was already revoked at if another request got
+        # there first (the insert is the atomic check), or None if this call revoked it.
+        now = datetime.utcnow()
+        try:
+            db.add(models.RevokedToken(id=key, kind=kind, user_id=user_id, revoked_at=now, expires_at=expires_at))
+            db.commit()
+            with self._lock:
+                self._entries[key] = (kind, now, expires_at)
+            return None
+        except IntegrityError:
+            db.rollback() # primary key conflict: already revoked
+        existing = db.get(models.RevokedToken, key)
+        with self._lock:
+            self._entries[key] = (existing.kind, existing.revoked_at, existing.expires_at)
+        return existing.revoked_at
+
+    def _compact(self, db: Session):
+        # Expired tokens are rejected by their signature anyway, so their revocations can go.
+        now = datetime.utcnow()
+        db.query(models.RevokedToken).filter(models.RevokedToken.expires_at <= now)\
+            .delete(synchronize_session=False)
+        db.commit()
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[2] > now}
+
+# Per-process store.
+store = RevocationStore()
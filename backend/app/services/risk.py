@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models
+from .price_history import load_price_matrix, forward_fill
+
+logger = logging.getLogger(__name__)
+
+# Portfolio risk from daily returns.
+#
+# The exchange-wide covariance matrix is the expensive part, and it only changes when a new daily
+# bar arrives. It is computed once per trading day (per process) and cached; a user's request then
+# only slices the rows/columns of the stocks they hold and does a few small matrix products.
+
+RISK_WINDOW = 250         # daily returns used for the covariance (~one trading year)
+MIN_OBSERVATIONS = 20     # stocks with fewer returns than this are reported as missing history
+TRADING_DAYS_PER_YEAR = 252
+Z_95, Z_99 = 1.6449, 2.3263
+REFRESH_CHECK_SECONDS = 60
+
+class CovarianceModel:
+    def __init__(self, as_of, stock_ids, returns, observations):
+        self.as_of = as_of
+        self.stock_ids = stock_ids
+        self.row = {int(sid): i for i, sid in enumerate(stock_ids)}
+        self.returns = returns # (S, T) daily returns, 0 where a stock did not trade
+        self.observations = observations
+        centered = returns - returns.mean(axis=1, keepdims=True)
+        self.covariance = centered @ centered.T / max(returns.shape[1] - 1, 1)
+
+    @classmethod
+    def build(cls, db: Session):
+        latest = db.query(func.max(models.StockPrice.date)).scalar()
+        if latest is None:
+            return None
+        started = time.perf_counter()
+        matrix = load_price_matrix(db, start_date=latest - timedelta(days=RISK_WINDOW * 7 // 5 + 14))
+        close = forward_fill(matrix.close)[:, -(RISK_WINDOW + 1):]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            returns = close[:, 1:] / close[:, :-1] - 1.0
+        observations = (~np.isnan(returns)).sum(axis=1)
+        model = cls(latest, matrix.stock_ids, np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0), observations)
+        logger.info(f"Covariance matrix for {len(matrix.stock_ids)} stocks built in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms")
+        return model
+
+_model = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+def get_model(db: Session):
+    # One rebuild per new trading day. Concurrent requests wait on the lock instead of all rebuilding.
+    global _model, _checked_at
+    with _lock:
+        if _model is None or time.monotonic() - _checked_at > REFRESH_CHECK_SECONDS:
+            latest = db.query(func.max(models.StockPrice.date)).scalar()
+            if latest is not None and (_model is None or latest > _model.as_of):
+                _model = CovarianceModel.build(db)
+            _checked_at = time.monotonic()
+        return _model
+
+def portfolio_risk(db: Session, positions):
+    # positions: rows of (stock_id, trading_code, quantity, ltp), e.g. from crud.get_positions.
+    model = get_model(db)
+    held = [p for p in positions if p.ltp]
+    covered = [p for p in held if model is not None and p.stock_id in model.row
+               and model.observations[model.row[p.stock_id]] >= MIN_OBSERVATIONS]
+    missing = sorted(p.trading_code for p in positions if p not in covered)
+
+    result = {
+        "as_of": model.as_of if model else None,
+        "value": float(sum(p.quantity * p.ltp for p in held)),
+        "volatility_daily": None, "volatility_annual": None,
+        "var_95": None, "var_99": None, "historical_var_95": None,
+        "holdings": [], "correlation": {"codes": [], "matrix": []},
+        "missing_history": missing,
+    }
+    if not covered:
+        return result
+
+    idx = np.array([model.row[p.stock_id] for p in covered])
+    values = np.array([p.quantity * p.ltp for p in covered], dtype=np.float64)
+    total = values.sum()
+    weights = values / total
+
+    cov = model.covariance[np.ix_(idx, idx)]
+    marginal = cov @ weights
+    variance = float(weights @ marginal)
+    sigma = np.sqrt(max(variance, 0.0))
+
+    # Historical VaR: 5th percentile of what today's holdings would have returned on past days.
+    portfolio_returns = weights @ model.returns[idx]
+    stock_vol = np.sqrt(np.diag(cov))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        contribution = weights * marginal / sigma if sigma > 0 else np.zeros_like(weights)
+        correlation = cov / np.outer(stock_vol, stock_vol)
+
+    result.update({
+        "volatility_daily": sigma,
+        "volatility_annual": sigma * np.sqrt(TRADING_DAYS_PER_YEAR),
+        "var_95": Z_95 * sigma * total,
+        "var_99": Z_99 * sigma * total,
+        "historical_var_95": float(-np.percentile(portfolio_returns, 5) * total),
+        "holdings": [
+            {
+                "trading_code": p.trading_code,
+                "value": float(values[i]),
+                "weight": float(weights[i]),
+                "volatility_annual": float(stock_vol[i] * np.sqrt(TRADING_DAYS_PER_YEAR)),
+                "risk_contribution": float(contribution[i]),
+                "risk_contribution_percent": float(contribution[i] / sigma * 100) if sigma > 0 else 0.0,
+            }
+            for i, p in enumerate(covered)
+        ],
+        "correlation": {
+            "codes": [p.trading_code for p in covered],
+            "matrix": np.round(np.nan_to_num(correlation), 4).tolist(),
+        },
+    })
+    return result
@@ -1,7 +1,9 @@
 import requests
+from datetime import datetime
 from bs4 import BeautifulSoup
 from sqlalchemy.orm import Session
 from .. import models, crud, schemas
+from . import snapshot, indicators, price_history, market_indices
 import logging
 
 logger = logging.getLogger(__name__)
@@ -9,13 +11,13 @@ logger = logging.getLogger(__name__)
 DSE_URL = "https://www.dsebd.org/latest_share_price_scroll_l.php"
 
 def scrape_dse_data(db: Session):
+    # Returns the published snapshot version. Errors are logged and raised, so a scrape job is retried.
     try:
         logger.info("Starting DSE scrape...")
         # requests.get fetches the HTML content of the URL.
         response = requests.get(DSE_URL)
         if response.status_code != 200:
-            logger.error(f"Failed to fetch DSE data: {response.status_code}")
-            return
+            raise RuntimeError(f"Failed to fetch DSE data: {response.status_code}")
 
         # BeautifulSoup parses the HTML content, making it easy to navigate and search.
         soup = BeautifulSoup(response.content, 'html.parser')
@@ -37,10 +39,10 @@ def scrape_dse_data(db: Session):
             logger.info(f"Found data table with {max_valid_rows} valid rows.")
         
         if not table:
-            logger.error("Could not find data table on DSE page")
-            return
+            raise RuntimeError("Could not find data table on DSE page")
 
         rows = table.find_all('tr')
+        bars = {} # stock_id -> today's bar, for price history and indicators
         # Iterate over each row in the table, skipping the first one (header).
         for row in rows[1:]:
             cols = row.find_all('td')
@@ -89,11 +91,31 @@ def scrape_dse_data(db: Session):
                 # Update or Create market data entry.
                 crud.update_market_data(db, stock.id, market_data)
 
+                if ltp > 0: # stocks that haven't traded today show no price
+                    bars[stock.id] = {"open": ltp, "high": high or ltp, "low": low or ltp, "close": ltp, "volume": volume}
+
             except ValueError as e:
                 logger.warning(f"Error parsing row for {trading_code if 'trading_code' in locals() else 'unknown'}: {e}")
                 continue
-                
-        logger.info("DSE scrape completed successfully.")
+
+        # Fire alerts against the new prices. Delivery happens later, in the notifier process.
+        fired = crud.trigger_alerts(db)
+        if fired:
+            logger.info(f"{fired} alerts triggered.")
+
+        # Record today's daily bar (the first scrape of the day sets 'open') and
+        # advance the indicators by one incremental step.
+        today = datetime.utcnow().date()
+        price_history.upsert_daily_bars(db, today, bars)
+        indicators.on_daily_bars(db, today, {sid: (b["close"], b["high"], b["low"]) for sid, b in bars.items()})
+        # Move the market indices by the stocks whose price changed.
+        market_indices.on_prices(db, {sid: b["close"] for sid, b in bars.items()})
+
+        # Publish the new board once for all worker processes on this host.
+        version = snapshot.publish_from_db(db)
+        logger.info(f"DSE scrape completed successfully (snapshot version {version}).")
+        return version
 
     except Exception as e:
         logger.error(f"Error during scraping: {e}")
+        raise
@@ -0,0 +1,128 @@
+import bisect
+import threading
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models
+from . import snapshot
+
+# In-memory symbol search (/market/search).
+#
+# Sorted (key, stock) lists answer prefix queries with a binary search, and a table of
+# single-character deletions answers typo-tolerant lookups (edit distance 1) with a few dict hits.
+# The whole index is a few hundred entries per list, so a query never touches Postgres.
+
+# Ranking tiers, lower is better. Ties are broken by turnover (traded value), highest first.
+EXACT_CODE, CODE_PREFIX, NAME_PREFIX, SECTOR_PREFIX, FUZZY_CODE = range(5)
+MATCH_NAMES = {EXACT_CODE: "code", CODE_PREFIX: "code_prefix", NAME_PREFIX: "name",
+               SECTOR_PREFIX: "sector", FUZZY_CODE: "fuzzy"}
+
+def _deletions(word: str):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+class SymbolIndex:
+    def __init__(self, stocks, turnover):
+        # stocks: list of (id, trading_code, name, sector)
+        self.stocks = stocks
+        self.turnover = turnover # trading_code -> traded value
+        self.codes = sorted((code.upper(), i) for i, (_, code, _, _) in enumerate(stocks))
+        self.by_code = {key: i for key, i in self.codes}
+        self.names = sorted(
+            (token, i)
+            for i, (_, _, name, _) in enumerate(stocks)
+            for token in set((name or "").upper().split()) | {(name or "").upper()}
+            if token
+        )
+        self.sectors = sorted(((sector or "").upper(), i) for i, (_, _, _, sector) in enumerate(stocks) if sector)
+
+        self.code_deletions = {}
+        for key, i in self.codes:
+            for variant in _deletions(key) | {key}:
+                self.code_deletions.setdefault(variant, set()).add(i)
+
+    @staticmethod
+    def _prefix(entries, prefix):
+        start = bisect.bisect_left(entries, (prefix, -1))
+        for position in range(start, len(entries)):
+            key, i = entries[position]
+            if not key.startswith(prefix):
+                break
+            yield i
+
+    def search(self, query: str, limit: int = 10):
+        q = query.strip().upper()
+        if not q:
+            return []
+
+        best = {} # stock index -> best tier
+        def add(indexes, tier):
+            for i in indexes:
+                if tier < best.get(i, FUZZY_CODE + 1):
+                    best[i] = tier
+
+        add(self._prefix(self.codes, q), CODE_PREFIX)
+        if q in self.by_code:
+            add([self.by_code[q]], EXACT_CODE)
+        add(self._prefix(self.names, q), NAME_PREFIX)
+        add(self._prefix(self.sectors, q), SECTOR_PREFIX)
+
+        if len(best) < limit and len(q) >= 2:
+            # Edit distance <= 1: any code sharing a one-deletion variant with the query.
+            candidates = set()
+            for variant in _deletions(q) | {q}:
+                candidates |= self.code_deletions.get(variant, set())
+            add(candidates, FUZZY_CODE)
+
+        ranked = sorted(best.items(), key=lambda item: (item[1], -self.turnover.get(self.stocks[item[0]][1], 0.0)))
+        return [
+            {"id": self.stocks[i][0], "trading_code": self.stocks[i][1], "name": self.stocks[i][2],
+             "sector": self.stocks[i][3], "match": MATCH_NAMES[tier]}
+            for i, tier in ranked[:limit]
+        ]
+
+_index = None
+_snapshot_version = None
+_lock = threading.Lock()
+
+def build_index(db: Session):
+    rows = db.query(
+        models.Stock.id,
+        models.Stock.trading_code,
+        models.Stock.name,
+        func.coalesce(models.Sector.name, models.Stock.sector),
+        models.MarketData.value,
+    ).outerjoin(models.Sector, models.Sector.id == models.Stock.sector_id)\
+        .outerjoin(models.MarketData, models.MarketData.stock_id == models.Stock.id).all()
+    return SymbolIndex([tuple(row[:4]) for row in rows], {row[1]: row[4] or 0.0 for row in rows})
+
+def invalidate():
+    # Call when stocks are created or renamed in this process. The next search rebuilds the index.
+    global _index
+    _index = None
+
+def _sync_with_snapshot():
+    # Other processes (scraper, importer) publish the shared snapshot after they change the board.
+    # A new version refreshes turnover from it; a different number of stocks means listings changed.
+    global _index, _snapshot_version
+    version = snapshot.reader.version
+    if not version or version == _snapshot_version or _index is None:
+        return
+    board = snapshot.reader.read(lambda records, v: {
+        code.decode(): value for code, value in zip(records["trading_code"].tolist(), records["value"].tolist())
+    })
+    if board is None:
+        return
+    if len(board) != len(_index.stocks):
+        _index = None
+    else:
+        _index.turnover = {code: (value if value == value else 0.0) for code, value in board.items()}
+    _snapshot_version = version
+
+def search(db: Session, query: str, limit: int = 10):
+    global _index, _snapshot_version
+    with _lock:
+        _sync_with_snapshot()
+        if _index is None:
+            _index = build_index(db)
+            _snapshot_version = snapshot.reader.version
+        index = _index
+    return index.search(query, limit)
@@ -0,0 +1,163 @@
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .. import models, crud
+from . import risk
+
+# What-if simulation for /portfolio/simulate.
+#
+# Every scenario is turned into one row of a (scenarios x stocks) quantity matrix, either the current
+# holdings plus hypothetical trades, or target weights applied to the portfolio value. Everything
+# after that is matrix arithmetic over all scenarios at once:
+#   cash required      (new - current quantities) @ prices
+#   sector exposure    position values @ (stocks x sectors) one-hot matrix
+#   dividend income    position values @ dividend yields
+#   drawdown           position values @ price paths relative to today, from the daily returns the
+#                      risk model already keeps in memory (services/risk.py), so no history query
+# Only building the rows loops in Python, over the trades and weights the client sent.
+
+MAX_SCENARIOS = 500
+UNCLASSIFIED = "Unclassified"
+
+def _universe(db: Session, user_id: int, codes):
+    # Held stocks plus every stock a scenario mentions: (stock_id, trading_code, quantity, ltp,
+    # sector, dividend_yield) rows, in trading code order.
+    held = {p.trading_code: p for p in crud.get_positions(db, user_id)}
+    wanted = set(codes) | set(held)
+    rows = db.query(
+        models.Stock.id, models.Stock.trading_code,
+        func.coalesce(models.Sector.name, models.Stock.sector),
+        models.MarketData.ltp, models.Fundamental.dividend_yield,
+    ).outerjoin(models.Sector, models.Sector.id == models.Stock.sector_id)\
+        .outerjoin(models.MarketData, models.MarketData.stock_id == models.Stock.id)\
+        .outerjoin(models.Fundamental, models.Fundamental.stock_id == models.Stock.id)\
+        .filter(models.Stock.trading_code.in_(wanted))\
+        .order_by(models.Stock.trading_code).all()
+    unknown = wanted - {r[1] for r in rows}
+    if unknown:
+        raise ValueError(f"Unknown trading code(s): {', '.join(sorted(unknown))}")
+    return [(sid, code, float(held[code].quantity) if code in held else 0.0, ltp, sector or UNCLASSIFIED, dy)
+            for sid, code, sector, ltp, dy in rows]
+
+def _scenario_codes(scenarios):
+    codes = set()
+    for s in scenarios:
+        codes.update(t.trading_code for t in s.trades)
+        codes.update(s.target_weights or {})
+    return codes
+
+def _target_row(scenario, codes, sectors, current_values):
+    # Weights per stock for a target scenario. Stocks named in target_weights get their weight; a
+    # target sector weight is spread over the other held stocks of that sector in proportion to their
+    # current value. Anything else is sold, and weights adding up to less than 1 leave cash.
+    weights = np.zeros(len(codes))
+    warnings = []
+    column = {code: i for i, code in enumerate(codes)}
+    named = set()
+    for code, weight in (scenario.target_weights or {}).items():
+        weights[column[code]] = weight
+        named.add(column[code])
+    for sector, weight in (scenario.target_sector_weights or {}).items():
+        members = np.array([i for i, s in enumerate(sectors) if s == sector and i not in named], dtype=np.int64)
+        member_values = current_values[members] if len(members) else np.zeros(0)
+        if member_values.sum() <= 0:
+            warnings.append(f"No holdings in sector '{sector}' to scale, its weight is left in cash")
+            continue
+        weights[members] += weight * member_values / member_values.sum()
+    if weights.sum() > 1 + 1e-9:
+        raise ValueError("Target weights add up to more than 1" + (f" in scenario '{scenario.name}'" if scenario.name else ""))
+    return weights, warnings
+
+def simulate(db: Session, user_id: int, scenarios, whole_shares: bool = True):
+    if len(scenarios) > MAX_SCENARIOS:
+        raise ValueError(f"At most {MAX_SCENARIOS} scenarios per request")
+    universe = _universe(db, user_id, _scenario_codes(scenarios))
+    codes = [u[1] for u in universe]
+    column = {code: i for i, code in enumerate(codes)}
+    current = np.array([u[2] for u in universe], dtype=np.float64)
+    prices = np.array([u[3] if u[3] else np.nan for u in universe], dtype=np.float64)
+    missing_prices = [code for code, p in zip(codes, prices) if np.isnan(p)]
+    prices = np.nan_to_num(prices, nan=0.0) # no price: no value, can't be bought by weight
+    sectors = [u[4] for u in universe]
+    # dividend_yield is a percentage of the price, as shown on the exchange site.
+    yields = np.array([u[5] or 0.0 for u in universe], dtype=np.float64) / 100
+    current_values = current * prices
+    portfolio_value = current_values.sum()
+
+    # Row 0 is the portfolio as it is, then one row per scenario.
+    quantities = np.tile(current, (len(scenarios) + 1, 1))
+    warnings = [[] for _ in range(len(scenarios) + 1)]
+    for n, scenario in enumerate(scenarios, start=1):
+        if scenario.target_weights or scenario.target_sector_weights:
+            if scenario.trades:
+                raise ValueError("A scenario takes either trades or target weights, not both")
+            weights, warnings[n] = _target_row(scenario, codes, sectors, current_values)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                target = np.where(prices > 0, weights * (portfolio_value + scenario.invest) / prices, current)
+            quantities[n] = np.floor(target) if whole_shares else target
+        else:
+            for trade in scenario.trades:
+                quantities[n, column[trade.trading_code]] += trade.quantity
+
+    # Selling more than is held is reported and treated as selling everything.
+    short = quantities < 0
+    for n, m in zip(*np.nonzero(short)):
+        warnings[n].append(f"Sells more {codes[m]} than held")
+    quantities[short] = 0.0
+
+    values = quantities * prices                           # (N, S)
+    totals = values.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(totals[:, None] > 0, values / totals[:, None], 0.0)
+    cash_required = (quantities - current) @ prices
+    dividend_income = values @ yields
+
+    sector_names = sorted(set(sectors))
+    one_hot = np.zeros((len(codes), len(sector_names)))
+    one_hot[np.arange(len(codes)), [sector_names.index(s) for s in sectors]] = 1.0
+    exposure = weights @ one_hot
+
+    # Price paths relative to today over the risk window: (S, T+1), 1.0 at the last column.
+    # Stocks without enough history keep a flat path and are listed in missing_history.
+    model = risk.get_model(db)
+    missing_history = []
+    drawdown = np.full(len(quantities), np.nan)
+    if model is not None:
+        paths = np.ones((len(codes), model.returns.shape[1] + 1))
+        for i, u in enumerate(universe):
+            row = model.row.get(u[0])
+            if row is None or model.observations[row] < risk.MIN_OBSERVATIONS:
+                missing_history.append(u[1])
+                continue
+            growth = np.concatenate(([1.0], np.cumprod(1.0 + model.returns[row])))
+            paths[i] = growth / growth[-1]
+        history = values @ paths                           # (N, T+1) value of each portfolio per day
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dd = 1.0 - history / np.maximum.accumulate(history, axis=1)
+        drawdown = np.where(totals > 0, np.nan_to_num(dd).max(axis=1), np.nan)
+
+    def result(n, name):
+        held = np.flatnonzero((quantities[n] > 0) | (current > 0))
+        return {
+            "name": name,
+            "value": float(totals[n]),
+            "cash_required": float(cash_required[n]),
+            "expected_dividend_income": float(dividend_income[n]),
+            "max_drawdown": None if np.isnan(drawdown[n]) else float(drawdown[n]),
+            "positions": [
+                {"trading_code": codes[m], "quantity": float(quantities[n, m]),
+                 "change": float(quantities[n, m] - current[m]), "price": float(prices[m]),
+                 "value": float(values[n, m]), "weight": float(weights[n, m])}
+                for m in held
+            ],
+            "sector_exposure": {s: float(exposure[n, k]) for k, s in enumerate(sector_names) if exposure[n, k] > 0},
+            "warnings": warnings[n],
+        }
+
+    return {
+        "as_of": model.as_of if model else None,
+        "current": result(0, "current"),
+        "scenarios": [result(n, s.name or f"scenario {n}") for n, s in enumerate(scenarios, start=1)],
+        "missing_prices": missing_prices,
+        "missing_history": missing_history,
+    }
@@ -0,0 +1,227 @@
+import fcntl
+import mmap
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+from sqlalchemy.orm import Session
+from .. import models
+
+# Shared market snapshot.
+#
+# The latest board (prices + a few fundamentals) is published once per scrape into a memory-mapped
+# file (in /dev/shm on Linux, so it lives in RAM). Every uvicorn worker on the host maps the same
+# file and reads the records in place as NumPy arrays: one copy of the data per host, no DB reads.
+#
+# File layout (fixed, little endian):
+#   header (64 bytes) | slot 0: CAPACITY records | slot 1: CAPACITY records
+#
+# The writer fills the slot that readers are NOT using, then flips 'active' and bumps 'version'.
+# Readers never lock: they read the version, read the active slot, and read the version again.
+# If it changed while they were reading, they simply retry.
+#
+# A writer with a different capacity lays the slots out again and bumps 'generation'; the version
+# keeps counting. The file only ever grows, so an older, shorter mapping stays valid, and readers
+# remap when they see a new capacity or generation.
+
+_default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SNAPSHOT_PATH = os.getenv("MARKET_SNAPSHOT_PATH", os.path.join(_default_dir, "stock_manager_snapshot"))
+SNAPSHOT_CAPACITY = int(os.getenv("MARKET_SNAPSHOT_CAPACITY", "2048"))
+
+MAGIC = b"STKSNAP2"
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("capacity", "<u4"),
+    ("active", "<u4"),     # slot readers should use (0 or 1)
+    ("version", "<u8"),    # incremented on every publish, 0 = never published
+    ("count", "<u4", 2),   # number of valid records in each slot
+    ("published_at", "<f8"),
+    ("generation", "<u8"), # incremented whenever the slot layout is reset
+])
+HEADER_SIZE = 64
+
+PRICE_FIELDS = ["ltp", "high", "low", "close", "ycp", "change", "trade", "value", "volume"]
+FUNDAMENTAL_FIELDS = ["eps", "nav", "audited_pe", "dividend_yield", "market_cap", "paid_up_capital", "public_holdings"]
+
+RECORD_DTYPE = np.dtype(
+    [("stock_id", "<i4"), ("trading_code", "S16"), ("updated_at", "<f8")]
+    + [(f, "<f8") for f in PRICE_FIELDS]
+    + [(f, "<f8") for f in FUNDAMENTAL_FIELDS]
+)
+
+def _file_size(capacity: int):
+    return HEADER_SIZE + 2 * capacity * RECORD_DTYPE.itemsize
+
+def to_timestamp(value: datetime):
+    # Our DB timestamps are naive UTC.
+    return value.replace(tzinfo=timezone.utc).timestamp() if value else np.nan
+
+def from_timestamp(value: float):
+    return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None) if value == value else None
+
+class SnapshotReader:
+    # One reader per process. The file is mapped lazily, so workers can start before the first scrape.
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self._mm = None
+        self._header = None
+        self._slots = None
+        self._layout = None # (capacity, generation) the slots were mapped with
+        self._index_version = None
+        self._index = {}
+
+    def _open(self):
+        if self._mm is not None:
+            return True
+        try:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return False
+        self._header = np.frombuffer(self._mm, dtype=HEADER_DTYPE, count=1)
+        if self._header["magic"][0] != MAGIC:
+            self.close()
+            return False
+        capacity = int(self._header["capacity"][0])
+        if len(self._mm) < _file_size(capacity):
+            self.close() # caught between a writer growing the file and writing its header
+            return False
+        self._layout = self._current_layout()
+        self._slots = [
+            np.frombuffer(self._mm, dtype=RECORD_DTYPE, count=capacity,
+                          offset=HEADER_SIZE + slot * capacity * RECORD_DTYPE.itemsize)
+            for slot in (0, 1)
+        ]
+        return True
+
+    def _current_layout(self):
+        return int(self._header["capacity"][0]), int(self._header["generation"][0])
+
+    def _ensure_mapped(self):
+        # Open the file, and map it again if a writer has changed the layout since.
+        if not self._open():
+            return False
+        if self._current_layout() != self._layout:
+            self.close()
+            return self._open()
+        return True
+
+    def close(self):
+        self._header = self._slots = self._layout = None
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+    @property
+    def version(self):
+        # 0 means no snapshot is available.
+        if not self._ensure_mapped():
+            return 0
+        return int(self._header["version"][0])
+
+    def read(self, fn, retries: int = 5):
+        # Call fn(records, version) on a consistent, zero-copy view of the current snapshot.
+        # fn must not keep the view: copy whatever it needs out of it. Returns None if unavailable.
+        for _ in range(retries):
+            if not self._ensure_mapped():
+                return None
+            version = int(self._header["version"][0])
+            if version == 0:
+                return None
+            slot = int(self._header["active"][0])
+            count = int(self._header["count"][0][slot])
+            result = fn(self._slots[slot][:count], version)
+            if int(self._header["version"][0]) == version:
+                return result
+        return None
+
+    def _row_index(self, records, version):
+        # trading_code -> row number, rebuilt once per published version.
+        if self._index_version != version:
+            self._index = {code.decode(): i for i, code in enumerate(records["trading_code"].tolist())}
+            self._index_version = version
+        return self._index
+
+    def get_rows(self, codes, fields):
+        # [(code, field values...)] for the requested codes, in request order.
+        def collect(records, version):
+            index = self._row_index(records, version)
+            rows = []
+            for code in codes:
+                i = index.get(code)
+                if i is not None:
+                    record = records[i]
+                    rows.append((code,) + tuple(record[f].item() for f in fields))
+            return rows
+        return self.read(collect)
+
+class SnapshotWriter:
+    def __init__(self, path: str = SNAPSHOT_PATH, capacity: int = SNAPSHOT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+
+    def publish(self, records: np.ndarray):
+        if len(records) > self.capacity:
+            raise ValueError(f"Snapshot capacity {self.capacity} exceeded ({len(records)} records)")
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Serialize writers (e.g. a scrape and an import finishing together). Readers don't lock.
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            size = _file_size(self.capacity)
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size) # grow only: shrinking would break readers' mappings
+            with mmap.mmap(fd, size) as mm:
+                header = np.frombuffer(mm, dtype=HEADER_DTYPE, count=1)
+                previous = int(header["version"][0]) if header["magic"][0] == MAGIC else 0
+                if header["magic"][0] != MAGIC:
+                    header[0] = (MAGIC, self.capacity, 0, 0, (0, 0), 0.0, 1)
+                elif header["capacity"][0] != self.capacity:
+                    # New layout. Version 0 (unavailable) sends readers to the database until this
+                    # publish is done; after it the version carries on from the old one.
+                    header["version"] = 0
+                    header["count"][0] = (0, 0)
+                    header["capacity"] = self.capacity
+                    header["generation"] = header["generation"][0] + 1
+
+                target = 1 - int(header["active"][0]) if header["version"][0] else 0
+                slot = np.frombuffer(mm, dtype=RECORD_DTYPE, count=self.capacity,
+                                     offset=HEADER_SIZE + target * self.capacity * RECORD_DTYPE.itemsize)
+                slot[:len(records)] = records
+                header["count"][0][target] = len(records)
+                header["published_at"] = time.time()
+                header["active"] = target
+                version = previous + 1
+                header["version"] = version
+                del header, slot # release the buffer exports before the mmap is closed
+            return version
+        finally:
+            os.close(fd)
+
+def build_records(db: Session):
+    # One query for the whole board: stocks + market data + fundamentals.
+    rows = db.query(
+        models.Stock.id,
+        models.Stock.trading_code,
+        models.MarketData.updated_at,
+        *[getattr(models.MarketData, f) for f in PRICE_FIELDS],
+        *[getattr(models.Fundamental, f) for f in FUNDAMENTAL_FIELDS],
+    ).outerjoin(models.MarketData, models.MarketData.stock_id == models.Stock.id)\
+        .outerjoin(models.Fundamental, models.Fundamental.stock_id == models.Stock.id)\
+        .order_by(models.Stock.id).all()
+
+    records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    for i, row in enumerate(rows):
+        records[i] = (row[0], row[1].encode()[:16], to_timestamp(row[2])) + tuple(
+            np.nan if v is None else v for v in row[3:]
+        )
+    return records
+
+def publish_from_db(db: Session):
+    # Called once per scrape/import, by whichever process did the work.
+    return SnapshotWriter().publish(build_records(db))
+
+# Per-process reader shared by all requests in this worker.
+reader = SnapshotReader()
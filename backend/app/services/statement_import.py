@@ -0,0 +1,160 @@
+import codecs
+import csv
+import json
+import math
+from datetime import datetime, timezone
+from sqlalchemy.orm import Session
+from .. import models, crud
+
+# Broker statement import.
+# Reads a CSV or NDJSON statement line by line (the upload is never loaded into memory as a whole),
+# validates every trade against the user's existing history in memory and bulk inserts the good rows.
+# A bad row is reported and skipped. A file that can't be read to the end (not UTF-8, broken CSV
+# quoting) raises ValueError before anything is inserted; the endpoint returns it as a 422.
+
+# Accepted column names for each field. Brokers do not agree on headers, so we allow a few aliases.
+FIELD_ALIASES = {
+    "trading_code": ("trading_code", "symbol", "code", "instrument"),
+    "type": ("type", "side", "action"),
+    "quantity": ("quantity", "qty", "shares"),
+    "price": ("price", "rate"),
+    "date": ("date", "trade_date", "datetime"),
+}
+
+def detect_format(filename: str = None, content_type: str = None):
+    # Guess the statement format from the upload metadata. CSV is the default.
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or (content_type or "").endswith(("ndjson", "jsonl")):
+        return "ndjson"
+    return "csv"
+
+def _normalize(record: dict):
+    # Map a raw record (any supported header) to our field names.
+    lowered = {str(k).strip().lower(): v for k, v in record.items() if k is not None}
+    row = {}
+    for field, aliases in FIELD_ALIASES.items():
+        row[field] = next((lowered[a] for a in aliases if a in lowered), None)
+    return row
+
+def iter_records(fileobj, fmt: str):
+    # Yield (line_number, normalized_record) pairs, decoding the binary upload incrementally.
+    lines = codecs.iterdecode(fileobj, "utf-8-sig")
+    line_no = 0
+    try:
+        if fmt == "ndjson":
+            for line_no, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, _normalize(json.loads(line))
+                except (ValueError, AttributeError):
+                    yield line_no, None
+        else:
+            reader = csv.DictReader(lines)
+            for record in reader:
+                # line_num counts the header too, which matches what users see in a spreadsheet.
+                line_no = reader.line_num
+                yield line_no, _normalize(record)
+    except UnicodeDecodeError:
+        raise ValueError(f"File is not UTF-8 text (after line {line_no})")
+    except csv.Error as e:
+        raise ValueError(f"Malformed CSV after line {line_no}: {e}")
+
+def _parse_row(record: dict):
+    # Convert a normalized record to typed values. Raises ValueError with a readable message.
+    code = record.get("trading_code") or ""
+    if not isinstance(code, str): # NDJSON values can be any JSON type
+        raise ValueError(f"Invalid trading code: {code!r}")
+    code = code.strip().upper()
+    if not code:
+        raise ValueError("Missing trading code")
+
+    try:
+        tx_type = models.TransactionType(str(record.get("type") or "").strip().upper())
+    except ValueError:
+        raise ValueError(f"Invalid transaction type: {record.get('type')!r}")
+
+    try:
+        quantity = float(str(record.get("quantity")).replace(",", ""))
+        price = float(str(record.get("price")).replace(",", ""))
+    except ValueError:
+        raise ValueError("Quantity and price must be numbers")
+    if not (math.isfinite(quantity) and math.isfinite(price)) or quantity <= 0 or price <= 0:
+        raise ValueError("Quantity and price must be positive")
+
+    raw_date = record.get("date")
+    if raw_date:
+        try:
+            date = datetime.fromisoformat(str(raw_date).strip())
+        except ValueError:
+            raise ValueError(f"Invalid date: {raw_date!r}")
+        if date.tzinfo is not None:
+            # Transaction dates are stored as naive UTC.
+            date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        date = datetime.utcnow()
+
+    return {"trading_code": code, "type": tx_type, "quantity": quantity, "price": price, "date": date}
+
+def import_statement(db: Session, user_id: int, fileobj, fmt: str = "csv"):
+    errors = []
+    parsed = []
+
+    # 1. Parse the stream. Bad rows are reported and skipped, they never abort the import.
+    for line_no, record in iter_records(fileobj, fmt):
+        if record is None:
+            errors.append({"row": line_no, "detail": "Malformed JSON line"})
+            continue
+        try:
+            parsed.append((line_no, _parse_row(record)))
+        except ValueError as e:
+            errors.append({"row": line_no, "detail": str(e)})
+
+    # 2. Resolve every trading code with a single query.
+    code_map = crud.get_stock_ids_by_codes(db, {row["trading_code"] for _, row in parsed})
+
+    pending = []
+    for line_no, row in parsed:
+        stock_id = code_map.get(row["trading_code"])
+        if stock_id is None:
+            errors.append({"row": line_no, "detail": f"Unknown trading code: {row['trading_code']}"})
+            continue
+        pending.append((line_no, stock_id, row))
+
+    # 3. Replay existing history and the new trades in date order to validate SELLs.
+    # Existing transactions sort before imported ones on the same timestamp.
+    events = [
+        (t.date or datetime.min, 0, 0, t.stock_id, t.type, t.quantity, None)
+        for t in crud.get_transaction_history_for_stocks(db, user_id, {stock_id for _, stock_id, _ in pending})
+    ]
+    events += [
+        (row["date"], 1, line_no, stock_id, row["type"], row["quantity"], row)
+        for line_no, stock_id, row in pending
+    ]
+    events.sort(key=lambda e: e[:3])
+
+    holdings = {}
+    to_insert = []
+    for _, _, line_no, stock_id, tx_type, quantity, row in events:
+        if tx_type not in (models.TransactionType.BUY, models.TransactionType.SELL):
+            continue # existing rows without a type are ignored, as in replay_cost_basis
+        held = holdings.get(stock_id, 0.0)
+        if row is not None and tx_type == models.TransactionType.SELL and held < quantity:
+            errors.append({"row": line_no, "detail": f"Insufficient quantity to sell {row['trading_code']} (held {held:g})"})
+            continue
+        holdings[stock_id] = held + quantity if tx_type == models.TransactionType.BUY else held - quantity
+        if row is not None:
+            to_insert.append({
+                "stock_id": stock_id,
+                "user_id": user_id,
+                "type": tx_type,
+                "quantity": quantity,
+                "price": row["price"],
+                "date": row["date"],
+            })
+
+    # 4. One bulk INSERT, one commit.
+    crud.bulk_create_transactions(db, to_insert)
+
+    errors.sort(key=lambda e: e["row"])
+    return {"imported": len(to_insert), "errors": errors}
@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event
+
+# Slow query log.
+#
+# With SLOW_QUERY_MS set, every statement that takes longer is logged (logger "app.slow_queries")
+# as one JSON line with its bind parameters, duration, the line of our code that ran it and, for
+# SELECTs on PostgreSQL, the EXPLAIN plan. Without it no event listener is installed, so there is
+# no overhead.
+#
+# The plan is taken in a background thread on a separate pooled connection, so the request neither
+# waits for it nor has anything run in its transaction. It is a plain EXPLAIN (estimates, the query
+# isn't run again), and each distinct statement is explained at most once per
+# EXPLAIN_COOLDOWN_SECONDS. The log line is written once the plan is there.
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+EXPLAIN_SLOW_QUERIES = os.getenv("EXPLAIN_SLOW_QUERIES", "true").lower() == "true"
+EXPLAIN_COOLDOWN_SECONDS = float(os.getenv("EXPLAIN_COOLDOWN_SECONDS", "300"))
+MAX_PARAMETER_LENGTH = 500
+
+logger = logging.getLogger(__name__)
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+_explained = {} # statement -> time it was last explained
+_explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+
+def _call_site():
+    # The innermost frame in our own code (not SQLAlchemy or this module).
+    for frame in reversed(traceback.extract_stack()):
+        if frame.filename.startswith(APP_DIR) and frame.filename != __file__:
+            return f"{os.path.relpath(frame.filename, os.path.dirname(APP_DIR))}:{frame.lineno} in {frame.name}"
+    return None
+
+def _due_for_explain(statement):
+    now = time.monotonic()
+    if now - _explained.get(statement, -EXPLAIN_COOLDOWN_SECONDS) < EXPLAIN_COOLDOWN_SECONDS:
+        return False
+    _explained[statement] = now
+    return True
+
+def _explain(engine, statement, parameters):
+    # A raw DBAPI connection from the pool: its own transaction, and no SQLAlchemy events fire.
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        return cursor.fetchone()[0]
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        connection.rollback()
+        connection.close()
+
+def _log(entry):
+    logger.warning("slow query %s", json.dumps(entry, default=str))
+
+def _explain_and_log(engine, entry, parameters):
+    entry["plan"] = _explain(engine, entry["statement"], parameters)
+    _log(entry)
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+
+    entry = {
+        "duration_ms": round(elapsed_ms, 2),
+        "statement": statement,
+        "parameters": repr(parameters)[:MAX_PARAMETER_LENGTH],
+        "executemany": executemany,
+        "call_site": _call_site(),
+    }
+    is_select = statement.lstrip().upper().startswith("SELECT")
+    if EXPLAIN_SLOW_QUERIES and is_select and not executemany and conn.dialect.name == "postgresql" \
+            and _due_for_explain(statement):
+        _explainer.submit(_explain_and_log, conn.engine, entry, parameters)
+    else:
+        _log(entry)
+
+def _error(exception_context):
+    # A failed statement never reaches after_cursor_execute.
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+def install(engine):
+    # Called from main.py for the primary and each read replica when SLOW_QUERY_MS is set.
+    event.listen(engine, "before_cursor_execute", _before)
+    event.listen(engine, "after_cursor_execute", _after)
+    event.listen(engine, "handle_error", _error)
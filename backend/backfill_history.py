@@ -0,0 +1,238 @@
+import argparse
+import csv
+import io
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+import psycopg2
+from bs4 import BeautifulSoup
+from sqlalchemy.engine import make_url
+from app.database import SessionLocal, SQLALCHEMY_DATABASE_URL
+from app.services import indicators, snapshot
+
+# Loads daily bars into stock_prices from DSE day-end archive downloads (the HTML pages or their CSV
+# exports, one or many days per file):
+#   python backfill_history.py ~/dse-archive
+#   python backfill_history.py ~/dse-archive --workers 8
+#   python backfill_history.py ~/dse-archive --restart          # ignore the checkpoint
+#
+# Files are parsed in a process pool. The main process resolves trading codes to stock ids with one
+# query, COPYs each batch into a temporary staging table and moves it into stock_prices with
+# INSERT ... ON CONFLICT (stock_id, date) DO NOTHING, so bars that are already there (from scraping
+# or an earlier run) are kept. After each committed batch the finished file names are written to a
+# checkpoint file; an interrupted run skips them when started again. A batch that was committed but
+# not yet checkpointed is simply loaded again and skipped by ON CONFLICT.
+#
+# Rows that can't be read are counted as skipped. A file that can't be parsed at all (unreadable, a
+# bad date in its name) is logged, listed under "errors" in the result and not checkpointed, so the
+# next run tries it again.
+
+CHECKPOINT_NAME = ".backfill_checkpoint.json"
+BATCH_ROWS = 200_000
+FILE_EXTENSIONS = (".csv", ".htm", ".html", ".txt")
+DATE_IN_NAME = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})")
+
+# Archive column headers (upper-cased, without '*' and spaces around) -> our field.
+HEADER_FIELDS = {
+    "DATE": "date", "TRADING CODE": "code", "TRADINGCODE": "code", "SCRIP": "code",
+    "OPENP": "open", "OPEN": "open", "HIGH": "high", "LOW": "low",
+    "CLOSEP": "close", "CLOSE": "close", "LTP": "ltp", "VOLUME": "volume",
+}
+
+def libpq_url():
+    return make_url(SQLALCHEMY_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+# --- Parsing (runs in the pool processes) ---
+
+def _number(text):
+    text = text.replace(",", "").strip()
+    return float(text) if text and text not in ("--", "-") else None
+
+def _date(text):
+    text = text.strip()
+    for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d-%b-%Y", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    return None
+
+def _table_rows(path):
+    # The file's rows as lists of cell texts, header row included.
+    with open(path, "rb") as f:
+        content = f.read()
+    if path.lower().endswith(".csv") or b"<table" not in content[:200_000].lower():
+        return list(csv.reader(io.StringIO(content.decode("utf-8", errors="replace"))))
+    soup = BeautifulSoup(content, "html.parser")
+    rows = []
+    for tr in soup.find_all("tr"):
+        rows.append([cell.get_text(strip=True) for cell in tr.find_all(["th", "td"])])
+    return rows
+
+def parse_file(path):
+    # Returns (path, bars, skipped): bars are (trading_code, date, open, high, low, close, volume).
+    rows = _table_rows(path)
+    match = DATE_IN_NAME.search(os.path.basename(path))
+    file_date = date(*map(int, match.groups())) if match else None
+
+    columns = None
+    bars, skipped = [], 0
+    for row in rows:
+        if columns is None:
+            # The header is the first row naming a trading code column.
+            names = [HEADER_FIELDS.get(c.replace("*", "").strip().upper()) for c in row]
+            if "code" in names:
+                columns = {field: i for i, field in enumerate(names) if field}
+            continue
+        try:
+            cell = lambda field: row[columns[field]] if field in columns else ""
+            day = _date(cell("date")) if "date" in columns else file_date
+            close = _number(cell("close")) or _number(cell("ltp"))
+            code = cell("code").strip()
+            if not code or day is None or not close:
+                skipped += 1 # no trades that day, or not a data row
+                continue
+            high, low, open_ = _number(cell("high")), _number(cell("low")), _number(cell("open"))
+            bars.append((code, day, open_ or close, high or close, low or close, close, _number(cell("volume")) or 0.0))
+        except (IndexError, ValueError):
+            skipped += 1 # short row, or a cell that isn't a number
+    return path, bars, skipped
+
+def parse_file_or_error(path):
+    # parse_file for the pool: returns (path, bars, skipped, error) instead of raising.
+    try:
+        return (*parse_file(path), None)
+    except Exception as e:
+        return path, [], 0, f"{e.__class__.__name__}: {e}"
+
+# --- Loading (main process) ---
+
+def load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return set(json.load(f)["done"])
+    return set()
+
+def save_checkpoint(path, done):
+    # Write then rename, so a crash never leaves a half-written checkpoint.
+    with open(path + ".tmp", "w") as f:
+        json.dump({"done": sorted(done), "updated_at": datetime.utcnow().isoformat()}, f)
+    os.replace(path + ".tmp", path)
+
+def resolve_stocks(cur, codes):
+    # trading code -> stock id for all codes in one round trip. Codes we have never seen (e.g.
+    # delisted companies) are created, as the scraper does for new listings.
+    cur.execute("SELECT trading_code, id FROM stocks WHERE trading_code = ANY(%s)", (list(codes),))
+    ids = dict(cur.fetchall())
+    missing = sorted(set(codes) - set(ids))
+    if missing:
+        cur.execute(
+            "INSERT INTO stocks (trading_code, name, last_updated) "
+            "SELECT code, code, now() FROM unnest(%s::text[]) AS code "
+            "ON CONFLICT (trading_code) DO NOTHING", (missing,))
+        cur.execute("SELECT trading_code, id FROM stocks WHERE trading_code = ANY(%s)", (missing,))
+        ids.update(cur.fetchall())
+    return ids
+
+def flush(conn, bars, stock_ids):
+    # Streams one batch through the staging table. Returns the number of new rows in stock_prices.
+    with conn.cursor() as cur:
+        new_codes = {b[0] for b in bars} - set(stock_ids)
+        if new_codes:
+            stock_ids.update(resolve_stocks(cur, new_codes))
+        buffer = io.StringIO()
+        for code, day, open_, high, low, close, volume in bars:
+            buffer.write(f"{stock_ids[code]}\t{day.isoformat()}\t{open_}\t{high}\t{low}\t{close}\t{volume}\n")
+        buffer.seek(0)
+        cur.copy_expert("COPY stock_prices_staging (stock_id, date, open, high, low, close, volume) FROM STDIN", buffer)
+        cur.execute(
+            "INSERT INTO stock_prices (stock_id, date, open, high, low, close, volume) "
+            "SELECT stock_id, date, open, high, low, close, volume FROM stock_prices_staging "
+            "ON CONFLICT (stock_id, date) DO NOTHING")
+        inserted = cur.rowcount
+    conn.commit() # the staging table empties itself on commit
+    return inserted
+
+def archive_files(directory):
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory) for name in names
+        if name.lower().endswith(FILE_EXTENSIONS)
+    )
+
+def backfill(directory, workers=None, checkpoint=None, restart=False, log=print):
+    checkpoint = checkpoint or os.path.join(directory, CHECKPOINT_NAME)
+    done = set() if restart else load_checkpoint(checkpoint)
+    files = [f for f in archive_files(directory) if os.path.relpath(f, directory) not in done]
+    log(f"{len(files)} files to load ({len(done)} already done)")
+    totals = {"files": 0, "bars": 0, "inserted": 0, "skipped": 0, "errors": []}
+    if not files:
+        return totals
+
+    started = time.time()
+    conn = psycopg2.connect(libpq_url())
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET synchronous_commit = off")
+            cur.execute("CREATE TEMP TABLE stock_prices_staging "
+                        "(stock_id integer, date date, open float8, high float8, low float8, close float8, volume float8) "
+                        "ON COMMIT DELETE ROWS")
+            cur.execute("SELECT trading_code, id FROM stocks")
+            stock_ids = dict(cur.fetchall())
+        conn.commit()
+
+        batch, batch_files = [], []
+        with ProcessPoolExecutor(workers) as pool:
+            for path, bars, skipped, error in pool.map(parse_file_or_error, files, chunksize=8):
+                if error:
+                    log(f"Could not parse {path}: {error}")
+                    totals["errors"].append({"file": os.path.relpath(path, directory), "error": error})
+                    continue
+                batch.extend(bars)
+                batch_files.append(os.path.relpath(path, directory))
+                totals["files"] += 1
+                totals["bars"] += len(bars)
+                totals["skipped"] += skipped
+                if len(batch) >= BATCH_ROWS:
+                    totals["inserted"] += flush(conn, batch, stock_ids)
+                    done.update(batch_files)
+                    save_checkpoint(checkpoint, done)
+                    batch, batch_files = [], []
+                    rate = totals["bars"] / (time.time() - started)
+                    log(f"{totals['files']}/{len(files)} files, {totals['inserted']:,} new bars ({rate:,.0f} bars/s)")
+        if batch_files:
+            totals["inserted"] += flush(conn, batch, stock_ids)
+            done.update(batch_files)
+            save_checkpoint(checkpoint, done)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("ANALYZE stock_prices")
+    finally:
+        conn.close()
+    log(f"Loaded {totals['inserted']:,} new bars from {totals['files']} files in {time.time() - started:.1f}s"
+        + (f", {len(totals['errors'])} files could not be parsed" if totals["errors"] else ""))
+
+    # New history changes every indicator, so rebuild them, as after a seed or import.
+    if totals["inserted"]:
+        db = SessionLocal()
+        try:
+            indicators.recompute(db)
+            snapshot.publish_from_db(db)
+        finally:
+            db.close()
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Load DSE day-end archive files into stock_prices")
+    parser.add_argument("directory", help="directory with archive files (searched recursively)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--checkpoint", help=f"checkpoint file (default: <directory>/{CHECKPOINT_NAME})")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and load every file")
+    args = parser.parse_args()
+    backfill(args.directory, args.workers, args.checkpoint, args.restart)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ from bs4 import BeautifulSoup
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, engine
 from app import models
+from app.services import snapshot, indicators, fundamental_history
 import os
 from datetime import datetime
 
@@ -14,8 +15,11 @@ def parse_float(val):
     except ValueError:
         return 0.0
 
-def import_data():
-    file_path = "e:/Project/TestProjects/fast_api_with_postGres/frontend/src/pages/MarketData.txt"
+def import_data(file_path=None):
+    # Returns the number of stocks processed, or None if the file could not be read.
+    file_path = file_path or os.getenv(
+        "FUNDAMENTALS_FILE", "e:/Project/TestProjects/fast_api_with_postGres/frontend/src/pages/MarketData.txt"
+    )
     
     if not os.path.exists(file_path):
         print(f"File not found: {file_path}")
@@ -34,6 +38,10 @@ def import_data():
     
     # Cache sectors to minimize DB hits
     sectors_cache = {s.name: s for s in db.query(models.Sector).all()}
+
+    # Records which fundamentals changed in this run (only the changed columns are stored).
+    history = fundamental_history.ChangeRecorder(db)
+    run_started = datetime.utcnow()
     
     rows = table.find("tbody").find_all("tr")
     print(f"Found {len(rows)} rows. Processing...")
@@ -119,6 +127,9 @@ def import_data():
             fundamental = db.query(models.Fundamental).filter(models.Fundamental.stock_id == stock.id).first()
             if not fundamental:
                 fundamental = models.Fundamental(stock_id=stock.id)
+                previous = None
+            else:
+                previous = fundamental_history.snapshot_of(fundamental)
             
             fundamental.audited_pe = audited_pe
             fundamental.forward_pe = forward_pe
@@ -137,18 +148,32 @@ def import_data():
             fundamental.last_updated = datetime.utcnow()
             
             db.add(fundamental)
+            history.record(stock.id, previous, fundamental_history.snapshot_of(fundamental), run_started)
             count += 1
             if count % 50 == 0:
                 print(f"Processed {count} records...")
+                history.flush()
                 db.commit()
                 
         except Exception as e:
             print(f"Error processing row for {symbol if 'symbol' in locals() else 'Unknown'}: {e}")
             continue
 
+    history.flush()
     db.commit()
+
+    # Keep as-of lookups bounded: checkpoint stocks with many deltas since their last checkpoint.
+    fundamental_history.compact(db)
+
+    # RSI and beta from the file are only a fallback: recompute them from our own price history
+    # for every stock that has enough of it.
+    print(f"Recomputed indicators for {indicators.recompute(db)} stocks.")
+
+    # Refresh the shared market snapshot so running API workers see the new fundamentals.
+    snapshot.publish_from_db(db)
     db.close()
     print(f"Import Completed. Processed {count} stocks.")
+    return count
 
 if __name__ == "__main__":
     import_data()
@@ -0,0 +1,336 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import string
+import sys
+import time
+from datetime import datetime
+import httpx
+
+# Load generator for the Stock Manager API.
+#
+# Runs the same flow as verify_flow.py / verify_refresh.py (register -> login -> trade -> refresh
+# -> logout), but as many concurrent virtual users, each looping over a weighted mix of actions
+# until the test ends. Latencies are recorded per route in HDR-style histograms and written to a
+# JSON report that can be compared with an earlier run.
+#
+# Examples:
+#   python load_test.py --users 500 --duration 60
+#   python load_test.py --users 2000 --mix market=60,portfolio=20,trade=10,alerts=5,refresh=5
+#   python load_test.py --compare before.json after.json
+#
+# The API's admission control (app/admission.py) sheds load above its concurrency limits and rate
+# limits logins and registrations per address; every virtual user comes from this one host. Results
+# then measure the limits rather than the code. For runs you want to compare, start the server with
+# ADMISSION_ENABLED=false, or with limits sized for the test in ADMISSION_CONFIG, and use the same
+# setting for both runs.
+
+BASE_URL = "http://localhost:8000"
+DEFAULT_MIX = "market=50,portfolio=20,trade=10,alerts=10,refresh=10"
+
+class LatencyHistogram:
+    # Log-linear buckets with ~1% relative precision, like HdrHistogram with 2 significant digits.
+    # Memory does not depend on the number of samples, and histograms from several runs or routes
+    # can be merged by adding bucket counts.
+    PRECISION = 0.01
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _bucket(self, value_ms):
+        return int(math.log(max(value_ms, 0.001) / 0.001) / math.log(1 + self.PRECISION))
+
+    def _value(self, bucket):
+        return 0.001 * (1 + self.PRECISION) ** (bucket + 0.5)
+
+    def record(self, value_ms):
+        bucket = self._bucket(value_ms)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.sum += value_ms
+        self.max = max(self.max, value_ms)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        if not self.total:
+            return None
+        rank = math.ceil(p / 100 * self.total)
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return min(self._value(bucket), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.total,
+            "mean_ms": self.sum / self.total if self.total else None,
+            "p50_ms": self.percentile(50),
+            "p90_ms": self.percentile(90),
+            "p99_ms": self.percentile(99),
+            "p999_ms": self.percentile(99.9),
+            "max_ms": self.max,
+        }
+
+class Stats:
+    def __init__(self):
+        self.routes = {}
+
+    def record(self, route, latency_ms, status):
+        entry = self.routes.setdefault(route, {"histogram": LatencyHistogram(), "statuses": {}, "errors": 0})
+        entry["histogram"].record(latency_ms)
+        entry["statuses"][str(status)] = entry["statuses"].get(str(status), 0) + 1
+        if status == "error" or (isinstance(status, int) and status >= 400):
+            entry["errors"] += 1
+
+    def report(self, elapsed):
+        total = LatencyHistogram()
+        routes = {}
+        for route, entry in sorted(self.routes.items()):
+            histogram = entry["histogram"]
+            total.merge(histogram)
+            routes[route] = {
+                **histogram.summary(),
+                "throughput_rps": histogram.total / elapsed,
+                "errors": entry["errors"],
+                "error_rate": entry["errors"] / histogram.total,
+                "statuses": entry["statuses"],
+                "buckets": histogram.counts, # raw histogram, for merging/comparing runs
+            }
+        errors = sum(entry["errors"] for entry in self.routes.values())
+        return {
+            "total": {**total.summary(), "throughput_rps": total.total / elapsed,
+                      "errors": errors, "error_rate": errors / total.total if total.total else 0.0},
+            "routes": routes,
+        }
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ACTIONS:
+            raise SystemExit(f"Unknown action in mix: {name}")
+        mix[name.strip()] = float(weight)
+    return mix
+
+def get_random_string(length):
+    return ''.join(random.choice(string.ascii_lowercase) for _ in range(length))
+
+class VirtualUser:
+    def __init__(self, client, stats, stocks):
+        self.client = client
+        self.stats = stats
+        self.stocks = stocks
+        self.headers = {}
+        self.holdings = {}
+        self.alert_ids = []
+
+    async def call(self, method, url, route=None, **kwargs):
+        # route is the URL template used to group results, e.g. "GET /market/stocks/{code}".
+        route = f"{method} {route or url}"
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, headers=self.headers, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            response, status = None, "error"
+        self.stats.record(route, (time.perf_counter() - started) * 1000, status)
+        return response
+
+    async def login(self):
+        email = f"load_{get_random_string(10)}@example.com"
+        password = "password123"
+        await self.call("POST", "/register", json={"email": email, "password": password})
+        response = await self.call("POST", "/token", data={"username": email, "password": password})
+        if response is None or response.status_code != 200:
+            return False
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return True
+
+    async def market(self):
+        choice = random.random()
+        if choice < 0.4:
+            await self.call("GET", "/market/stocks", params={"limit": 500})
+        elif choice < 0.7:
+            codes = ",".join(s["trading_code"] for s in random.sample(self.stocks, min(10, len(self.stocks))))
+            await self.call("GET", "/market/quotes", params={"codes": codes})
+        else:
+            code = random.choice(self.stocks)["trading_code"]
+            await self.call("GET", f"/market/stocks/{code}", route="/market/stocks/{code}")
+
+    async def portfolio(self):
+        if random.random() < 0.6:
+            await self.call("GET", "/portfolio/")
+        else:
+            await self.call("GET", "/portfolio/transactions")
+
+    async def trade(self):
+        held = [sid for sid, qty in self.holdings.items() if qty > 0]
+        if held and random.random() < 0.3:
+            stock_id, tx_type = random.choice(held), "SELL"
+            quantity = min(self.holdings[stock_id], random.randint(1, 10))
+        else:
+            stock_id, tx_type, quantity = random.choice(self.stocks)["id"], "BUY", random.randint(1, 50)
+        response = await self.call("POST", "/portfolio/transactions", json={
+            "stock_id": stock_id, "type": tx_type, "quantity": quantity, "price": round(random.uniform(10, 500), 2)
+        })
+        if response is not None and response.status_code == 200:
+            self.holdings[stock_id] = self.holdings.get(stock_id, 0) + (quantity if tx_type == "BUY" else -quantity)
+
+    async def alerts(self):
+        choice = random.random()
+        if choice < 0.4 or not self.alert_ids:
+            response = await self.call("POST", "/alerts/", json={
+                "stock_id": random.choice(self.stocks)["id"],
+                "target_price": round(random.uniform(10, 500), 2),
+                "condition": random.choice(["ABOVE", "BELOW"]),
+            })
+            if response is not None and response.status_code == 200:
+                self.alert_ids.append(response.json()["id"])
+        elif choice < 0.8:
+            await self.call("GET", "/alerts/")
+        else:
+            alert_id = self.alert_ids.pop()
+            await self.call("DELETE", f"/alerts/{alert_id}", route="/alerts/{id}")
+
+    async def refresh(self):
+        # The refresh token travels in the client's cookie jar, like in the browser.
+        response = await self.call("POST", "/refresh")
+        if response is not None and response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def logout(self):
+        await self.call("POST", "/logout")
+
+ACTIONS = {
+    "market": VirtualUser.market,
+    "portfolio": VirtualUser.portfolio,
+    "trade": VirtualUser.trade,
+    "alerts": VirtualUser.alerts,
+    "refresh": VirtualUser.refresh,
+}
+
+async def run_user(user, mix, deadline, think_time):
+    try:
+        if not await user.login():
+            return
+        names, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            await ACTIONS[random.choices(names, weights)[0]](user)
+            if think_time:
+                await asyncio.sleep(random.expovariate(1 / think_time))
+        await user.logout()
+    finally:
+        await user.client.aclose()
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    # Lets every virtual user's client use one connection pool. Closing a client closes its
+    # transport, so this one leaves the pool open; run() closes it once at the end.
+    def __init__(self, transport):
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    stats = Stats()
+    async with httpx.AsyncClient(base_url=args.base_url) as client:
+        response = await client.get("/market/stocks", params={"limit": 1000, "fields": "id,trading_code"})
+        stocks = response.json() if response.status_code == 200 else []
+    if not stocks:
+        raise SystemExit("No stocks found. Load some market data first.")
+
+    # One connection pool shared by all virtual users; each user keeps its own cookie jar.
+    transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.connections,
+                                                             max_keepalive_connections=args.connections))
+    print(f"Starting {args.users} virtual users for {args.duration}s against {args.base_url} (mix: {mix})")
+    started = time.monotonic()
+    deadline = started + args.ramp_up + args.duration
+    tasks = []
+    for i in range(args.users):
+        client = httpx.AsyncClient(base_url=args.base_url, transport=SharedTransport(transport), timeout=args.timeout)
+        user = VirtualUser(client, stats, stocks)
+        delay = args.ramp_up * i / args.users # spread user start times over the ramp-up period
+        tasks.append(asyncio.create_task(_delayed(delay, run_user(user, mix, deadline, args.think_time))))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    await transport.aclose()
+
+    report = {
+        "started_at": datetime.utcnow().isoformat(),
+        "config": vars(args),
+        "elapsed_seconds": elapsed,
+        **stats.report(elapsed),
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print_report(report)
+    print(f"\nReport written to {args.report}")
+
+async def _delayed(delay, coroutine):
+    await asyncio.sleep(delay)
+    await coroutine
+
+def _fmt(value):
+    return f"{value:9.1f}" if value is not None else "        -"
+
+def print_report(report):
+    print(f"\n{'route':40} {'count':>8} {'rps':>8} {'err%':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for route, r in list(report["routes"].items()) + [("TOTAL", report["total"])]:
+        print(f"{route:40} {r['count']:8d} {r['throughput_rps']:8.1f} {r['error_rate'] * 100:6.2f} "
+              f"{_fmt(r['p50_ms'])} {_fmt(r['p90_ms'])} {_fmt(r['p99_ms'])} {_fmt(r['max_ms'])}")
+
+def compare(old_path, new_path):
+    # Side by side p50/p99/throughput for two saved reports.
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'route':40} {'p50 old':>9} {'p50 new':>9} {'p99 old':>9} {'p99 new':>9} {'rps old':>9} {'rps new':>9}")
+    routes = sorted(set(old["routes"]) | set(new["routes"]))
+    for route in routes + ["TOTAL"]:
+        a = old["total"] if route == "TOTAL" else old["routes"].get(route, {})
+        b = new["total"] if route == "TOTAL" else new["routes"].get(route, {})
+        print(f"{route:40} {_fmt(a.get('p50_ms'))} {_fmt(b.get('p50_ms'))} {_fmt(a.get('p99_ms'))} "
+              f"{_fmt(b.get('p99_ms'))} {_fmt(a.get('throughput_rps'))} {_fmt(b.get('throughput_rps'))}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the Stock Manager API")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--users", type=int, default=100, help="number of concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of steady load after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds over which users are started")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted action mix, e.g. " + DEFAULT_MIX)
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean pause between actions (s), 0 = none")
+    parser.add_argument("--connections", type=int, default=200, help="max open HTTP connections")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--report", default="load_report.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two saved reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        sys.exit(1)
@@ -1,29 +1,64 @@
+import sys
 from app.database import engine
-from sqlalchemy import text
+from sqlalchemy import inspect, text
 
-def migrate():
-    with engine.connect() as conn:
-        print("Migrating schema...")
-        try:
-            conn.execute(text("ALTER TABLE transactions ADD COLUMN user_id INTEGER REFERENCES users(id)"))
-            print("Added user_id to transactions")
-        except Exception as e:
-            print(f"Error altering transactions (might already exist): {e}")
+# Brings an existing database up to date with the models. New tables come from create_all; this adds
+# the columns and indexes that create_all doesn't add to tables that already exist.
+#
+# Each step runs in its own transaction, so one failure doesn't abort the steps after it (Postgres
+# rejects every statement in a transaction after an error). Steps that are already applied are
+# detected and skipped; anything else that fails is reported and makes the script exit non-zero.
+
+def add_column(table, column, definition):
+    # Returns the statement to run, or None when the column is already there.
+    if column in {c["name"] for c in inspect(engine).get_columns(table)}:
+        return None
+    return f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
 
-        try:
-            conn.execute(text("ALTER TABLE watchlist ADD COLUMN user_id INTEGER REFERENCES users(id)"))
-            print("Added user_id to watchlist")
-        except Exception as e:
-            print(f"Error altering watchlist (might already exist): {e}")
+def has_index(table, name):
+    return name in {i["name"] for i in inspect(engine).get_indexes(table)}
 
-        try:
-            conn.execute(text("ALTER TABLE alerts ADD COLUMN user_id INTEGER REFERENCES users(id)"))
-            print("Added user_id to alerts")
-        except Exception as e:
-            print(f"Error altering alerts (might already exist): {e}")
-            
-        conn.commit()
+def run_step(description, statement):
+    if statement is None:
+        print(f"{description}: already present")
+        return True
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(statement))
+        print(f"{description}: done")
+        return True
+    except Exception as e:
+        print(f"{description}: FAILED: {e}")
+        return False
+
+def migrate():
+    print("Migrating schema...")
+    steps = [
+        ("Add user_id to transactions", add_column("transactions", "user_id", "INTEGER REFERENCES users(id)")),
+        ("Add user_id to watchlist", add_column("watchlist", "user_id", "INTEGER REFERENCES users(id)")),
+        ("Add user_id to alerts", add_column("alerts", "user_id", "INTEGER REFERENCES users(id)")),
+        ("Add user_id to jobs", add_column("jobs", "user_id", "INTEGER REFERENCES users(id)")),
+        ("Add (user_id, date, id) index to transactions",
+         "CREATE INDEX IF NOT EXISTS ix_transactions_user_date_id ON transactions (user_id, date, id)"),
+    ]
+    # The scraper and the history backfill upsert with ON CONFLICT (stock_id, date), which needs this
+    # unique index. Older databases can hold duplicate bars, which would make creating it fail, so the
+    # duplicates go first (the newest row of each (stock_id, date) is kept).
+    if has_index("stock_prices", "ix_stock_prices_stock_date"):
+        steps.append(("Add unique (stock_id, date) index to stock_prices", None))
+    else:
+        steps += [
+            ("Remove duplicate stock_prices bars",
+             "DELETE FROM stock_prices WHERE id NOT IN (SELECT MAX(id) FROM stock_prices GROUP BY stock_id, date)"),
+            ("Add unique (stock_id, date) index to stock_prices",
+             "CREATE UNIQUE INDEX IF NOT EXISTS ix_stock_prices_stock_date ON stock_prices (stock_id, date)"),
+        ]
+    failed = [description for description, statement in steps if not run_step(description, statement)]
+    if failed:
+        print(f"Migration finished with {len(failed)} failed step(s).")
+    else:
         print("Migration complete.")
+    return not failed
 
 if __name__ == "__main__":
-    migrate()
+    sys.exit(0 if migrate() else 1)
@@ -0,0 +1,11 @@
+import asyncio
+import logging
+from app.services.notifier import Dispatcher
+
+# Runs the alert notification dispatcher as its own process:
+#   python run_notifier.py
+# Start more than one to increase delivery throughput; they share the outbox safely.
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(Dispatcher().run_forever())
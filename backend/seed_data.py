@@ -0,0 +1,348 @@
+import argparse
+import io
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import Pool
+import numpy as np
+import psycopg2
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from app.database import engine, SessionLocal, SQLALCHEMY_DATABASE_URL
+from app import models
+from app.auth import get_password_hash
+from app.services import indicators, snapshot
+from migrate_db import migrate
+
+# Seeds a database for performance work:
+#   1. restores the baseline dump shipped with the repo (stocks, sectors, fundamentals, a few users),
+#   2. drops the secondary indexes and foreign keys of the tables we fill,
+#   3. generates synthetic users, price history, transactions, watchlists and alerts with NumPy and
+#      loads them with COPY from several processes at once,
+#   4. rebuilds the indexes and constraints (in parallel) and runs ANALYZE.
+#
+# Examples:
+#   python seed_data.py                                    # 10k users, 1M transactions, 3 years
+#   python seed_data.py --users 100000 --transactions 50000000 --workers 8
+#   python seed_data.py --no-restore --users 1000          # add to the current database
+#
+# Everything is generated from --seed, so the same arguments give the same dataset.
+
+BASELINE_DUMP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "newBackup.backup")
+SEED_TABLES = ["users", "stock_prices", "transactions", "watchlist", "alerts"]
+SEED_PASSWORD = "password123"
+CHUNK_ROWS = 250_000
+# DSE trades Sunday to Thursday (Python weekdays: Monday = 0, Sunday = 6).
+TRADING_WEEKDAYS = {6, 0, 1, 2, 3}
+SELL_PROBABILITY = 0.4 # share of buy lots that are later (partly) sold
+
+def libpq_url():
+    # psycopg2 and pg_restore take a plain postgresql:// URL, without the SQLAlchemy driver name.
+    return make_url(SQLALCHEMY_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+def restore_baseline(path):
+    print(f"Restoring baseline from {path}...")
+    # Drop our tables first: tables newer than the dump (e.g. notifications) reference tables in it
+    # and would block pg_restore --clean.
+    models.Base.metadata.drop_all(bind=engine)
+    # pg_restore exits non-zero for harmless warnings (e.g. objects that didn't exist to drop).
+    subprocess.run(["pg_restore", "--clean", "--if-exists", "--no-owner", "--no-privileges",
+                    "--dbname", libpq_url(), path])
+    # Bring the restored schema up to date with the current models.
+    models.Base.metadata.create_all(bind=engine)
+    migrate()
+
+# --- Schema helpers ---
+
+def drop_constraints_and_indexes(conn):
+    # Returns the statements that recreate what was dropped. Primary keys stay (COPY is cheap with them
+    # and other tables reference them).
+    tables = list(SEED_TABLES)
+    foreign_keys = conn.execute(text(
+        "SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE contype = 'f' AND conrelid::regclass::text = ANY(:tables)"
+    ), {"tables": tables}).all()
+    indexes = conn.execute(text(
+        "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_class t ON t.oid = x.indrelid "
+        "WHERE t.relname = ANY(:tables) "
+        "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.oid)"
+    ), {"tables": tables}).all()
+
+    for table, name, _ in foreign_keys:
+        conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+    for name, _ in indexes:
+        conn.execute(text(f'DROP INDEX "{name}"'))
+    conn.commit()
+    print(f"Dropped {len(indexes)} indexes and {len(foreign_keys)} foreign keys")
+    return [definition for _, definition in indexes], \
+        [f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}' for table, name, definition in foreign_keys]
+
+def _run_statement(statement):
+    conn = psycopg2.connect(libpq_url())
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem = '512MB'")
+            cur.execute(statement)
+        conn.commit()
+    finally:
+        conn.close()
+
+def rebuild(index_statements, constraint_statements, workers):
+    # Indexes first (in parallel, one connection each), then the foreign keys, which can use them.
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_run_statement, index_statements))
+    for statement in constraint_statements:
+        _run_statement(statement)
+    print(f"Rebuilt indexes and constraints in {time.time() - started:.1f}s")
+
+def reset_sequences(conn):
+    for table in SEED_TABLES:
+        conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"
+        ))
+    conn.commit()
+
+# --- Synthetic data ---
+#
+# Distributions:
+#   prices        geometric random walk with a common market factor, per-stock beta and volatility,
+#                 and fat-tailed (Student t) daily shocks; each path ends at the stock's current price
+#   stock choice  Zipf-like popularity (a few stocks get most of the trading)
+#   user activity log-normal weights (most users trade rarely, a few trade a lot)
+#   trade size    log-normal amount of money per trade
+#   trade dates   more recent dates are more likely (a growing user base)
+
+class Context:
+    # Everything a worker needs, rebuilt from the seed in each process instead of being pickled.
+    def __init__(self, args, stocks, first_existing_day, id_bases):
+        self.args = args
+        self.id_bases = id_bases
+        rng = np.random.default_rng(args.seed)
+
+        self.stock_ids = np.array([s[0] for s in stocks], dtype=np.int64)
+        anchor = np.array([s[1] for s in stocks], dtype=np.float64)
+        n_stocks = len(stocks)
+
+        # Trading days before the first bar already in the database.
+        end = first_existing_day - timedelta(days=1)
+        days = [end - timedelta(days=i) for i in range(int(args.years * 365))]
+        self.days = np.array(sorted(d for d in days if d.weekday() in TRADING_WEEKDAYS), dtype="datetime64[D]")
+        n_days = len(self.days)
+
+        market = rng.normal(0.0003, 0.011, n_days)
+        beta = np.clip(rng.normal(1.0, 0.35, n_stocks), 0.1, 2.5)
+        volatility = rng.lognormal(np.log(0.016), 0.4, n_stocks)
+        shocks = rng.standard_t(4, (n_days, n_stocks)) / np.sqrt(2) # t(4) has variance 2
+        log_returns = market[:, None] * beta + shocks * volatility
+        path = np.cumsum(log_returns, axis=0)
+        self.close = np.round(anchor * np.exp(path - path[-1]), 1).clip(min=0.1)
+
+        self.popularity = 1.0 / np.arange(1, n_stocks + 1) ** 1.1
+        self.popularity = self.popularity[rng.permutation(n_stocks)]
+        self.popularity /= self.popularity.sum()
+        self.user_weights = rng.lognormal(0.0, 1.5, args.users)
+        self.user_weights /= self.user_weights.sum()
+
+        self.password_hash = get_password_hash(SEED_PASSWORD)
+
+_context = None
+
+def _init_worker(args, stocks, first_existing_day, id_bases):
+    global _context
+    _context = Context(args, stocks, first_existing_day, id_bases)
+
+def _copy(cur, table, columns, arrays):
+    # Tab separated text built column-wise by NumPy; one COPY per chunk.
+    lines = map("\t".join, zip(*[np.asarray(a).astype(str) for a in arrays]))
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", io.StringIO("\n".join(lines) + "\n"))
+    return len(arrays[0])
+
+def _users(rng, start, count):
+    ctx = _context
+    ids = ctx.id_bases["users"] + start + np.arange(count)
+    emails = np.char.add(np.char.add("seed_user_", ids.astype(str)), "@example.com")
+    return "users", ["id", "email", "hashed_password", "is_active"], \
+        [ids, emails, np.full(count, ctx.password_hash), np.full(count, "t")]
+
+def _stock_prices(rng, start, count):
+    # 'start'/'count' are a range of stocks here: one row per stock per day.
+    ctx = _context
+    close = ctx.close[:, start:start + count]
+    n_days = close.shape[0]
+    open_ = np.round(np.vstack([close[:1], close[:-1]]) * (1 + rng.normal(0, 0.004, close.shape)), 1)
+    spread = np.abs(rng.normal(0, 0.012, close.shape)) * close
+    high = np.round(np.maximum(open_, close) + spread, 1)
+    low = np.round(np.clip(np.minimum(open_, close) - spread, 0.1, None), 1)
+    # Popular stocks trade more, and every stock trades more on days it moves a lot.
+    base_volume = rng.lognormal(11, 1.2, count) * ctx.popularity[start:start + count] * len(ctx.popularity)
+    moves = np.abs(np.diff(np.log(close), axis=0, prepend=np.log(close[:1])))
+    volume = np.round(base_volume * rng.lognormal(0, 0.5, close.shape) * (1 + 20 * moves))
+
+    ids = ctx.id_bases["stock_prices"] + start * n_days + np.arange(close.size)
+    stock_ids = np.tile(ctx.stock_ids[start:start + count], n_days)
+    dates = np.repeat(ctx.days, count)
+    return "stock_prices", ["id", "stock_id", "date", "open", "high", "low", "close", "volume"], \
+        [ids, stock_ids, dates, open_.ravel(), high.ravel(), low.ravel(), close.ravel(), volume.ravel()]
+
+SESSION_START, SESSION_END = 4 * 3600, int(8.5 * 3600) # 10:00-14:30 Dhaka, in seconds of the UTC day
+
+def _session_seconds(rng, count, after=None):
+    # Random moments of the trading session, each later than 'after' (seconds) where given.
+    low = SESSION_START if after is None else np.maximum(SESSION_START, after + 1)
+    return low + (rng.random(count) * (SESSION_END + 1 - low)).astype(np.int64)
+
+def _timestamps(day_index, seconds):
+    return _context.days[day_index].astype("datetime64[s]") + seconds.astype("timedelta64[s]")
+
+def _transactions(rng, start, count):
+    # 'count' buy lots; about SELL_PROBABILITY of them get a later sell of part of the lot, so no
+    # user ever sells more than they bought.
+    ctx = _context
+    n_days, n_stocks = ctx.close.shape
+    users = ctx.id_bases["users"] + rng.choice(len(ctx.user_weights), count, p=ctx.user_weights)
+    stocks = rng.choice(n_stocks, count, p=ctx.popularity)
+    buy_day = np.minimum((n_days * np.sqrt(rng.random(count))).astype(np.int64), n_days - 1)
+    buy_price = np.round(ctx.close[buy_day, stocks] * (1 + rng.normal(0, 0.004, count)), 1).clip(min=0.1)
+    quantity = np.maximum(1, np.round(rng.lognormal(np.log(40000), 1.0, count) / buy_price))
+
+    sold = rng.random(count) < SELL_PROBABILITY
+    sell_day = buy_day[sold] + (rng.random(sold.sum()) * (n_days - buy_day[sold])).astype(np.int64)
+    sell_price = np.round(ctx.close[sell_day, stocks[sold]] * (1 + rng.normal(0, 0.004, sold.sum())), 1).clip(min=0.1)
+    sell_quantity = np.maximum(1, np.round(quantity[sold] * rng.uniform(0.2, 1.0, sold.sum())))
+    buy_time = _session_seconds(rng, count)
+    # A sell on the day of its buy comes later in the session.
+    sell_time = _session_seconds(rng, sold.sum(), np.where(sell_day == buy_day[sold], buy_time[sold], 0))
+
+    n = count + sold.sum()
+    ids = ctx.id_bases["transactions"] + 2 * start + np.arange(n) # 2 ids reserved per lot
+    return "transactions", ["id", "stock_id", "type", "quantity", "price", "date", "user_id"], [
+        ids,
+        np.concatenate([ctx.stock_ids[stocks], ctx.stock_ids[stocks[sold]]]),
+        np.concatenate([np.full(count, "BUY"), np.full(sold.sum(), "SELL")]),
+        np.concatenate([quantity, sell_quantity]),
+        np.concatenate([buy_price, sell_price]),
+        np.concatenate([_timestamps(buy_day, buy_time), _timestamps(sell_day, sell_time)]),
+        np.concatenate([users, users[sold]]),
+    ]
+
+def _per_user(rng, start, count, mean):
+    # (user ids, stock indexes) with a Poisson number of distinct, popularity weighted stocks per user.
+    ctx = _context
+    per_user = rng.poisson(mean, count)
+    users = ctx.id_bases["users"] + start + np.repeat(np.arange(count), per_user)
+    stocks = rng.choice(len(ctx.stock_ids), len(users), p=ctx.popularity)
+    _, unique = np.unique(users * len(ctx.stock_ids) + stocks, return_index=True)
+    return users[unique], stocks[unique]
+
+def _watchlist(rng, start, count):
+    ctx = _context
+    users, stocks = _per_user(rng, start, count, ctx.args.watchlist_per_user)
+    ids = ctx.id_bases["watchlist"] + start * 64 + np.arange(len(users))
+    return "watchlist", ["id", "stock_id", "user_id"], [ids, ctx.stock_ids[stocks], users]
+
+def _alerts(rng, start, count):
+    ctx = _context
+    users, stocks = _per_user(rng, start, count, ctx.args.alerts_per_user)
+    above = rng.random(len(users)) < 0.5
+    distance = rng.uniform(0.03, 0.2, len(users))
+    target = np.round(ctx.close[-1, stocks] * np.where(above, 1 + distance, 1 - distance), 1)
+    ids = ctx.id_bases["alerts"] + start * 64 + np.arange(len(users))
+    return "alerts", ["id", "stock_id", "target_price", "condition", "is_active", "user_id"], [
+        ids, ctx.stock_ids[stocks], target, np.where(above, "ABOVE", "BELOW"),
+        np.where(rng.random(len(users)) < 0.8, "t", "f"), users,
+    ]
+
+GENERATORS = {
+    "users": _users,
+    "stock_prices": _stock_prices,
+    "transactions": _transactions,
+    "watchlist": _watchlist,
+    "alerts": _alerts,
+}
+
+def _load_chunk(task):
+    kind, start, count = task
+    rng = np.random.default_rng([_context.args.seed, SEED_TABLES.index(kind), start])
+    table, columns, arrays = GENERATORS[kind](rng, start, count)
+    conn = psycopg2.connect(libpq_url())
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET synchronous_commit = off")
+            rows = _copy(cur, table, columns, arrays)
+        conn.commit()
+    finally:
+        conn.close()
+    return kind, rows
+
+def _chunks(kind, total, size):
+    return [(kind, start, min(size, total - start)) for start in range(0, total, size)]
+
+def seed(args):
+    with engine.connect() as conn:
+        stocks = conn.execute(text(
+            "SELECT s.id, COALESCE(NULLIF(md.ltp, 0), NULLIF(md.ycp, 0), 50) FROM stocks s "
+            "LEFT JOIN market_data md ON md.stock_id = s.id ORDER BY s.id"
+        )).all()
+        first_day = conn.execute(text("SELECT MIN(date) FROM stock_prices")).scalar() or date.today()
+        id_bases = {table: conn.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")).scalar()
+                    for table in SEED_TABLES}
+        if not stocks:
+            raise SystemExit("No stocks in the database. Restore the baseline first.")
+        index_statements, constraint_statements = drop_constraints_and_indexes(conn)
+
+    # Foreign keys are off during the load, so all tables load at once. The big transaction chunks go
+    # first to keep all workers busy until the end.
+    lots = int(args.transactions / (1 + SELL_PROBABILITY))
+    user_chunk = CHUNK_ROWS // 64 # watchlist/alerts reserve 64 ids per user in a chunk
+    stocks_per_chunk = max(1, CHUNK_ROWS // max(1, int(args.years * 260)))
+    tasks = _chunks("transactions", lots, CHUNK_ROWS // 2) \
+        + _chunks("stock_prices", len(stocks), stocks_per_chunk) \
+        + _chunks("users", args.users, CHUNK_ROWS) \
+        + _chunks("watchlist", args.users, user_chunk) \
+        + _chunks("alerts", args.users, user_chunk)
+
+    started = time.time()
+    totals = {}
+    with Pool(args.workers, initializer=_init_worker, initargs=(args, stocks, first_day, id_bases)) as pool:
+        for kind, rows in pool.imap_unordered(_load_chunk, tasks):
+            totals[kind] = totals.get(kind, 0) + rows
+            print(f"\r{', '.join(f'{k}: {v:,}' for k, v in totals.items())}", end="", flush=True)
+    print(f"\nLoaded in {time.time() - started:.1f}s")
+
+    rebuild(index_statements, constraint_statements, args.workers)
+    with engine.connect() as conn:
+        reset_sequences(conn)
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("ANALYZE"))
+
+    # Derived data, as after a market data import.
+    db = SessionLocal()
+    try:
+        indicators.recompute(db)
+        snapshot.publish_from_db(db)
+    finally:
+        db.close()
+    print(f"Done. Seeded users can log in with password '{SEED_PASSWORD}'.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Restore the baseline and generate a synthetic dataset")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--transactions", type=int, default=1_000_000, help="approximate number of rows")
+    parser.add_argument("--years", type=float, default=3, help="years of daily bars before the existing ones")
+    parser.add_argument("--watchlist-per-user", type=float, default=4)
+    parser.add_argument("--alerts-per-user", type=float, default=1.5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE_DUMP, help="pg_dump archive to restore first")
+    parser.add_argument("--no-restore", action="store_true", help="keep the current data and add to it")
+    args = parser.parse_args()
+
+    if not args.no_restore:
+        restore_baseline(args.baseline)
+    seed(args)
+
+if __name__ == "__main__":
+    main()
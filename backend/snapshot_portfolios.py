@@ -0,0 +1,37 @@
+import argparse
+import logging
+from datetime import date
+from app.database import SessionLocal
+from app.services import portfolio_snapshots
+
+# End-of-day portfolio snapshots (see app/services/portfolio_snapshots.py).
+#   python snapshot_portfolios.py                                   # today, run it after the market closes
+#   python snapshot_portfolios.py --date 2024-05-02                 # redo one day
+#   python snapshot_portfolios.py --backfill                        # every trading day since the first trade
+#   python snapshot_portfolios.py --backfill --start 2024-01-01 --end 2024-03-31
+#
+# Every run is idempotent: a day that was already snapshotted is overwritten. The same work can be
+# queued for worker.py as a "portfolio_snapshots" job.
+
+def main():
+    parser = argparse.ArgumentParser(description="Value every portfolio at the close")
+    parser.add_argument("--date", type=date.fromisoformat, help="day to snapshot (default: today)")
+    parser.add_argument("--backfill", action="store_true", help="snapshot a range of trading days")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day of the backfill (default: first trade)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day of the backfill (default: today)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    db = SessionLocal()
+    try:
+        if args.backfill:
+            result = portfolio_snapshots.backfill(db, args.start, args.end)
+            print(f"Snapshotted {result['days']} days ({result['rows']} rows)")
+        else:
+            rows = portfolio_snapshots.snapshot_day(db, args.date)
+            print(f"Snapshotted {rows} portfolios for {args.date or date.today()}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app import crud, models
+from app.database import Base
+from app.services import notifier
+
+# Alerts fire once per crossing and their notifications are delivered once, whatever the
+# number of scrapes and dispatcher runs in between.
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+# trigger_alerts (UPDATE ... FROM ... RETURNING) and the dispatcher (SKIP LOCKED) need Postgres.
+@pytest.fixture
+def session_factory(monkeypatch):
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    engine = create_engine(TEST_DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(crud, "NOTIFICATION_CHANNELS", ["memory"])
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    Base.metadata.drop_all(bind=engine)
+    engine.dispose()
+
+def _add_stock(db, code, ltp):
+    stock = models.Stock(trading_code=code, name=code)
+    db.add(stock)
+    db.flush()
+    db.add(models.MarketData(stock_id=stock.id, ltp=ltp, high=ltp, low=ltp, close=ltp, ycp=ltp,
+                             change=0.0, trade=0.0, value=0.0, volume=0.0))
+    return stock
+
+def test_alert_delivered_exactly_once_and_untraded_stocks_skipped(session_factory):
+    db = session_factory()
+    user = models.User(email="alerts@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    traded = _add_stock(db, "GP", 300.0)
+    untraded = _add_stock(db, "BATBC", 0.0) # no trades today: the scraper stores ltp 0
+    db.add_all([
+        models.Alert(user_id=user.id, stock_id=traded.id, target_price=250.0, condition=models.AlertCondition.ABOVE),
+        models.Alert(user_id=user.id, stock_id=untraded.id, target_price=500.0, condition=models.AlertCondition.BELOW),
+    ])
+    db.commit()
+
+    sink = notifier.MemorySink()
+    dispatcher = notifier.Dispatcher(sinks={"memory": sink}, session_factory=session_factory)
+    for _ in range(3): # repeated scrapes at the same prices
+        crud.trigger_alerts(db)
+        asyncio.run(dispatcher.run_once())
+
+    assert len(sink.sent) == 1
+    user_id, payloads = sink.sent[0]
+    assert user_id == user.id
+    assert [p["trading_code"] for p in payloads] == ["GP"]
+    alerts = {a.stock_id: a.is_active for a in db.query(models.Alert).all()}
+    assert alerts == {traded.id: False, untraded.id: True}
+    assert db.query(models.Notification).filter(
+        models.Notification.status == models.NotificationStatus.SENT).count() == 1
+    db.close()
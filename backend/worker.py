@@ -0,0 +1,167 @@
+import argparse
+import logging
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from app.database import SessionLocal
+from app.services import jobs
+
+# Background job worker:
+#   python worker.py                              # all job kinds, one process per CPU
+#   python worker.py --kinds scrape --processes 1
+#   python worker.py --kinds import_fundamentals,recompute_indicators --processes 4
+#
+# The main process claims jobs from the jobs table (see app/services/jobs.py), keeps their leases
+# alive and records the outcome. The jobs themselves run in a process pool, so CPU-heavy parsing never
+# competes with the API workers, and heavy kinds can get their own worker processes. Any number of
+# workers can run against the same database, on any number of hosts.
+
+POLL_SECONDS = 2.0
+logger = logging.getLogger("worker")
+
+# --- Job handlers (run inside the pool processes, each opens its own DB session) ---
+
+def run_scrape(payload):
+    from app.services import scraper
+    db = SessionLocal()
+    try:
+        return {"snapshot_version": scraper.scrape_dse_data(db)}
+    finally:
+        db.close()
+
+def run_import_fundamentals(payload):
+    from import_market_data import import_data
+    # Paths were checked when the job was queued; check again, the payload is just data in the table.
+    count = import_data(jobs.import_path(payload["path"]) if payload.get("path") else None)
+    if count is None:
+        raise RuntimeError("Import failed, see the worker log")
+    return {"stocks": count}
+
+def run_recompute_indicators(payload):
+    from app.services import indicators, snapshot
+    db = SessionLocal()
+    try:
+        updated = indicators.recompute(db)
+        snapshot.publish_from_db(db)
+        return {"stocks": updated}
+    finally:
+        db.close()
+
+def run_portfolio_snapshots(payload):
+    # {} for today, {"date": "YYYY-MM-DD"} for one day, {"start": ..., "end": ...} to backfill a range.
+    from datetime import date
+    from app.services import portfolio_snapshots
+    db = SessionLocal()
+    try:
+        if "start" in payload or "end" in payload:
+            start, end = payload.get("start"), payload.get("end")
+            return portfolio_snapshots.backfill(db, start and date.fromisoformat(start), end and date.fromisoformat(end))
+        day = date.fromisoformat(payload["date"]) if "date" in payload else None
+        return {"rows": portfolio_snapshots.snapshot_day(db, day)}
+    finally:
+        db.close()
+
+def run_backfill_history(payload):
+    # {"directory": "/path/to/archive"}; resumes from the directory's checkpoint after a retry.
+    from backfill_history import backfill
+    return backfill(jobs.import_path(payload["directory"]), payload.get("workers"), restart=payload.get("restart", False))
+
+HANDLERS = {
+    "scrape": run_scrape,
+    "import_fundamentals": run_import_fundamentals,
+    "recompute_indicators": run_recompute_indicators,
+    "portfolio_snapshots": run_portfolio_snapshots,
+    "backfill_history": run_backfill_history,
+}
+
+def run_job(kind, payload):
+    return HANDLERS[kind](payload or {})
+
+# --- Main loop ---
+
+def _claim(owner, limit, kinds):
+    db = SessionLocal()
+    try:
+        return jobs.claim(db, owner, limit, kinds)
+    finally:
+        db.close()
+
+def _renew(owner, job_ids):
+    db = SessionLocal()
+    try:
+        jobs.renew(db, owner, job_ids)
+    finally:
+        db.close()
+
+def _finish(job_id, owner, result=None, error=None):
+    db = SessionLocal()
+    try:
+        jobs.finish(db, job_id, owner, result=result, error=error)
+    finally:
+        db.close()
+
+def _new_pool(processes):
+    # "spawn": pool processes start clean instead of inheriting this process's DB connections.
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs")
+    parser.add_argument("--kinds", help="comma separated job kinds to run (default: all)")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    kinds = args.kinds.split(",") if args.kinds else list(HANDLERS)
+
+    logging.basicConfig(level=logging.INFO)
+    owner = jobs.worker_id()
+    logger.info(f"Worker {owner} started ({args.processes} processes, kinds: {', '.join(kinds)})")
+
+    running = {} # future -> job id
+    renewed_at = time.monotonic()
+    pool = _new_pool(args.processes)
+    while True:
+        free = args.processes - len(running)
+        if free > 0:
+            try:
+                for job in _claim(owner, free, kinds):
+                    logger.info(f"Job {job.id} ({job.kind}) started, attempt {job.attempts + 1}")
+                    running[pool.submit(run_job, job.kind, job.payload)] = job.id
+            except Exception as e:
+                logger.error(f"Could not claim jobs: {e}")
+
+        done = set()
+        if running:
+            done, _ = wait(running, timeout=POLL_SECONDS, return_when=FIRST_COMPLETED)
+        else:
+            time.sleep(POLL_SECONDS)
+
+        broken = False
+        for future in done:
+            job_id = running.pop(future)
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, "".join(traceback.format_exception(e))
+                broken = broken or isinstance(e, BrokenProcessPool)
+            try:
+                _finish(job_id, owner, result=result, error=error)
+            except Exception as e:
+                logger.error(f"Could not record the outcome of job {job_id}: {e}")
+        if broken:
+            # A pool process died (e.g. killed for memory); every job in the pool fails with it and
+            # goes back to the queue. Start a fresh pool.
+            logger.error("Process pool broke, restarting it")
+            pool.shutdown(wait=False, cancel_futures=True)
+            pool = _new_pool(args.processes)
+
+        # Renew the leases of long jobs well before they run out.
+        if running and time.monotonic() - renewed_at > jobs.LEASE_SECONDS / 3:
+            try:
+                _renew(owner, list(running.values()))
+            except Exception as e:
+                logger.error(f"Could not renew leases: {e}")
+            renewed_at = time.monotonic()
+
+if __name__ == "__main__":
+    main()